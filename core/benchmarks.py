@@ -0,0 +1,434 @@
+"""
+Benchmarks of the ingest, object counter and read paths.
+
+``manage.py benchmark`` (``just bench``) runs them on a throwaway test
+database, filled by the synthetic data generators below, and prints the
+results as one JSON document. Save it per commit and compare the
+``rows_per_sec`` / ``objects_per_sec`` and latency percentiles of two runs.
+
+The synthetic services have ``fields`` columns cycling through the form
+types, so every form table gets its share of the cells. The bizrule ingest
+reads them from a local stub API, paginated like Scryfall, so the numbers
+cover the fetch, convert and write pipeline without the network.
+"""
+import contextlib
+import datetime
+import io
+import json
+import math
+import multiprocessing
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import django
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from core import response_cache
+from core.biz_rule import _write_source
+from core.fetchers import ScryfallFetcher
+from core.http_client import HTTPClient
+from core.ingest import Column, bulk_ingest
+from core.instrumentation import record_queries
+from core.mapping import FieldMapping, SourceMapping, iso_date
+from core.models import FORM_TYPE_MAP, Field, Object, Service, service_names
+
+# records per page of the stub API
+PAGE_SIZE = 175
+
+
+class BenchmarkConfig(NamedTuple):
+    # rows x fields of the synthetic services, the fields cycle through form_types
+    rows: int = 1000
+    fields: int = 8
+    form_types: tuple = tuple(FORM_TYPE_MAP)
+    # rows of the services listed through /objects/
+    sizes: tuple = (1000, 10000, 100000)
+    # concurrent Object.save callers, each saving objects_per_worker objects
+    threads: int = 4
+    processes: int = 4
+    objects_per_worker: int = 250
+    # timed calls per latency measurement
+    samples: int = 100
+    batch_size: Optional[int] = None
+
+
+# synthetic data
+
+
+def synthetic_columns(fields: int, form_types=tuple(FORM_TYPE_MAP)) -> list[Column]:
+    return [
+        Column(f"Field{i}", f"Synthetic {form_type.lower()} field", form_type)
+        for i, form_type in ((i, form_types[i % len(form_types)]) for i in range(fields))
+    ]
+
+
+def synthetic_value(form_type: str, row: int, column: int) -> Any:
+    """A value of ``form_type``, varying with the row so the value indexes aren't degenerate."""
+    n = row * 31 + column
+
+    if form_type == Field.CHAR:
+        return f"Value {n % 997}"
+
+    if form_type == Field.TEXT:
+        return f"Row {row} of column {column}. " + "Lorem ipsum dolor sit amet. " * (1 + n % 4)
+
+    if form_type == Field.INTEGER:
+        return n % 10007
+
+    if form_type == Field.FLOAT:
+        return n / 7
+
+    if form_type == Field.BOOLEAN:
+        return n % 2 == 0
+
+    if form_type == Field.DATE:
+        return datetime.date(2000, 1, 1) + datetime.timedelta(days=n % 9000)
+
+    if form_type == Field.URL:
+        return f"https://example.com/items/{row}/{column}"
+
+    raise ValueError(f"Unknown form type {form_type}")
+
+
+def synthetic_rows(columns: list[Column], count: int, start: int = 0) -> Iterator[dict]:
+    """Rows keyed by column name, with the upstream identity under ``key``."""
+    for row in range(start, start + count):
+        values = {column.name: synthetic_value(column.form_type, row, i) for i, column in enumerate(columns)}
+
+        yield {"key": f"row-{row}", **values}
+
+
+def synthetic_mapping(service: str, columns: list[Column]) -> SourceMapping:
+    # the stub API sends the dates as ISO strings, like the real ones
+    return SourceMapping(
+        service=service,
+        description="Synthetic benchmark service",
+        key="key",
+        fields=[
+            FieldMapping(
+                column.name,
+                column.description,
+                column.form_type,
+                column.name,
+                iso_date if column.form_type == Field.DATE else None,
+            )
+            for column in columns
+        ],
+    )
+
+
+def synthetic_service(name: str, rows: int, columns: list[Column], batch_size: Optional[int] = None) -> Service:
+    service = Service.objects.create(name=name, description="Synthetic benchmark service")
+    bulk_ingest(service, columns, synthetic_rows(columns, rows), batch_size)
+    service_names.refresh()
+
+    return service
+
+
+# stub API
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        page = int(parse_qs(urlsplit(self.path).query).get("page", ["0"])[0])
+        body = json.dumps(self.server.page(page), default=str).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubAPIServer(ThreadingHTTPServer):
+    """Serves the synthetic rows of ``columns`` as ``has_more`` / ``next_page`` pages."""
+
+    daemon_threads = True
+
+    def __init__(self, columns: list[Column], rows: int, page_size: int = PAGE_SIZE):
+        super().__init__(("127.0.0.1", 0), StubAPIHandler)
+        self.columns = columns
+        self.rows = rows
+        self.page_size = page_size
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+
+        return f"http://{host}:{port}/records"
+
+    def page(self, number: int) -> dict:
+        start = number * self.page_size
+        count = max(0, min(self.page_size, self.rows - start))
+        has_more = start + count < self.rows
+
+        return {
+            "data": list(synthetic_rows(self.columns, count, start)),
+            "has_more": has_more,
+            "next_page": f"{self.url}?page={number + 1}" if has_more else None,
+        }
+
+
+@contextlib.contextmanager
+def stub_api(columns: list[Column], rows: int) -> Iterator[StubAPIServer]:
+    server = StubAPIServer(columns, rows)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield server
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+# measurements
+
+
+def latency(samples: list[float]) -> dict:
+    """Mean and nearest rank percentiles of ``samples`` (seconds) in milliseconds."""
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return round(ordered[max(0, math.ceil(p * len(ordered)) - 1)] * 1000, 3)
+
+    return {
+        "samples": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": percentile(1.0),
+    }
+
+
+def throughput(count: int, seconds: float, unit: str = "rows") -> dict:
+    return {unit: count, "seconds": round(seconds, 3), f"{unit}_per_sec": round(count / seconds, 1) if seconds else None}
+
+
+def bench_ingest(config: BenchmarkConfig) -> dict:
+    """The bizrule import of a new catalogue, then of the same one again (nothing to write)."""
+    columns = synthetic_columns(config.fields, config.form_types)
+    mapping = synthetic_mapping("benchmarkIngest", columns)
+    results = {}
+
+    with stub_api(columns, config.rows) as server:
+        for run in ("created", "unchanged"):
+            fetcher = ScryfallFetcher(client=HTTPClient())
+            fetcher.url = server.url
+            output = io.StringIO()
+            start = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=1) as executor, record_queries(run) as queries:
+                fetcher.start(executor)
+
+                # the fetcher and the bizrule print their progress
+                with contextlib.redirect_stdout(output):
+                    result = _write_source("benchmark", mapping, fetcher.cursor_records(), config.batch_size)
+
+            if result is None:
+                raise RuntimeError(f"The benchmark ingest failed:\n{output.getvalue()}")
+
+            results[run] = {
+                **throughput(config.rows, time.perf_counter() - start),
+                "queries": queries.count,
+                "result": result._asdict(),
+            }
+
+    return results
+
+
+def _save_objects(service_id: int, count: int) -> float:
+    # one Object.save (a counter allocation and an insert) after the other, on this worker's own connection
+    service = Service.objects.get(pk=service_id)
+    start = time.perf_counter()
+
+    try:
+        for _ in range(count):
+            Object(service=service).save()
+
+        return time.perf_counter() - start
+
+    finally:
+        connection.close()
+
+
+def bench_counters(config: BenchmarkConfig) -> dict:
+    """``Object.save`` throughput with the counter allocation contended by threads, then processes."""
+    service = Service.objects.create(name="benchmarkCounters", description="Synthetic benchmark service")
+    results = {}
+
+    for mode, workers in (("threads", config.threads), ("processes", config.processes)):
+        if not workers:
+            continue
+
+        if mode == "processes" and (
+            connection.vendor == "sqlite" and connection.is_in_memory_db()
+            or "fork" not in multiprocessing.get_all_start_methods()
+        ):
+            # forked workers need a database they can reach, and the settings of this one
+            results[mode] = {"skipped": "needs a file or server database and fork"}
+            continue
+
+        before = Object.objects.filter(service=service).count()
+        start = time.perf_counter()
+
+        if mode == "threads":
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(_save_objects, [service.pk] * workers, [config.objects_per_worker] * workers))
+
+        else:
+            # the forked workers would share this process' connections otherwise
+            connections.close_all()
+
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                pool.starmap(_save_objects, [(service.pk, config.objects_per_worker)] * workers)
+
+        seconds = time.perf_counter() - start
+        count = workers * config.objects_per_worker
+        counters = Object.objects.filter(service=service).values("object_counter")
+
+        results[mode] = {
+            "workers": workers,
+            **throughput(count, seconds, "objects"),
+            # every object got a counter of its own
+            "unique_counters": counters.distinct().count() == before + count,
+        }
+
+    return results
+
+
+def bench_load(config: BenchmarkConfig) -> dict:
+    """``Object.load`` latency of human IDs spread over a service."""
+    columns = synthetic_columns(config.fields, config.form_types)
+    service = synthetic_service("benchmarkLoad", config.rows, columns, config.batch_size)
+    counters = list(Object.objects.filter(service=service).order_by("object_counter").values_list("object_counter", flat=True))
+    step = max(1, len(counters) // config.samples)
+    samples = []
+
+    for counter in counters[::step][: config.samples]:
+        start = time.perf_counter()
+        Object.load(f"{service.name}-{counter}")
+        samples.append(time.perf_counter() - start)
+
+    return latency(samples)
+
+
+def bench_customer_api(config: BenchmarkConfig) -> dict:
+    """``CustomerAPI.post`` throughput creating ``rows`` objects, then updating them."""
+    columns = synthetic_columns(config.fields, config.form_types)
+    client = Client()
+    service = "benchmarkCustomerApi"
+    results = {}
+
+    def payload(human_ids: Optional[list[str]] = None) -> dict:
+        objects = []
+
+        for i, row in enumerate(synthetic_rows(columns, config.rows)):
+            fields = [{"name": column.name, "type": column.form_type, "value": row[column.name]} for column in columns]
+            objects.append({"fields": fields} if human_ids is None else {"human_id": human_ids[i], "fields": fields})
+
+        return {"service": service, "objects": objects}
+
+    for run in ("created", "updated"):
+        human_ids = None
+
+        if run == "updated":
+            objects = Object.objects.filter(service__name=service).select_related("service").order_by("object_counter")
+            human_ids = [obj.human_id for obj in objects]
+
+        data = payload(human_ids)
+        start = time.perf_counter()
+        response = client.post(reverse("customer_api") + "?ids=false", data=data, content_type="application/json")
+        seconds = time.perf_counter() - start
+
+        if response.status_code != 200:
+            raise RuntimeError(f"The customer API answered {response.status_code}: {response.content[:500]!r}")
+
+        results[run] = {**throughput(config.rows, seconds), "queries": response.json()["result"].get("queries")}
+
+    return results
+
+
+def bench_object_list(config: BenchmarkConfig) -> dict:
+    """``/objects/`` first page latency per service size, rendered and from the response cache."""
+    columns = synthetic_columns(config.fields, config.form_types)
+    client = Client()
+    results = {}
+
+    for size in config.sizes:
+        service = synthetic_service(f"benchmarkList{size}", size, columns, config.batch_size)
+        url = reverse("object-list")
+        samples = {"uncached": [], "cached": []}
+
+        for _ in range(config.samples):
+            for cached in (False, True):
+                if not cached:
+                    response_cache.bump(service.pk)
+
+                start = time.perf_counter()
+                response = client.get(url, {"service": service.name})
+                samples["cached" if cached else "uncached"].append(time.perf_counter() - start)
+
+                if response.status_code != 200:
+                    raise RuntimeError(f"/objects/ answered {response.status_code}")
+
+        results[str(size)] = {kind: latency(times) for kind, times in samples.items()}
+
+    return results
+
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "counters": bench_counters,
+    "load": bench_load,
+    "customer_api": bench_customer_api,
+    "object_list": bench_object_list,
+}
+
+
+def _commit() -> Optional[str]:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    return None
+
+
+def run(config: BenchmarkConfig, names: Optional[list[str]] = None) -> dict:
+    """Runs the benchmarks (all of them by default) on the current database."""
+    results = {}
+    started = datetime.datetime.now(datetime.timezone.utc)
+    run_start = time.perf_counter()
+
+    for name in names or BENCHMARKS:
+        start = time.perf_counter()
+        results[name] = BENCHMARKS[name](config)
+        results[name]["elapsed_s"] = round(time.perf_counter() - start, 3)
+
+    return {
+        "commit": _commit(),
+        "started": started.isoformat(timespec="seconds"),
+        "elapsed_s": round(time.perf_counter() - run_start, 3),
+        "python": sys.version.split()[0],
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "database": connection.vendor,
+        "config": config._asdict(),
+        "results": results,
+    }
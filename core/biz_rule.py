@@ -1,335 +1,159 @@
-import requests
-from core.models import (
-    Service,
-    Field,
-    Object,
-    Form,
-    TextForm,
-    IntegerForm,
-    FloatForm,
-    BooleanForm,
-    DateForm,
-    URLForm,
-    CharacterForm,
-)
-from datetime import datetime
-from django.db import transaction
+from core.http_cache import DEFAULT_MAX_SIZE, HTTPCache
+from core.http_client import shared_client
+from core.instrumentation import log_summary, record_queries
+from core.ingest import SyncResult, begin_import, legacy_objects, resumable_checkpoint, sync_ingest_columns
+from core.mapping import SourceMapping
+from core.models import ImportCheckpoint, Service
+from core.pipeline import Pipeline
+from core.purge import purge_all, purge_services
+from core.sources import SOURCE_MODULES
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from functools import partial
+from typing import Iterable, Optional
+from django.conf import settings
 
 # show detailed error messages
 import traceback
 
-# The secret should be added to gitignore, but keep it here for running the code
-from core.secret import api_key
-import hashlib
-
 
 # empty all the data in the database, clean the envs
 def _empty_all():
-    form_list = [
-        TextForm,
-        IntegerForm,
-        FloatForm,
-        BooleanForm,
-        DateForm,
-        URLForm,
-        CharacterForm,
-    ]
-    for form in form_list:
-        form.objects.all().delete()
-    Field.objects.all().delete()
-    Object.objects.all().delete()
-    Service.objects.all().delete()
+    _, counts = purge_all()
+    print(f"Deleted {counts}")
 
 # manual error handling function, delete the created objects if an error happens
 def _disater_recovery(created_service_name: str):
-    # deleted service
-    service = Service.objects.get(name=created_service_name)
-    form_list = [
-        TextForm,
-        IntegerForm,
-        FloatForm,
-        BooleanForm,
-        DateForm,
-        URLForm,
-        CharacterForm,
-    ]
-    object_list = Object.objects.filter(service=service)  # row list
-    for obj in object_list:
-        for form in form_list:
-            form.objects.filter(object=obj).delete()
-        obj.delete()
-    Field.objects.filter(service=service).delete()
-    service.delete()
-
-# convert date from "YYYY/MM/DD" to "YYYY-MM-DD"
-def _date_converter(date_str):
-    parsed = datetime.strptime(date_str, "%Y/%m/%d")
-    formatted = parsed.strftime("%Y-%m-%d")
-    return formatted
-
-# map the form type to the corresponding form class
-FORM_TYPE_MAP = {
-    Field.CHAR: CharacterForm,
-    Field.TEXT: TextForm,
-    Field.INTEGER: IntegerForm,
-    Field.FLOAT: FloatForm,
-    Field.BOOLEAN: BooleanForm,
-    Field.DATE: DateForm,
-    Field.URL: URLForm,
-}
+    # deleted service, with its rows (objects), cells (forms) and fields
+    _, counts = purge_services(Service.objects.filter(name=created_service_name))
+    print(f"Deleted {counts}")
+
+# reuse the service of an earlier run, so its objects (and their human IDs) are kept
+def _get_or_create_service(name: str, description: str) -> tuple[Service, bool]:
+    service = Service.objects.filter(name=name).order_by("id").first()
+
+    if service is not None:
+        return service, False
+
+    return Service.objects.create(name=name, description=description), True
+
+# write the records of a source to its service, only the delta since the last run.
+# Every batch is committed with a checkpoint and readers keep seeing the previous import until
+# the whole source is written. If an error happens the checkpoint is left for --resume, only a
+# service created in this round without a single committed batch is deleted (manual error handling)
+def _write_source(
+    name: str, mapping: SourceMapping, records: Iterable[tuple[dict, dict]], batch_size=None, resume=False
+) -> Optional[SyncResult]:
+    created = False
 
-# add a field value to the corresponding form table
-def _add_field_value(obj: Object, field: Field, value):
-    form_cls: Form = FORM_TYPE_MAP[field.form_type]
-    # Simply using this line give creates a new field every time in the service
-    form_cls.objects.create(object=obj, field=field, value=value)
-
-# add a field to the service, and add the corresponding value to the object
-def _add_field(
-    obj: Object,
-    service: Service,
-    name: str,
-    description: str,
-    form_type: str,
-    value: str,
-) -> Field:
-    # Simply using this line give creates a new field every time in the service
-    # field = Field.objects.create(
-    field = Field.objects.get_or_create(
-        service=service, name=name, description=description, form_type=form_type
-    )
-    # if the field already exists, get_or_create returns a tuple (field, true/false)
-    field = field[0]
-    _add_field_value(obj=obj, field=field, value=value)
-
-
-@transaction.atomic # if any error happens, rollback everything in this function (automatic error handling)
-
-# get data from the pokemon API and store it in the database
-def _pokemon_data():
-    # This url gets a list of all pokemon card sets
-    pokemon_api_key = api_key.get("pokemon_key", "")
-    base_pokemon_url = "https://api.pokemontcg.io/v2/sets"
-
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Api-Key": pokemon_api_key,
-    }
-    # make the request to get the data
-    response = requests.get(f"{base_pokemon_url}", headers=headers)
-    print(f"Finished API Call, {str(response.status_code)}")
-
-    # create a service, in the models.py given the hierarchy of the classes. The server is like a datatable
-    service = Service.objects.create(
-        name="pokemonSetCollection",
-        description="Collection of pokemon Card Sets",
-    )
-    created_objects = []
-    for pokemon_set in response.json()["data"]:
-        # create an object for each pokemon set, like a row in the datatable
-        obj = Object(service=service)
-        obj.save()
-        created_objects.append(obj.human_id)
-        # add fields to the object, like columns in the datatable
-        _add_field(
-            obj=obj,
-            service=service,
-            name="SetName",
-            description="Name of the pokemon set",
-            form_type=Field.TEXT,
-            value=pokemon_set.get("name", ""),
-        )
-        _add_field(
-            obj=obj,
-            service=service,
-            name="Series",
-            description="Series of the pokemon set",
-            form_type=Field.TEXT,
-            value=pokemon_set.get("series", ""),
-        )
-        _add_field(
-            obj=obj,
-            service=service,
-            name="TotalCards",
-            description="Total number of cards in the set",
-            form_type=Field.INTEGER,
-            value=pokemon_set.get("printedTotal", 0),
-        )
-        _add_field(
-            obj=obj,
-            service=service,
-            name="ReleaseDate",
-            description="Release date of the pokemon set",
-            form_type=Field.DATE,
-            value=_date_converter(pokemon_set.get("releaseDate", "")),
-        )
-        _add_field(
-            obj=obj,
-            service=service,
-            name="symbol",
-            description="Pokemon set symbol URL",
-            form_type=Field.URL,
-            value=pokemon_set.get("images", {"symbol": ""}).get("symbol", ""),
-        )
-        # raise Exception("Testisng error handling")
-
-# get data from the marvel API and store it in the database
-def _marvel_data(): # manual error handling
-    # variables for the API call
-    # URL, API KEY
-    comics_marvel_url = "https://gateway.marvel.com/v1/public/comics"
-    public_key = api_key.get("marvel_public_key", "")
-    private_key = api_key.get("marvel_private_key", "")
-    ts = str(datetime.now().timestamp())
-
-    # hash — a md5 digest of the ts parameter, your private key and your public key (e.g, md5(ts+privateKey+publicKey)
-    hash_input = ts + private_key + public_key
-    hash_result = hashlib.md5(hash_input.encode()).hexdigest()
-    params = {"apikey": public_key, "ts": ts, "hash": hash_result}
-
-    headers = {
-        "Content-Type": "application/json", 
-        "Accept": "application/json"
-        }
-
-    # make the request to get the data
-    response = requests.get(f"{comics_marvel_url}", headers=headers, params=params)
-    print(f"Finished API Call, {str(response.status_code)}")
-
-    # create a service, which is the virutal table
-    service_name = "MarvelComicCollection"
-    try:
-        service = Service.objects.create(
-            name=service_name,
-            description="Collection of Marvel Comics books",
-        )
-
-        created_objects = []
-        for marvel_comic in response.json()["data"]["results"]:
-            # create an object for each marvel comic book, like a row in the datatable
-            obj = Object(service=service)
-            obj.save()
-            created_objects.append(obj.human_id)
-            # add fields to the object, like columns in the datatable
-            _add_field(
-                obj=obj,
-                service=service,
-                name="title",
-                description="Name of the Marvel comic book",
-                form_type=Field.TEXT,
-                value=marvel_comic.get("title", ""),
-            )
-            _add_field(
-                obj=obj,
-                service=service,
-                name="pageCount",
-                description="The number of pages of the Marvel comic book",
-                form_type=Field.INTEGER,
-                value=marvel_comic.get("pageCount", ""),
-            )
-            _add_field(
-                obj=obj,
-                service=service,
-                name="resourceURI",
-                description="The resource URI of the Marvel comic book",
-                form_type=Field.URL,
-                value=marvel_comic.get("resourceURI", ""),
-            )
-            _add_field(
-                obj=obj,
-                service=service,
-                name="price",
-                description="The print price of the Marvel comic book",
-                form_type=Field.FLOAT,
-                value=[
-                    price
-                    for price in marvel_comic["prices"]
-                    if price["type"] == "printPrice"
-                ][0].get("price", 0.0),
-            )
-            # uncomment the following line to test error handling
-            # raise Exception("Testing error handling")
-    except Exception as e:
-        print(traceback.format_exc())
-        # only delete the created objects in this round if an error occurs
-        _disater_recovery(created_service_name=service_name)
-
-# get data from the scryfall API and store it in the database
-def _scryfall_data():
-    sets_scryfall_url = "https://api.scryfall.com/sets"
-    headers = {
-        "Content-Type": "*/*",
-        "Accept": "application/json",
-        "User-Agent": "insomnia/11.6.0",
-    }
-
-    # make the request to get the data
-    response = requests.get(f"{sets_scryfall_url}", headers=headers)
-    print(f"Finished API Call, {str(response.status_code)}")
-
-    # create a service, in the models.py given the hierarchy of the classes. The server is like a datatable
-    service_name = "scryfallSets"
     try:
-        service = Service.objects.create(
-            name=service_name,
-            description="List of all Scryfall Card Sets",
-        )
-        created_objects = []
-        for scryfall_set in response.json()["data"]:
-             # create an object for each scryfall set, like a row in the datatable
-            obj = Object(service=service)
-            obj.save()
-            created_objects.append(obj.human_id)
-            # add fields to the object, like columns in the datatable
-            _add_field(
-                obj=obj,
-                service=service,
-                name="SetName",
-                description="Name of the scryfall set",
-                form_type=Field.TEXT,
-                value=scryfall_set.get("name", ""),
-            )
+        service, created = _get_or_create_service(mapping.service, mapping.description)
+        checkpoint = begin_import(service, name, resume)
 
-            _add_field(
-                obj=obj,
-                service=service,
-                name="SetType",
-                description="Type of the scryfall set",
-                form_type=Field.TEXT,
-                value=scryfall_set.get("set_type", ""),
-            )
+        if checkpoint.rows:
+            print(f"{name}: resuming after {checkpoint.rows} rows, at {checkpoint.last_natural_key}")
 
-            _add_field(
-                obj=obj,
-                service=service,
-                name="CardCount",
-                description="Total number of cards in the set",
-                form_type=Field.INTEGER,
-                value=scryfall_set.get("card_count", 0),
-            )
+        # rows of a database populated before the imports had natural keys, see HELP.md
+        if legacy := legacy_objects(service).count():
+            print(f"Warning: {mapping.service} has {legacy} rows without a natural key, this import replaces them")
+
+        # the converter is compiled once per run and fills the columns of a whole batch at a time,
+        # fetching and converting run on their own threads while this one writes
+        converter = mapping.compile()
+        pipeline = Pipeline(records, converter, batch_size, cursors=True)
 
-            _add_field(
-                obj=obj,
-                service=service,
-                name="ReleaseDate",
-                description="Release date of the scryfall set",
-                form_type=Field.DATE,
-                value=scryfall_set.get("released_at", ""),
+        with record_queries(f"bizrule:{name}") as queries, closing(pipeline.batches()) as batches:
+            result = sync_ingest_columns(
+                service, converter.columns, batches, batch_size, checkpoint, replace_legacy=True
             )
 
+        print(f"{mapping.service}: {result}")
+
+        if converter.skipped:
+            print(f"{mapping.service}: skipped {converter.skipped} records without a {mapping.key}")
+
+        print(pipeline.report())
+        print(queries)
+        log_summary(queries, **result._asdict())
+
+        return result
+
     except Exception as e:
         print(traceback.format_exc())
-        # only delete the created objects in this round if an error occurs
-        _disater_recovery(created_service_name=service_name)
-            
 
+        if created and not ImportCheckpoint.objects.filter(source=name, rows__gt=0).exists():
+            _disater_recovery(created_service_name=mapping.service)
+
+
+# source name -> (build the paginated fetcher of the API, write the (cursor, record) pairs to the
+# database and return the result, None if the write failed)
+SOURCES = {
+    name: (module.fetcher, partial(_write_source, name, module.MAPPING))
+    for name, module in SOURCE_MODULES.items()
+}
+
+DEFAULT_SOURCES = ["scryfall"]
+
+
+def _source_timeout(name: str) -> float:
+    timeouts = getattr(settings, "BIZRULE_TIMEOUTS", {})
+
+    return timeouts.get(name, getattr(settings, "BIZRULE_TIMEOUT", 30))
+
+
+# the on-disk cache of the API responses, None when disabled in the settings
+def _http_cache(max_age=None) -> Optional[HTTPCache]:
+    config = getattr(settings, "BIZRULE_HTTP_CACHE", None)
+
+    if not config:
+        return None
+
+    return HTTPCache(
+        config["DIR"],
+        max_age=max_age if max_age is not None else config.get("MAX_AGE"),
+        max_size=config.get("MAX_SIZE", DEFAULT_MAX_SIZE),
+    )
+
+
+def main(sources=None, batch_size=None, max_workers=None, wipe=False, use_cache=True, max_age=None, resume=False):
+    sources = sources or DEFAULT_SOURCES
+    max_workers = max_workers or getattr(settings, "BIZRULE_MAX_WORKERS", 4)
+    cache = _http_cache(max_age) if use_cache else None
+
+    # by default only the delta since the last run is written, wipe starts over from an empty database
+    if wipe:
+        _empty_all()
+
+    # the API calls run side by side (at most max_workers at a time), the database writes
+    # stay on this thread, one source at a time, in the order the first pages arrive.
+    # While a page is written the next one of the same source is already being fetched
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        first_pages = {}
+
+        for name in sources:
+            fetcher = SOURCES[name][0](_source_timeout(name), cache)
+            # an interrupted import picks up at the page of its last committed row
+            checkpoint = resumable_checkpoint(name) if resume and not wipe else None
+            cursor = checkpoint.cursor if checkpoint is not None else None
+            first_pages[fetcher.start(executor, cursor)] = name, fetcher
+
+        for first_page in as_completed(first_pages):
+            name, fetcher = first_pages[first_page]
+
+            if first_page.exception() is not None:
+                print(f"Fetching {name} failed, skipping it")
+                print("".join(traceback.format_exception(first_page.exception())))
+                continue
+
+            # a single page catalogue the API reports unchanged since its last ingest needs no write at all
+            page = first_page.result()
+
+            if page.unchanged and page.next_request is None and not wipe:
+                print(f"{name} has not changed since the last run, skipping it")
+                continue
 
-def main():
-    # empty all delete all the existing data
-    # with the testing error raised, we can prove the atomic transaction works both mannually (_disaster_recovery) and automatically (transaction.atomic)
-    _empty_all()
-    #_pokemon_data()
-    #_marvel_data()
-    _scryfall_data()
+            if SOURCES[name][1](fetcher.cursor_records(), batch_size, resume=resume) is not None:
+                fetcher.mark_ingested()
 
+    # requests, retries and the time spent throttled or backing off, per API host
+    print(shared_client().metrics)
@@ -0,0 +1,219 @@
+"""
+Paginated fetchers for the third-party APIs ingested by the bizrule command.
+
+A fetcher follows its API's pagination and yields the records one at a time.
+The next page is requested in the background while the current one is being
+consumed, so at most two pages are held in memory however large the catalogue.
+
+With an ``HTTPCache`` the pages are revalidated rather than downloaded again,
+and a page the API reports unchanged since it was last ingested is flagged so
+the caller can skip writing it.
+
+The requests go through the shared ``HTTPClient``, which pools the
+connections, paces the calls per host and retries transient failures.
+
+Every page carries the request it was fetched with, which is the cursor an
+interrupted import resumes from (see ``start``).
+"""
+import hashlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterator, NamedTuple, Optional
+
+from core.http_cache import HTTPCache
+from core.http_client import HTTPClient, shared_client
+
+
+class Page(NamedTuple):
+    records: list[dict]
+    # keyword arguments of the request for the next page, None on the last page
+    next_request: Optional[dict]
+    # the cached body was revalidated and had already been ingested by an earlier run
+    unchanged: bool = False
+    # keyword arguments of the request the page was fetched with
+    request: Optional[dict] = None
+
+
+class Fetcher:
+    url = ""
+    headers: dict = {}
+    page_size: Optional[int] = None
+    # query parameters that differ between runs without changing the response
+    cache_ignore_params: frozenset = frozenset()
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        page_size: Optional[int] = None,
+        cache: Optional[HTTPCache] = None,
+        client: Optional[HTTPClient] = None,
+    ):
+        self.timeout = timeout
+        self.page_size = page_size or self.page_size
+        self.cache = cache
+        self.cache_keys: list[str] = []
+        # anything with the get of requests.Session
+        self.session = client or shared_client()
+        self._executor: Optional[Executor] = None
+        self._pending: Optional[Future] = None
+
+    def first_request(self) -> dict:
+        return {"url": self.url}
+
+    def parse(self, request: dict, payload: dict) -> Page:
+        raise NotImplementedError
+
+    def fetch_page(self, request: dict) -> Page:
+        if self.cache is None:
+            response = self.session.get(
+                request["url"], params=request.get("params"), headers=self.headers, timeout=self.timeout
+            )
+
+        else:
+            response = self.cache.get(
+                self.session,
+                request["url"],
+                params=request.get("params"),
+                headers=self.headers,
+                timeout=self.timeout,
+                ignore_params=self.cache_ignore_params,
+            )
+
+        print(f"Finished API Call, {str(response.status_code)}")
+        response.raise_for_status()
+        page = self.parse(request, response.json())._replace(request=request)
+
+        if self.cache is not None:
+            self.cache_keys.append(response.key)
+            page = page._replace(unchanged=response.not_modified and response.ingested)
+
+        return page
+
+    def mark_ingested(self) -> None:
+        """Records that the pages fetched so far were written to the database."""
+        if self.cache is not None:
+            self.cache.mark_ingested(self.cache_keys)
+
+    def start(self, executor: Executor, request: Optional[dict] = None) -> Future:
+        """
+        Requests the first page (or the page of ``request``, the cursor of an
+        interrupted import) on ``executor``, which also fetches the later
+        pages, ``records()`` picks up from there.
+        """
+        self._executor = executor
+        self._pending = executor.submit(self.fetch_page, request or self.first_request())
+
+        return self._pending
+
+    def pages(self) -> Iterator[Page]:
+        if self._pending is not None:
+            yield from self._pages()
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.start(executor)
+            yield from self._pages()
+
+    def records(self) -> Iterator[dict]:
+        for page in self.pages():
+            yield from page.records
+
+    def cursor_records(self) -> Iterator[tuple[dict, dict]]:
+        """Yields ``(request, record)``, the request being the cursor of the record's page."""
+        for page in self.pages():
+            for record in page.records:
+                yield page.request, record
+
+    def _pages(self) -> Iterator[Page]:
+        pending, self._pending = self._pending, None
+
+        while pending is not None:
+            page = pending.result()
+
+            # ask for the next page before handing out this one
+            pending = (
+                self._executor.submit(self.fetch_page, page.next_request)
+                if page.next_request
+                else None
+            )
+
+            yield page
+
+
+# page/pageSize, the response carries the totalCount
+class PokemonFetcher(Fetcher):
+    url = "https://api.pokemontcg.io/v2/sets"
+    page_size = 250
+
+    def __init__(self, api_key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "X-Api-Key": api_key,
+        }
+
+    def first_request(self) -> dict:
+        return {"url": self.url, "params": {"page": 1, "pageSize": self.page_size}}
+
+    def parse(self, request: dict, payload: dict) -> Page:
+        params = request["params"]
+        records = payload["data"]
+        total = payload.get("totalCount", 0)
+        next_request = None
+
+        if records and params["page"] * params["pageSize"] < total:
+            next_request = {"url": request["url"], "params": {**params, "page": params["page"] + 1}}
+
+        return Page(records, next_request)
+
+
+# offset/limit, the page is wrapped in a data container with the total
+class MarvelFetcher(Fetcher):
+    url = "https://gateway.marvel.com/v1/public/comics"
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+    page_size = 100
+    cache_ignore_params = frozenset({"ts", "hash"})
+
+    def __init__(self, public_key: str, private_key: str, **kwargs):
+        super().__init__(**kwargs)
+        ts = str(datetime.now().timestamp())
+
+        # hash — a md5 digest of the ts parameter, your private key and your public key (e.g, md5(ts+privateKey+publicKey)
+        hash_result = hashlib.md5((ts + private_key + public_key).encode()).hexdigest()
+        self.auth = {"apikey": public_key, "ts": ts, "hash": hash_result}
+
+    def first_request(self) -> dict:
+        return {"url": self.url, "params": {**self.auth, "offset": 0, "limit": self.page_size}}
+
+    def parse(self, request: dict, payload: dict) -> Page:
+        data = payload["data"]
+        records = data["results"]
+        offset = data.get("offset", 0) + data.get("count", len(records))
+        next_request = None
+
+        if records and offset < data.get("total", 0):
+            next_request = {"url": request["url"], "params": {**request["params"], "offset": offset}}
+
+        return Page(records, next_request)
+
+
+# has_more/next_page, the next page is a ready made URL
+class ScryfallFetcher(Fetcher):
+    url = "https://api.scryfall.com/sets"
+    headers = {
+        "Content-Type": "*/*",
+        "Accept": "application/json",
+        "User-Agent": "insomnia/11.6.0",
+    }
+
+    def parse(self, request: dict, payload: dict) -> Page:
+        next_request = None
+
+        if payload.get("has_more") and payload.get("next_page"):
+            next_request = {"url": payload["next_page"]}
+
+        return Page(payload["data"], next_request)
@@ -0,0 +1,66 @@
+"""
+Filtering of the objects endpoint by cell value.
+
+``/objects/?service=sets&CardCount__gt=300&ReleaseDate__gte=2020-01-01``
+keeps the objects of ``sets`` matching every condition, each one an index
+seek through ``ObjectQuerySet.where``. A parameter without an operator
+(``?SetName=Alpha``) compares for equality, ``in`` takes a comma separated
+list.
+"""
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from core.models import WHERE_OPERATORS, Field, Service, service_names
+
+SERVICE_PARAM = "service"
+# query parameters that belong to the pagination or the renderer
+RESERVED_PARAMS = {SERVICE_PARAM, "cursor", "page_size", "format"}
+
+
+def parse_condition(param: str) -> tuple[str, str]:
+    """Splits ``CardCount__gt`` into the field name and the operator."""
+    field_name, _, op = param.rpartition("__")
+
+    if field_name and op in WHERE_OPERATORS:
+        return field_name, op
+
+    return param, "eq"
+
+
+class FieldValueFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        conditions = [(param, value) for param, value in request.query_params.items() if param not in RESERVED_PARAMS]
+        service_name = request.query_params.get(SERVICE_PARAM)
+
+        if service_name is None:
+            if conditions:
+                raise ValidationError({SERVICE_PARAM: "Filtering by field value requires a service"})
+
+            return queryset
+
+        service_id = service_names.get(service_name) or service_names.refresh().get(service_name)
+
+        if service_id is None:
+            raise ValidationError({SERVICE_PARAM: f"Unknown service {service_name}"})
+
+        queryset = queryset.filter(service_id=service_id)
+
+        if not conditions:
+            return queryset
+
+        service = Service.objects.get(pk=service_id)
+
+        for param, value in conditions:
+            field_name, op = parse_condition(param)
+
+            try:
+                queryset = queryset.where(service, field_name, op, value.split(",") if op == "in" else value)
+
+            except Field.DoesNotExist:
+                raise ValidationError({param: f"{service_name} has no field {field_name}"})
+
+            except DjangoValidationError as e:
+                raise ValidationError({param: e.messages})
+
+        return queryset
@@ -0,0 +1,193 @@
+"""
+On-disk cache of the API responses fetched by the bizrule command.
+
+Bodies are stored per URL and query parameters together with their
+``ETag``/``Last-Modified`` validators. A cached response is revalidated with
+``If-None-Match``/``If-Modified-Since``, so an unchanged source answers
+``304 Not Modified`` without sending its body again. The cache is bounded in
+size and evicts the least recently used entries first.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+import requests
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class CachedResponse:
+    """
+    The part of ``requests.Response`` the fetchers use, ``not_modified`` is
+    set when the body came from the cache (revalidated or still fresh).
+    """
+
+    def __init__(self, key: str, status_code: int, content: bytes, not_modified: bool, ingested: bool):
+        self.key = key
+        self.status_code = status_code
+        self.content = content
+        self.not_modified = not_modified
+        # whether the body was written to the database by an earlier run
+        self.ingested = ingested
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+
+class HTTPCache:
+    def __init__(self, directory, max_age: Optional[float] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = Path(directory)
+        # seconds a stored body is used without revalidating, overrides the server's Cache-Control
+        self.max_age = max_age
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, params: Optional[dict] = None, ignore_params: Iterable[str] = ()) -> str:
+        # per request credentials (e.g. the Marvel ts/hash pair) must not split the cache
+        params = sorted((name, str(value)) for name, value in (params or {}).items() if name not in ignore_params)
+
+        return hashlib.sha256(json.dumps([url, params]).encode()).hexdigest()
+
+    def get(
+        self,
+        session: requests.Session,
+        url: str,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        ignore_params: Iterable[str] = (),
+    ) -> CachedResponse:
+        key = self.key(url, params, ignore_params)
+        entry = self._read_meta(key)
+        headers = dict(headers or {})
+
+        if entry is not None:
+            max_age = self.max_age if self.max_age is not None else entry.get("max_age", 0)
+
+            if time.time() - entry["stored_at"] < max_age and (content := self._read_body(key)) is not None:
+                return CachedResponse(key, 200, content, not_modified=True, ingested=entry["ingested"])
+
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = session.get(url, params=params, headers=headers, timeout=timeout)
+
+        if response.status_code == 304 and entry is not None and (content := self._read_body(key)) is not None:
+            entry.update(stored_at=time.time(), max_age=self._max_age(response))
+            self._write_meta(key, entry)
+
+            return CachedResponse(key, 200, content, not_modified=True, ingested=entry["ingested"])
+
+        response.raise_for_status()
+
+        if response.status_code == 200:
+            self._write_body(key, response.content)
+            self._write_meta(key, {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "stored_at": time.time(),
+                "max_age": self._max_age(response),
+                "ingested": False,
+            })
+            self.evict()
+
+        return CachedResponse(key, response.status_code, response.content, not_modified=False, ingested=False)
+
+    def mark_ingested(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            if (entry := self._read_meta(key)) is not None:
+                entry["ingested"] = True
+                self._write_meta(key, entry)
+
+    def evict(self) -> None:
+        """
+        Deletes the least recently used bodies (and their metadata) until the
+        cache fits in ``max_size``.
+        """
+        with self.lock:
+            bodies = []
+
+            for path in self.directory.glob("*.body"):
+                try:
+                    stat = path.stat()
+
+                except FileNotFoundError:
+                    continue
+
+                bodies.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in bodies)
+
+            for _, size, path in sorted(bodies):
+                if total <= self.max_size:
+                    break
+
+                path.unlink(missing_ok=True)
+                path.with_suffix(".json").unlink(missing_ok=True)
+                total -= size
+
+    @staticmethod
+    def _max_age(response) -> float:
+        cache_control = response.headers.get("Cache-Control", "")
+
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return 0
+
+        match = MAX_AGE_RE.search(cache_control)
+
+        return int(match.group(1)) if match else 0
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads((self.directory / f"{key}.json").read_text())
+
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _read_body(self, key: str) -> Optional[bytes]:
+        path = self.directory / f"{key}.body"
+
+        try:
+            content = path.read_bytes()
+
+        except FileNotFoundError:
+            return None
+
+        # reads count as uses for the LRU eviction
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+
+        return content
+
+    def _write_meta(self, key: str, entry: dict) -> None:
+        self._write(self.directory / f"{key}.json", json.dumps(entry).encode())
+
+    def _write_body(self, key: str, content: bytes) -> None:
+        self._write(self.directory / f"{key}.body", content)
+
+    def _write(self, path: Path, content: bytes) -> None:
+        # write then rename, so a concurrent reader never sees half a file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+        with os.fdopen(fd, "wb") as temp:
+            temp.write(content)
+
+        os.replace(temp_path, path)
@@ -0,0 +1,232 @@
+"""
+Shared HTTP client for the API calls of the bizrule sources.
+
+Every source goes through one ``requests.Session`` whose connection pool keeps
+the connections to each API alive between pages. The calls to a host are
+paced by a token bucket (Scryfall asks for at most 10 requests a second), and
+a transient failure (a connection error, ``429`` or ``5xx``) is retried with
+exponential backoff and full jitter, waiting for the ``Retry-After`` the
+server asks for instead when it sends one.
+
+The client counts the requests, retries and the time spent waiting per host,
+see ``HTTPMetrics``.
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+DEFAULTS = {
+    # requests per second per host, hosts without an entry use DEFAULT_RATE (None: unlimited)
+    "RATE_LIMITS": {},
+    "DEFAULT_RATE": None,
+    "MAX_RETRIES": 5,
+    # seconds, the first retry waits up to BACKOFF, doubling with every attempt up to MAX_BACKOFF
+    "BACKOFF": 0.5,
+    "MAX_BACKOFF": 30.0,
+    # connections kept alive per host
+    "POOL_SIZE": 10,
+}
+
+
+class TokenBucket:
+    """
+    Hands out ``rate`` tokens a second, up to ``burst`` at once. A caller
+    that finds the bucket empty reserves the next token and sleeps until it
+    is due, so concurrent callers queue up instead of all waking at once.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        # the default spaces the calls evenly, 1 / rate seconds apart
+        self.burst = burst
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes a token, returns the seconds waited for it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
+class HostMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        # seconds spent waiting for the rate limit and between retries
+        self.throttled = 0.0
+        self.backoff = 0.0
+        # the client is shared by the threads of a bizrule run
+        self.lock = threading.Lock()
+
+    def add(self, **counts):
+        """Adds to the counters, e.g. ``add(retries=1, backoff=0.5)``."""
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "throttled_ms": round(self.throttled * 1000, 1),
+            "backoff_ms": round(self.backoff * 1000, 1),
+        }
+
+
+class HTTPMetrics:
+    def __init__(self):
+        self.hosts: dict[str, HostMetrics] = {}
+        self.lock = threading.Lock()
+
+    def host(self, host: str) -> HostMetrics:
+        with self.lock:
+            return self.hosts.setdefault(host, HostMetrics())
+
+    def as_dict(self) -> dict:
+        return {host: metrics.as_dict() for host, metrics in self.hosts.items()}
+
+    def __str__(self):
+        return "\n".join(
+            f"{host}: {metrics.requests} requests, {metrics.retries} retries, {metrics.failures} failures, "
+            f"throttled {metrics.throttled:.2f}s, backoff {metrics.backoff:.2f}s"
+            for host, metrics in self.hosts.items()
+        )
+
+
+class HTTPClient:
+    """
+    Has the ``get`` of ``requests.Session``, so it can stand in for one (e.g.
+    in ``HTTPCache.get``). The last response is returned once the retries run
+    out, for the caller's ``raise_for_status``.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, **options):
+        self.options = {**DEFAULTS, **options}
+        self.session = session or self._session(self.options["POOL_SIZE"])
+        self.metrics = HTTPMetrics()
+        self.buckets: dict[str, Optional[TokenBucket]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _session(pool_size: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def bucket(self, host: str) -> Optional[TokenBucket]:
+        with self.lock:
+            if host not in self.buckets:
+                rate = self.options["RATE_LIMITS"].get(host, self.options["DEFAULT_RATE"])
+                self.buckets[host] = TokenBucket(rate) if rate else None
+
+            return self.buckets[host]
+
+    def get(self, url: str, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        host = urlsplit(url).hostname or ""
+        bucket = self.bucket(host)
+        metrics = self.metrics.host(host)
+        attempt = 0
+
+        while True:
+            if bucket is not None:
+                metrics.add(throttled=bucket.acquire())
+
+            metrics.add(requests=1)
+
+            try:
+                response = self.session.get(url, params=params, **kwargs)
+
+            except RETRY_EXCEPTIONS:
+                response = None
+
+                if attempt >= self.options["MAX_RETRIES"]:
+                    metrics.add(failures=1)
+                    raise
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+
+            delay = self.delay(attempt, response)
+
+            if response is not None and (attempt >= self.options["MAX_RETRIES"] or delay is None):
+                metrics.add(failures=1)
+                return response
+
+            attempt += 1
+            metrics.add(retries=1, backoff=delay)
+            time.sleep(delay)
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> Optional[float]:
+        """
+        Seconds to wait before retrying, ``None`` when the server asks for a
+        longer wait than ``MAX_BACKOFF`` (e.g. a daily quota is used up).
+        """
+        retry_after = retry_after_seconds(response) if response is not None else None
+
+        if retry_after is not None:
+            return retry_after if retry_after <= self.options["MAX_BACKOFF"] else None
+
+        return random.uniform(0, min(self.options["MAX_BACKOFF"], self.options["BACKOFF"] * 2**attempt))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    # either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After")
+
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+
+    except (TypeError, ValueError):
+        return None
+
+
+_client: Optional[HTTPClient] = None
+_client_lock = threading.Lock()
+
+
+def shared_client() -> HTTPClient:
+    """The client of the process, configured by ``settings.BIZRULE_HTTP``."""
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient(**getattr(settings, "BIZRULE_HTTP", {}))
+
+        return _client
@@ -0,0 +1,525 @@
+"""
+Bulk ingestion of rows into a Service.
+
+A batch of rows costs one counter reservation, one ``Object`` insert and two
+inserts per form type (the polymorphic ``core_form`` parent rows followed by
+the concrete subclass rows), no matter how many cells it carries.
+
+``sync_ingest`` stages an import as a new generation of the service: its new
+objects and the new values of its changed rows stay hidden from readers (see
+``ObjectQuerySet.published`` and ``FormQuerySet.published``) until the whole
+import is written, then the generation is published, replacing the values it
+changed, in one transaction. With an ``ImportCheckpoint`` every batch also
+records where it stopped, so an interrupted import can be resumed.
+"""
+import hashlib
+import json
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, Sequence
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.db.models import F, Max
+
+from core import response_cache
+from core.models import (
+    FORM_TYPE_MAP, Field, Form, ImportCheckpoint, ImportCheckpointKey, Object, ObjectQuerySet, Service,
+)
+from core.purge import purge_forms, purge_objects
+from core.schema import FieldSpec, schemas
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class Column(NamedTuple):
+    name: str
+    description: str
+    form_type: str
+
+
+class ColumnBatch(NamedTuple):
+    keys: list[str]
+    # one list per column, aligned with the keys
+    values: list[list]
+    # where to resume fetching after this batch, see ``ImportCheckpoint.cursor``
+    cursor: Any = None
+
+
+class SyncResult(NamedTuple):
+    created: int
+    updated: int
+    unchanged: int
+    deleted: int
+
+
+# hash of the values of a row, in column order
+def content_hash(values: Sequence) -> str:
+    encoded = json.dumps(list(values), separators=(",", ":"), default=str)
+
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def get_batch_size(batch_size: Optional[int] = None) -> int:
+    return batch_size or getattr(settings, "INGEST_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+
+def batched(rows: Iterable, batch_size: int) -> Iterator[list]:
+    batch = []
+
+    for row in rows:
+        batch.append(row)
+
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+# resolve (or create) the Field of every column once per import, rather than once per cell
+def resolve_fields(service: Service, columns: Iterable[Column]) -> dict[str, Field]:
+    columns = list(columns)
+    resolved = schemas.resolve(
+        service, [FieldSpec(column.name, column.form_type, column.description) for column in columns]
+    )
+
+    return {column.name: resolved[(column.name, column.form_type)] for column in columns}
+
+
+def create_objects(
+    service: Service,
+    count: int,
+    natural_keys: Optional[list[str]] = None,
+    content_hashes: Optional[list[str]] = None,
+    **fields,
+) -> list[Object]:
+    if not count:
+        return []
+
+    first_counter = Object.reserve_object_counters(service, count)
+    objects = [Object(service=service, object_counter=first_counter + i, **fields) for i in range(count)]
+
+    for obj, natural_key in zip(objects, natural_keys or ()):
+        obj.natural_key = natural_key
+
+    for obj, content_hash in zip(objects, content_hashes or ()):
+        obj.content_hash = content_hash
+
+    return insert_objects(service, objects)
+
+
+def insert_objects(service: Service, objects: list[Object]) -> list[Object]:
+    if not objects:
+        return objects
+
+    # bulk_create sends no post_save
+    response_cache.bump(service.pk)
+    Object.objects.bulk_create(objects)
+
+    if objects and objects[0].pk is None:
+        # backends without INSERT ... RETURNING don't hand the ids back, look them up by counter
+        generation = objects[0].generation
+        ids = dict(
+            Object.objects.filter(
+                service=service,
+                generation=generation,
+                object_counter__in=[obj.object_counter for obj in objects],
+            ).values_list("object_counter", "id")
+        )
+
+        for obj in objects:
+            obj.id = ids[obj.object_counter]
+
+    return objects
+
+
+def bulk_create_forms(forms: list[Form]) -> list[Form]:
+    """
+    ``bulk_create`` refuses multi-table inherited models, so every form type is
+    written in two steps: the ``core_form`` parent rows (with their
+    ``polymorphic_ctype``) and then the subclass rows pointing at them.
+    """
+    forms_by_class: dict[type, list[Form]] = {}
+
+    for form in forms:
+        forms_by_class.setdefault(type(form), []).append(form)
+
+    for form_cls, instances in forms_by_class.items():
+        db = router.db_for_write(form_cls)
+
+        if not connections[db].features.can_return_rows_from_bulk_insert:
+            # the parent ids can't be read back from a bulk insert, fall back to saving one by one
+            for form in instances:
+                form.save(using=db)
+
+            continue
+
+        ctype = ContentType.objects.db_manager(db).get_for_model(form_cls, for_concrete_model=False)
+        parents = [
+            Form(object_id=form.object_id, field_id=form.field_id, generation=form.generation, polymorphic_ctype=ctype)
+            for form in instances
+        ]
+        Form.objects.using(db).bulk_create(parents)
+
+        for form, parent in zip(instances, parents):
+            form.id = form.form_ptr_id = parent.id
+            form.polymorphic_ctype = ctype
+            # what ValueIndex.save copies, _insert doesn't go through save()
+            form.value_field_id = form.field_id
+
+        fields = form_cls._meta.local_concrete_fields
+        insert_size = max(connections[db].ops.bulk_batch_size(fields, instances), 1)
+
+        for batch in batched(instances, insert_size):
+            form_cls._base_manager._insert(batch, fields=fields, using=db)
+
+        for form in instances:
+            form._state.adding = False
+            form._state.db = db
+
+    return forms
+
+
+def bulk_upsert_forms(cells: Iterable[tuple[Object, Field, Any]]) -> tuple[list[Form], list[Form]]:
+    """
+    Sets the value of each ``(object, field, value)`` cell, updating the Forms
+    that already exist and creating the rest, with one lookup, one
+    ``bulk_update`` and one ``bulk_create_forms`` per form type.
+
+    Returns the created and the updated forms.
+    """
+    cells_by_class: dict[type, list[tuple[Object, Field, Any]]] = {}
+
+    for obj, field, value in cells:
+        cells_by_class.setdefault(FORM_TYPE_MAP[field.form_type], []).append((obj, field, value))
+
+    # bulk_update and bulk_create_forms send no signals
+    response_cache.bump(*{obj.service_id for class_cells in cells_by_class.values() for obj, _, _ in class_cells})
+
+    created, updated = [], []
+
+    for form_cls, class_cells in cells_by_class.items():
+        # the published form wins over a value an unfinished import staged next to it
+        existing = {
+            (form.object_id, form.field_id): form
+            for form in form_cls.objects.non_polymorphic()
+            .filter(
+                object_id__in={obj.id for obj, _, _ in class_cells},
+                field_id__in={field.id for _, field, _ in class_cells},
+            )
+            .order_by("-generation")
+        }
+        new_forms, changed_forms = [], {}
+
+        for obj, field, value in class_cells:
+            form = existing.get((obj.id, field.id))
+
+            if form is None:
+                form = form_cls(object=obj, field=field, value=value)
+                existing[(obj.id, field.id)] = form
+                new_forms.append(form)
+
+            else:
+                form.value = value
+
+                if form.pk is not None:
+                    changed_forms[form.pk] = form
+
+        form_cls.objects.bulk_update(changed_forms.values(), ["value"])
+        bulk_create_forms(new_forms)
+
+        created.extend(new_forms)
+        updated.extend(changed_forms.values())
+
+    return created, updated
+
+
+def ingest_batches(
+    service: Service,
+    columns: list[Column],
+    rows: Iterable[dict],
+    batch_size: Optional[int] = None,
+) -> Iterator[list[Object]]:
+    """
+    Writes ``rows`` (dicts keyed by column name) as Objects of ``service`` with
+    one Form per column present in the row, ``batch_size`` rows per transaction.
+
+    Yields the Objects of each batch once it is written, ``rows`` is only read
+    one batch ahead so it can be a generator over a much larger source.
+    """
+    fields = resolve_fields(service, columns)
+
+    for batch in batched(rows, get_batch_size(batch_size)):
+        with transaction.atomic():
+            objects = create_objects(service, len(batch))
+            forms = [
+                FORM_TYPE_MAP[column.form_type](object=obj, field=fields[column.name], value=row[column.name])
+                for obj, row in zip(objects, batch)
+                for column in columns
+                if column.name in row
+            ]
+            bulk_create_forms(forms)
+
+        yield objects
+
+
+def bulk_ingest(
+    service: Service,
+    columns: list[Column],
+    rows: Iterable[dict],
+    batch_size: Optional[int] = None,
+) -> list[Object]:
+    """
+    Like ``ingest_batches`` but returns all the created Objects at once.
+    """
+    return [obj for objects in ingest_batches(service, columns, rows, batch_size) for obj in objects]
+
+
+def sync_ingest(
+    service: Service,
+    columns: list[Column],
+    rows: Iterable[tuple[str, dict]],
+    batch_size: Optional[int] = None,
+) -> SyncResult:
+    """
+    Brings ``service`` in line with ``rows``, ``(natural_key, row)`` pairs with
+    the full current contents of the upstream source.
+
+    Rows whose content hash matches the stored one aren't written, changed
+    rows get their new values staged on the same object (keeping its id and
+    human ID), new rows are created and keyed objects whose key no longer
+    shows up are deleted when the import is published, once every row has
+    been read.
+    """
+    batches = (
+        ColumnBatch(
+            [natural_key for natural_key, _ in batch],
+            [[row.get(column.name) for _, row in batch] for column in columns],
+        )
+        for batch in batched(rows, get_batch_size(batch_size))
+    )
+
+    return sync_ingest_columns(service, columns, batches, batch_size)
+
+
+def next_generation(service: Service) -> int:
+    """
+    The generation of a new import of ``service``, after deleting what an
+    abandoned import left unpublished. Numbers of abandoned imports aren't
+    reused, so the values they staged can't pass for staged by the new one.
+    """
+    service.refresh_from_db(fields=["generation"])
+    last = Object.objects.filter(service=service).aggregate(
+        generation=Max("generation"), staged_generation=Max("staged_generation")
+    )
+    unpublished = Form.objects.non_polymorphic().filter(object__service=service, generation__gt=service.generation)
+
+    if (last["generation"] or 0) > service.generation:
+        purge_objects(Object.objects.filter(service=service, generation__gt=service.generation))
+
+    if unpublished.exists():
+        purge_forms(unpublished)
+
+    return max(service.generation, last["generation"] or 0, last["staged_generation"] or 0) + 1
+
+
+def resumable_checkpoint(source: str) -> Optional[ImportCheckpoint]:
+    """The checkpoint of an unfinished import of ``source``, if any."""
+    checkpoint = ImportCheckpoint.objects.select_related("service").filter(source=source).first()
+
+    # the service may have moved past it with an import that didn't use the checkpoint
+    if checkpoint is None or checkpoint.generation <= checkpoint.service.generation:
+        return None
+
+    return checkpoint
+
+
+def begin_import(service: Service, source: str, resume: bool = False) -> ImportCheckpoint:
+    """
+    Returns the checkpoint to pass to ``sync_ingest_columns``, the unfinished
+    one of ``source`` when resuming, a new one otherwise.
+    """
+    if resume and (checkpoint := resumable_checkpoint(source)) is not None:
+        if checkpoint.service_id != service.pk:
+            # its fetch already started at the cursor, a new import from there would lose the rows before it
+            raise ValueError(f"The checkpoint of {source} belongs to another service")
+
+        return checkpoint
+
+    with transaction.atomic():
+        ImportCheckpoint.objects.filter(source=source).delete()
+
+        return ImportCheckpoint.objects.create(source=source, service=service, generation=next_generation(service))
+
+
+def sync_ingest_columns(
+    service: Service,
+    columns: list[Column],
+    batches: Iterable[ColumnBatch],
+    batch_size: Optional[int] = None,
+    checkpoint: Optional[ImportCheckpoint] = None,
+    replace_legacy: bool = False,
+) -> SyncResult:
+    """
+    ``sync_ingest`` for rows already laid out in columns, one transaction per
+    batch. A ``None`` value leaves the cell out.
+
+    With a ``checkpoint`` the import is written in its generation and each
+    batch records its cursor and the keys it read, rows written by an earlier
+    attempt count as unchanged. Without one the keys are kept in memory and a
+    batch without new or changed rows writes nothing.
+
+    ``replace_legacy`` is for the owner of the service (the bizrule command):
+    its first keyed import also deletes the rows of ``legacy_objects``.
+    """
+    fields = resolve_fields(service, columns)
+    # resolved once per column rather than once per cell
+    targets = [(fields[column.name], FORM_TYPE_MAP[column.form_type]) for column in columns]
+    generation = checkpoint.generation if checkpoint is not None else next_generation(service)
+    seen: set[str] = set()
+    created = updated = unchanged = 0
+
+    for batch in batches:
+        # the last occurrence of a key wins, like it would with one write per row
+        positions = {natural_key: position for position, natural_key in enumerate(batch.keys)}
+        rows = list(zip(*batch.values)) if batch.values else [()] * len(batch.keys)
+        hashes = {natural_key: content_hash(rows[position]) for natural_key, position in positions.items()}
+
+        # the published hash of each key, or the one this import already staged
+        existing = {
+            natural_key: (id_, staged_hash if staged_generation == generation else stored_hash)
+            for natural_key, id_, stored_hash, staged_hash, staged_generation in Object.objects.filter(
+                service=service, natural_key__in=list(positions)
+            ).values_list("natural_key", "id", "content_hash", "staged_hash", "staged_generation")
+        }
+        new_keys = [natural_key for natural_key in positions if natural_key not in existing]
+        changed = [
+            Object(
+                id=id_,
+                service=service,
+                natural_key=natural_key,
+                staged_hash=hashes[natural_key],
+                staged_generation=generation,
+            )
+            for natural_key, (id_, stored_hash) in existing.items()
+            if stored_hash != hashes[natural_key]
+        ]
+
+        if checkpoint is None:
+            seen.update(positions)
+
+            if not new_keys and not changed:
+                unchanged += len(positions)
+                continue
+
+        with transaction.atomic():
+            objects = create_objects(
+                service,
+                len(new_keys),
+                new_keys,
+                [hashes[natural_key] for natural_key in new_keys],
+                generation=generation,
+            )
+            # a changed row keeps its object (and id), its new values are staged next to the published ones
+            Object.objects.bulk_update(changed, ["staged_hash", "staged_generation"])
+            bulk_create_forms(
+                [
+                    form_cls(object=obj, field=field, value=value, generation=generation)
+                    for (field, form_cls), values in zip(targets, batch.values)
+                    for obj in objects + changed
+                    if (value := values[positions[obj.natural_key]]) is not None
+                ]
+            )
+
+            if checkpoint is not None:
+                ImportCheckpointKey.objects.bulk_create(
+                    [ImportCheckpointKey(checkpoint=checkpoint, natural_key=natural_key) for natural_key in positions]
+                )
+                checkpoint.cursor = batch.cursor
+                checkpoint.last_natural_key = batch.keys[-1] if batch.keys else checkpoint.last_natural_key
+                checkpoint.rows += len(batch.keys)
+                checkpoint.save(update_fields=["cursor", "last_natural_key", "rows", "updated_at"])
+
+        created += len(objects)
+        updated += len(changed)
+        unchanged += len(positions) - len(objects) - len(changed)
+
+    deleted = publish(
+        service, generation, [field.pk for field, _ in targets], checkpoint, seen, batch_size, replace_legacy
+    )
+
+    return SyncResult(created, updated, unchanged, deleted)
+
+
+def legacy_objects(service: Service) -> ObjectQuerySet:
+    """
+    The objects of a service that has never published a keyed import, all of
+    them written before imports had natural keys. Their records can't be told
+    apart from the ones the first keyed import creates again, so that import
+    replaces them instead of leaving a duplicate of every record.
+    """
+    if Object.objects.published().filter(service=service, natural_key__isnull=False).exists():
+        return Object.objects.none()
+
+    return Object.objects.filter(service=service, natural_key__isnull=True)
+
+
+def publish(
+    service: Service,
+    generation: int,
+    field_ids: list[int],
+    checkpoint: Optional[ImportCheckpoint] = None,
+    seen: Iterable[str] = (),
+    batch_size: Optional[int] = None,
+    replace_legacy: bool = False,
+) -> int:
+    """
+    Makes ``generation`` the one readers see, in one transaction: the staged
+    values of the changed rows replace their published forms of ``field_ids``
+    (forms of other fields, e.g. written through the customer API, are kept)
+    and the keyed objects that weren't read (``seen``, or the keys of the
+    checkpoint) are deleted. Objects without a natural key don't come from an
+    import and are left alone, unless ``replace_legacy`` (see
+    ``legacy_objects``). Returns the number of deleted objects.
+
+    An import that changed nothing isn't published, nothing is written.
+    """
+    keyed = Object.objects.filter(service=service, natural_key__isnull=False)
+
+    if checkpoint is not None:
+        vanished = list(
+            keyed.exclude(natural_key__in=checkpoint.seen_keys.values("natural_key")).values_list("id", flat=True)
+        )
+
+    else:
+        seen = set(seen)
+        vanished = [id_ for id_, natural_key in keyed.values_list("id", "natural_key").iterator() if natural_key not in seen]
+
+    if replace_legacy:
+        vanished += list(legacy_objects(service).values_list("id", flat=True))
+
+    staged = Object.objects.filter(service=service, staged_generation=generation)
+    written = Object.objects.filter(service=service, generation=generation).exists() or staged.exists()
+
+    with transaction.atomic():
+        if written:
+            purge_forms(
+                Form.objects.non_polymorphic().filter(
+                    object__in=staged, field_id__in=field_ids, generation__lt=generation
+                )
+            )
+            staged.update(content_hash=F("staged_hash"), staged_hash="")
+
+        for ids in batched(vanished, get_batch_size(batch_size)):
+            purge_objects(Object.objects.filter(id__in=ids))
+
+        if written or vanished:
+            Service.objects.filter(pk=service.pk).update(generation=generation)
+            service.generation = generation
+            response_cache.bump(service.pk)
+
+        if checkpoint is not None:
+            checkpoint.delete()
+
+    return len(vanished)
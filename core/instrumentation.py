@@ -0,0 +1,183 @@
+"""
+Query count and latency instrumentation.
+
+``record_queries()`` hooks an ``execute_wrapper`` on the database connections
+of the current thread and records every query with its duration and a
+fingerprint (the SQL with its literals and ``IN`` lists folded), so a query
+repeated with different parameters, the signature of an N+1, shows up as a
+duplicate fingerprint.
+
+``QueryInstrumentationMiddleware`` records every request, sends the numbers
+as ``Server-Timing`` headers, logs them as one JSON line on the
+``core.instrumentation`` logger and checks them against the per endpoint
+budgets of ``settings.QUERY_BUDGETS``. Queries run while a streaming
+response is consumed happen after the middleware returns and aren't counted.
+"""
+import contextlib
+import json
+import logging
+import re
+import time
+from collections import Counter
+from typing import Iterator, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# the slowest queries kept in a summary
+SLOWEST = 5
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r"\bIN \((?:\s*(?:\?|%s)\s*,?)+\)", re.IGNORECASE)
+SPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecord(NamedTuple):
+    sql: str
+    duration: float
+    alias: str
+
+
+def fingerprint(sql: str) -> str:
+    """The SQL with its literals replaced by ``?`` and ``IN`` lists folded."""
+    sql = STRING_RE.sub("?", sql)
+    sql = NUMBER_RE.sub("?", sql)
+    sql = IN_LIST_RE.sub("IN (...)", sql)
+
+    return SPACE_RE.sub(" ", sql).strip()
+
+
+class QueryRecorder:
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.queries: list[QueryRecord] = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def wrapper(self, alias: str):
+        def execute(execute, sql, params, many, context):
+            start = time.perf_counter()
+
+            try:
+                return execute(sql, params, many, context)
+
+            finally:
+                self.queries.append(QueryRecord(sql, time.perf_counter() - start, alias))
+
+        return execute
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def sql_time(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+    def slowest(self, count: int = SLOWEST) -> list[QueryRecord]:
+        return sorted(self.queries, key=lambda query: query.duration, reverse=True)[:count]
+
+    def duplicates(self) -> dict[str, int]:
+        """Fingerprints run more than once, with their count."""
+        counts = Counter(fingerprint(query.sql) for query in self.queries)
+
+        return {sql: count for sql, count in counts.most_common() if count > 1}
+
+    def summary(self) -> dict:
+        return {
+            "label": self.label,
+            "queries": self.count,
+            "sql_ms": round(self.sql_time * 1000, 3),
+            "total_ms": round(self.elapsed * 1000, 3),
+            "slowest": [
+                {"sql": query.sql, "ms": round(query.duration * 1000, 3)} for query in self.slowest()
+            ],
+            "duplicates": self.duplicates(),
+        }
+
+    def server_timing(self) -> str:
+        duplicated = sum(count - 1 for count in self.duplicates().values())
+
+        return ", ".join([
+            f'db;dur={self.sql_time * 1000:.3f};desc="{self.count} queries"',
+            f'dup;desc="{duplicated} duplicated"',
+            f"total;dur={self.elapsed * 1000:.3f}",
+        ])
+
+    def __str__(self):
+        return (
+            f"{self.label}: {self.count} queries, {self.sql_time:.3f}s in SQL of {self.elapsed:.3f}s, "
+            f"{len(self.duplicates())} repeated"
+        )
+
+
+@contextlib.contextmanager
+def record_queries(label: str = "", budget: Optional[int] = None) -> Iterator[QueryRecorder]:
+    """
+    Records the queries of the current thread on every database, raises
+    ``QueryBudgetExceeded`` on the way out if there were more than ``budget``.
+    """
+    recorder = QueryRecorder(label)
+
+    with contextlib.ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder.wrapper(alias)))
+
+        try:
+            yield recorder
+
+        finally:
+            recorder.elapsed = time.perf_counter() - recorder.started
+
+    if budget is not None and recorder.count > budget:
+        raise QueryBudgetExceeded(f"{label} ran {recorder.count} queries, over its budget of {budget}")
+
+
+def log_summary(recorder: QueryRecorder, **extra) -> None:
+    logger.info(json.dumps({**recorder.summary(), **extra}, default=str))
+
+
+def endpoint_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+
+    return match.view_name if match is not None and match.view_name else request.path
+
+
+class QueryInstrumentationMiddleware:
+    """
+    ``settings.QUERY_BUDGETS`` maps a view name (e.g. ``"object-list"``) to
+    the most queries a request to it may run. An overrun is logged as a
+    warning, or raised with ``QUERY_BUDGETS_RAISE`` so the test doing the
+    request fails.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries(request.path) as recorder:
+            response = self.get_response(request)
+
+        name = endpoint_name(request)
+        recorder.label = name
+        response["Server-Timing"] = recorder.server_timing()
+        log_summary(recorder, method=request.method, path=request.path, status=response.status_code)
+
+        budget = getattr(settings, "QUERY_BUDGETS", {}).get(name)
+
+        if budget is not None and recorder.count > budget:
+            message = f"{request.method} {request.path} ({name}) ran {recorder.count} queries, over its budget of {budget}"
+
+            if getattr(settings, "QUERY_BUDGETS_RAISE", False):
+                raise QueryBudgetExceeded(message)
+
+            logger.warning(message)
+
+        return response
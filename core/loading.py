@@ -0,0 +1,75 @@
+"""
+Loading concrete forms without polymorphic downcasting.
+
+django-polymorphic reads the ``core_form`` rows first and then the subclass
+rows of every content type it finds, although a form's class follows from
+its field's ``form_type``. Here the form types are taken from the fields and
+each subclass table is read directly (joined to its ``core_form`` parent row
+by the multi-table inheritance), one query per form type.
+"""
+from collections import defaultdict
+from typing import Iterable
+
+from core.models import FORM_TYPE_MAP, Form, Object
+
+
+def load_forms(form_types: Iterable[str], **filters) -> list[Form]:
+    """
+    The concrete forms matching ``filters`` (lookups on the Form fields) of
+    the given form types, in ``id`` order.
+    """
+    forms = []
+
+    for form_cls in {FORM_TYPE_MAP[form_type] for form_type in form_types}:
+        forms.extend(form_cls.objects.non_polymorphic().filter(**filters))
+
+    forms.sort(key=lambda form: form.pk)
+
+    return forms
+
+
+def concrete_forms(forms: list[Form]) -> list[Form]:
+    """
+    Replaces plain ``core_form`` rows (e.g. of a non polymorphic queryset
+    with ``select_related("field")``) by their concrete forms, in order.
+    """
+    ids_by_type: dict[str, list[int]] = defaultdict(list)
+
+    for form in forms:
+        ids_by_type[form.field.form_type].append(form.pk)
+
+    loaded = {}
+
+    for form_type, ids in ids_by_type.items():
+        loaded.update((form.pk, form) for form in FORM_TYPE_MAP[form_type].objects.non_polymorphic().filter(pk__in=ids))
+
+    return [loaded[form.pk] for form in forms if form.pk in loaded]
+
+
+def prefetch_forms(objects: list[Object]) -> list[Object]:
+    """
+    Fills ``form_set`` of every object with its concrete forms, one query per
+    form type used by the objects' services. The services' fields are read
+    through ``service.field_set``, prefetch them to keep that to one query.
+    """
+    if not objects:
+        return objects
+
+    form_types = {field.form_type for obj in objects for field in obj.service.field_set.all()}
+    forms_by_object = defaultdict(list)
+
+    generations = {obj.pk: obj.service.generation for obj in objects}
+
+    for form in load_forms(form_types, object_id__in=[obj.pk for obj in objects]):
+        # values an unfinished import staged stay hidden, see FormQuerySet.published
+        if form.generation <= generations[form.object_id]:
+            forms_by_object[form.object_id].append(form)
+
+    for obj in objects:
+        # what prefetch_related leaves behind, form_set.all() is served from it
+        queryset = obj.form_set.all()
+        queryset._result_cache = forms_by_object[obj.pk]
+        queryset._prefetch_done = True
+        obj._prefetched_objects_cache = {**getattr(obj, "_prefetched_objects_cache", {}), "form_set": queryset}
+
+    return objects
@@ -0,0 +1,125 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core.benchmarks import BENCHMARKS, BenchmarkConfig, run
+from core.models import FORM_TYPE_MAP
+
+DEFAULTS = BenchmarkConfig()
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the ingest, object counters and read endpoints on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            choices=list(BENCHMARKS),
+            default=None,
+            help=f"Benchmarks to run (default: {' '.join(BENCHMARKS)})",
+        )
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=DEFAULTS.rows,
+            help=f"Rows of the ingested, loaded and posted services (default: {DEFAULTS.rows})",
+        )
+        parser.add_argument(
+            "--fields",
+            type=int,
+            default=DEFAULTS.fields,
+            help=f"Fields of every synthetic service (default: {DEFAULTS.fields})",
+        )
+        parser.add_argument(
+            "--form-types",
+            nargs="+",
+            choices=list(FORM_TYPE_MAP),
+            default=list(DEFAULTS.form_types),
+            help="Form types the fields cycle through (default: all of them)",
+        )
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=list(DEFAULTS.sizes),
+            help=f"Rows of the services listed through /objects/ (default: {' '.join(map(str, DEFAULTS.sizes))})",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=DEFAULTS.threads,
+            help=f"Threads saving objects concurrently, 0 to skip (default: {DEFAULTS.threads})",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=DEFAULTS.processes,
+            help=f"Processes saving objects concurrently, 0 to skip (default: {DEFAULTS.processes})",
+        )
+        parser.add_argument(
+            "--objects-per-worker",
+            type=int,
+            default=DEFAULTS.objects_per_worker,
+            help=f"Objects saved by every thread or process (default: {DEFAULTS.objects_per_worker})",
+        )
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=DEFAULTS.samples,
+            help=f"Timed calls per latency measurement (default: {DEFAULTS.samples})",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of rows written per bulk insert (defaults to settings.INGEST_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="File the JSON results are written to (default: stdout)",
+        )
+
+    def handle(self, *args, **options):
+        config = BenchmarkConfig(
+            rows=options["rows"],
+            fields=options["fields"],
+            form_types=tuple(options["form_types"]),
+            sizes=tuple(options["sizes"]),
+            threads=options["threads"],
+            processes=options["processes"],
+            objects_per_worker=options["objects_per_worker"],
+            samples=options["samples"],
+            batch_size=options["batch_size"],
+        )
+
+        # a test database like manage.py test creates, the real data is left alone. SQLite's is
+        # put in a file rather than in memory so the forked workers of the counter benchmark reach it
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite" and not connection.settings_dict["TEST"].get("NAME"):
+                connection.settings_dict["TEST"]["NAME"] = f"{directory}/benchmark.sqlite3"
+
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+            try:
+                results = run(config, options["only"])
+
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        else:
+            self.stdout.write(output)
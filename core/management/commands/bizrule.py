@@ -1,12 +1,63 @@
 from django.core.management.base import BaseCommand
 
-from core.biz_rule import main
+from core.biz_rule import DEFAULT_SOURCES, SOURCES, main
 
 
 class Command(BaseCommand):
     help = "Ingests Random API Data"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sources",
+            nargs="+",
+            choices=list(SOURCES),
+            default=DEFAULT_SOURCES,
+            help=f"APIs to ingest (default: {' '.join(DEFAULT_SOURCES)})",
+        )
+        parser.add_argument(
+            "--wipe",
+            action="store_true",
+            help="Delete all the existing data first instead of only writing what changed upstream",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of rows written per bulk insert (defaults to settings.INGEST_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Maximum number of API calls in flight (defaults to settings.BIZRULE_MAX_WORKERS)",
+        )
+
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Download every page again instead of revalidating the cached responses",
+        )
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            default=None,
+            help="Seconds a cached response is reused without asking the API (defaults to settings.BIZRULE_HTTP_CACHE)",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted import from its last checkpoint instead of starting it over",
+        )
+
     def handle(self, *args, **options):
-        main()
+        main(
+            sources=options["sources"],
+            batch_size=options["batch_size"],
+            max_workers=options["workers"],
+            wipe=options["wipe"],
+            use_cache=not options["no_cache"],
+            max_age=options["max_age"],
+            resume=options["resume"],
+        )
 
         self.stdout.write(self.style.SUCCESS('Successfully run'))
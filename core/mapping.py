@@ -0,0 +1,124 @@
+"""
+Declarative mapping of API records onto the columns of a Service.
+
+A ``SourceMapping`` lists, per column, where the value sits in a record (a
+dotted path), how to convert it and the default for a record without it.
+``compile()`` turns it into a converter that reads each path with a prepared
+getter and fills whole columns at a time, ready for
+``ingest.sync_ingest_columns``.
+"""
+import logging
+from datetime import date
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from core.ingest import Column, ColumnBatch, batched, get_batch_size
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class FieldMapping(NamedTuple):
+    name: str
+    description: str
+    form_type: str
+    # dotted path to the value in the record, e.g. "images.symbol"
+    path: str
+    converter: Optional[Callable[[Any], Any]] = None
+    # used when the path isn't in the record, ``None`` leaves the cell out
+    default: Any = None
+
+    @property
+    def column(self) -> Column:
+        return Column(self.name, self.description, self.form_type)
+
+
+class SourceMapping(NamedTuple):
+    service: str
+    description: str
+    # dotted path to the upstream identity of a record
+    key: str
+    fields: list[FieldMapping]
+
+    @property
+    def columns(self) -> list[Column]:
+        return [field.column for field in self.fields]
+
+    def compile(self) -> "RowConverter":
+        return RowConverter(self)
+
+
+def getter(path: str) -> Callable[[Any], Any]:
+    """Returns a function reading ``path`` from a record, ``MISSING`` if absent."""
+    keys = path.split(".")
+
+    if len(keys) == 1:
+        key = keys[0]
+
+        return lambda record: record.get(key, MISSING)
+
+    def get(record):
+        for key in keys:
+            if not isinstance(record, dict):
+                return MISSING
+
+            record = record.get(key, MISSING)
+
+            if record is MISSING:
+                break
+
+        return record
+
+    return get
+
+
+class RowConverter:
+    def __init__(self, mapping: SourceMapping):
+        self.mapping = mapping
+        self.columns = mapping.columns
+        self.key = getter(mapping.key)
+        self.getters = [(getter(field.path), field.converter, field.default) for field in mapping.fields]
+        # records left out for having no natural key
+        self.skipped = 0
+
+    def __call__(self, records: list[dict]) -> ColumnBatch:
+        keys = [self.key(record) for record in records]
+
+        if any(key is MISSING or key is None for key in keys):
+            # without its identity a record can't be matched to its object, all of them would share one key
+            keyed = [(key, record) for key, record in zip(keys, records) if key is not MISSING and key is not None]
+            skipped = len(records) - len(keyed)
+            self.skipped += skipped
+            logger.warning("%s: skipped %d records without a %s", self.mapping.service, skipped, self.mapping.key)
+            keys = [key for key, _ in keyed]
+            records = [record for _, record in keyed]
+
+        values = []
+
+        for get, converter, default in self.getters:
+            column = list(map(get, records))
+
+            if converter is None:
+                values.append([default if value is MISSING else value for value in column])
+
+            else:
+                values.append([default if value is MISSING else converter(value) for value in column])
+
+        return ColumnBatch([str(key) for key in keys], values)
+
+    def batches(self, records: Iterable[dict], batch_size: Optional[int] = None) -> Iterator[ColumnBatch]:
+        for batch in batched(records, get_batch_size(batch_size)):
+            yield self(batch)
+
+
+# converters
+
+
+def iso_date(value: str) -> Optional[date]:
+    # "YYYY-MM-DD", an empty value leaves the cell out
+    return date.fromisoformat(value) if value else None
+
+
+def slash_date(value: str) -> Optional[date]:
+    # "YYYY/MM/DD", without the strptime format parsing
+    return date.fromisoformat(value.replace("/", "-")) if value else None
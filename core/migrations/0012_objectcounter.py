@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_object_counters(apps, schema_editor):
+    Object = apps.get_model("core", "Object")
+    ObjectCounter = apps.get_model("core", "ObjectCounter")
+    db = schema_editor.connection.alias
+
+    last_counters = (
+        Object.objects.using(db)
+        .values("service_id")
+        .annotate(last_counter=models.Max("object_counter"))
+        .order_by()
+    )
+    ObjectCounter.objects.using(db).bulk_create(
+        [
+            ObjectCounter(service_id=row["service_id"], last_counter=row["last_counter"])
+            for row in last_counters
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0011_alter_field_form_type"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ObjectCounter",
+            fields=[
+                (
+                    "service",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="core.service",
+                    ),
+                ),
+                ("last_counter", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_object_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0012_objectcounter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="object",
+            index=models.Index(
+                fields=["service", "object_counter"], name="core_object_service_d88f92_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0013_object_service_counter_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="object",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="object",
+            name="natural_key",
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="object",
+            constraint=models.UniqueConstraint(
+                fields=("service", "natural_key"), name="core_object_unique_natural_key"
+            ),
+        ),
+    ]
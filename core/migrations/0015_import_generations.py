@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0014_object_natural_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="service",
+            name="generation",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="object",
+            name="generation",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="object",
+            name="staged_hash",
+            field=models.CharField(blank=True, default="", editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="object",
+            name="staged_generation",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="form",
+            name="generation",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="ImportCheckpoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("source", models.CharField(max_length=255, unique=True)),
+                ("generation", models.IntegerField()),
+                ("cursor", models.JSONField(blank=True, null=True)),
+                ("last_natural_key", models.CharField(blank=True, max_length=255, null=True)),
+                ("rows", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "service",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="core.service"),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ImportCheckpointKey",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("natural_key", models.CharField(max_length=255)),
+                (
+                    "checkpoint",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="seen_keys",
+                        to="core.importcheckpoint",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["checkpoint", "natural_key"], name="core_import_checkpo_04c081_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,152 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.db.models.functions.text
+
+FORM_MODELS = [
+    "BooleanForm",
+    "CharacterForm",
+    "DateForm",
+    "FloatForm",
+    "IntegerForm",
+    "TextForm",
+    "URLForm",
+]
+
+
+# copy the field of every existing form next to its value
+def fill_value_field(apps, schema_editor):
+    Form = apps.get_model("core", "Form")
+
+    for name in FORM_MODELS:
+        apps.get_model("core", name).objects.update(
+            value_field=Subquery(Form.objects.filter(pk=OuterRef("pk")).values("field")[:1])
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0015_import_generations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booleanform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.AddField(
+            model_name="characterform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.AddField(
+            model_name="dateform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.AddField(
+            model_name="floatform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.AddField(
+            model_name="integerform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.AddField(
+            model_name="textform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.AddField(
+            model_name="urlform",
+            name="value_field",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.field",
+            ),
+        ),
+        migrations.RunPython(fill_value_field, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="booleanform",
+            index=models.Index(fields=["value_field", "value"], name="core_booleanform_value"),
+        ),
+        migrations.AddIndex(
+            model_name="characterform",
+            index=models.Index(fields=["value_field", "value"], name="core_characterform_value"),
+        ),
+        migrations.AddIndex(
+            model_name="dateform",
+            index=models.Index(fields=["value_field", "value"], name="core_dateform_value"),
+        ),
+        migrations.AddIndex(
+            model_name="floatform",
+            index=models.Index(fields=["value_field", "value"], name="core_floatform_value"),
+        ),
+        migrations.AddIndex(
+            model_name="integerform",
+            index=models.Index(fields=["value_field", "value"], name="core_integerform_value"),
+        ),
+        migrations.AddIndex(
+            model_name="textform",
+            index=models.Index(
+                models.F("value_field"),
+                django.db.models.functions.text.Substr("value", 1, 64),
+                name="core_textform_value_prefix",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="urlform",
+            index=models.Index(fields=["value_field", "value"], name="core_urlform_value"),
+        ),
+    ]
@@ -1,15 +1,22 @@
-from threading import Lock
+from polymorphic.managers import PolymorphicManager
 from polymorphic.models import PolymorphicModel
-from typing import Optional
-import contextlib
+from polymorphic.query import PolymorphicQuerySet
+from threading import Lock
+from typing import Iterable, Optional
 import re
 
-from django.db import models, transaction
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Substr
+
+HUMAN_ID_TWO_NUMBERS_RE = re.compile(r"-(\d+)-(\d+)$")
+HUMAN_ID_NUMBER_RE = re.compile(r"-(\d+)$")
 
 
 class Service(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
+    # the last import generation readers may see, see ``Object.generation``
+    generation = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -17,11 +24,108 @@ class Service(models.Model):
     def __repr__(self):
         return f"<Service: {str(self)}>"
 
+class ServiceNameIndex:
+    """
+    In-process map of service name to id, loaded with one query on first use and
+    dropped whenever a Service is saved or deleted (see ``core.signals``).
+    """
+    def __init__(self):
+        self._names: Optional[dict[str, int]] = None
+        self._lock = Lock()
+
+    def get(self, name: str) -> Optional[int]:
+        names = self._names
+
+        if names is None:
+            names = self.refresh()
+
+        return names.get(name)
+
+    def refresh(self) -> dict[str, int]:
+        with self._lock:
+            # names aren't unique, the oldest service wins like Service.objects.filter(name=...).first()
+            self._names = dict(Service.objects.order_by("-id").values_list("name", "id"))
+
+            return self._names
+
+    def invalidate(self) -> None:
+        self._names = None
+
+
+service_names = ServiceNameIndex()
+
+# operators of ``ObjectQuerySet.where`` and the lookups they map to
+WHERE_OPERATORS = {
+    "eq": "exact",
+    "lt": "lt",
+    "lte": "lte",
+    "gt": "gt",
+    "gte": "gte",
+    "startswith": "startswith",
+    "in": "in",
+}
+
+class ObjectQuerySet(models.QuerySet):
+    def published(self) -> "ObjectQuerySet":
+        """Leaves out the objects of imports that haven't been published yet."""
+        return self.filter(generation__lte=models.F("service__generation"))
+
+    def where(self, service: "Service", field_name: str, op: str, value) -> "ObjectQuerySet":
+        """
+        The objects of ``service`` whose ``field_name`` cell matches ``op``
+        (one of ``WHERE_OPERATORS``) and ``value``, e.g. ``where(sets,
+        "CardCount", "gt", 300)``. The value is converted to the type of the
+        field, so it can come from a query string.
+
+        The cells are looked up with an index seek on ``(value_field, value)``
+        in the table of the field's form type, without the polymorphic joins.
+        """
+        # the schema cache imports the models
+        from core.schema import schemas
+
+        if op not in WHERE_OPERATORS:
+            raise ValueError(f"Unknown operator {op}, expected one of {', '.join(WHERE_OPERATORS)}")
+
+        # another process may have added the field since the schema was read
+        field = schemas.get(service).find(field_name) or schemas.refresh(service).find(field_name)
+
+        if field is None:
+            raise Field.DoesNotExist(f"{service} has no field {field_name}")
+
+        form_cls = FORM_TYPE_MAP[field.form_type]
+        to_python = form_cls._meta.get_field("value").to_python
+        value = [to_python(item) for item in value] if op == "in" else to_python(value)
+        cells = form_cls.objects.non_polymorphic().filter(
+            value_field=field, generation__lte=service.generation, **{f"value__{WHERE_OPERATORS[op]}": value}
+        )
+
+        if form_cls is TextForm:
+            cells = TextForm.prefix_filter(cells, op, value)
+
+        return self.filter(service=service, id__in=cells.values("object_id"))
+
+
 class Object(models.Model):
     object_counter = models.IntegerField(default=0, editable=False)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
-
-    counter_lock = Lock()
+    # upstream identity of the record the object was ingested from, and a hash of its values
+    natural_key = models.CharField(max_length=255, null=True, blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    # the import that created the object, it is hidden until the service publishes that generation
+    generation = models.IntegerField(default=0, editable=False)
+    # an import that changed the record stages its hash here and its values as forms of its
+    # generation (see ``Form.generation``), both replace the published ones when it is published
+    staged_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    staged_generation = models.IntegerField(default=0, editable=False)
+
+    objects = ObjectQuerySet.as_manager()
+
+    class Meta:
+        # human ID lookups and keyset paging both seek on (service, object_counter)
+        indexes = [models.Index(fields=["service", "object_counter"])]
+        constraints = [
+            models.UniqueConstraint(fields=["service", "natural_key"], name="core_object_unique_natural_key"),
+        ]
 
     @property
     def human_id(self):
@@ -29,14 +133,87 @@ class Object(models.Model):
 
     @staticmethod
     def load(human_id: str) -> "Object":
+        key = Object._key(human_id)
+
+        if key is None:
+            raise Object.DoesNotExist(f"Bad human ID <{human_id}>")
+
+        obj = Object._get_by_counter(*key)
+
+        if obj is None:
+            # the index may be stale (e.g. the service was created by another process) and so may the
+            # split of the ID, "crm-1-2" is ticket 1 of "crm" until "crm-1" is known, retry once
+            service_names.refresh()
+
+            if (fresh_key := Object._key(human_id)) != key:
+                obj = Object._get_by_counter(*fresh_key)
+
+        if obj is None:
+            raise Object.DoesNotExist(f"No object matches human ID <{human_id}>")
+
+        return obj
+
+    @staticmethod
+    def _key(human_id: str) -> Optional[tuple[Optional[int], int]]:
+        """The ``(service_id, object_counter)`` of a human ID, ``None`` when it is malformed."""
         try:
             service, ticket = Object.extract_human_id_parts(human_id)
-            service = Service.objects.get(name=service)
 
-            return Object.objects.get(service=service, object_counter=ticket)
+        except ValueError:
+            return None
 
-        except (Service.DoesNotExist, ValueError) as ex:
-            raise Object.DoesNotExist from ex
+        return service_names.get(service), int(ticket)
+
+    @staticmethod
+    def _get_by_counter(service_id: Optional[int], ticket: int) -> Optional["Object"]:
+        if service_id is None:
+            return None
+
+        return (
+            Object.objects.select_related("service")
+            .published()
+            .filter(service_id=service_id, object_counter=ticket)
+            .first()
+        )
+
+    @staticmethod
+    def load_many(human_ids: Iterable[str]) -> dict[str, "Object"]:
+        """
+        Resolves every human ID with one query per service, human IDs that are
+        malformed or don't match an object are left out of the result.
+        """
+        keys = {human_id: Object._key(human_id) for human_id in human_ids}
+        objects = Object._get_many(keys)
+
+        if any(key is not None and human_id not in objects for human_id, key in keys.items()):
+            # the index may be stale, and with it the split of the IDs, see ``load``
+            service_names.refresh()
+            fresh_keys = {human_id: Object._key(human_id) for human_id in keys if human_id not in objects}
+            objects.update(Object._get_many({
+                human_id: key for human_id, key in fresh_keys.items() if key != keys[human_id]
+            }))
+
+        return objects
+
+    @staticmethod
+    def _get_many(keys: dict[str, Optional[tuple[Optional[int], int]]]) -> dict[str, "Object"]:
+        wanted: dict[int, dict[int, str]] = {}
+
+        for human_id, key in keys.items():
+            if key is not None and key[0] is not None:
+                wanted.setdefault(key[0], {})[key[1]] = human_id
+
+        objects = {}
+
+        for service_id, tickets in wanted.items():
+            similar_objects = Object.objects.select_related("service").published().filter(
+                service_id=service_id, object_counter__in=tickets
+            )
+
+            for obj in similar_objects:
+                objects[tickets[obj.object_counter]] = obj
+
+        return objects
 
     @staticmethod
     def extract_human_id_parts(human_id: str, service: Optional[str] = '') -> tuple[str, str]:
@@ -49,10 +226,10 @@ class Object(models.Model):
             else:
                 raise ValueError(f"Service name, <{service}>, does not match human ID, <{human_id}>")
 
-        human_id_parts = re.search(r"-(\d+)-(\d+)$", human_id)
+        human_id_parts = HUMAN_ID_TWO_NUMBERS_RE.search(human_id)
 
         if not human_id_parts:
-            human_id_parts = re.search(r"-(\d+)$", human_id)
+            human_id_parts = HUMAN_ID_NUMBER_RE.search(human_id)
 
             if not human_id_parts:
                 raise ValueError(BAD_HUMAN_ID_FORMAT_ERROR_STRING.format(human_id))
@@ -66,19 +243,12 @@ class Object(models.Model):
         ticket_ctr = human_id_parts.groups()[0]
 
         if not service and len(human_id_parts.groups()) == 2:
-            try:
-                Service.objects.get(name=service_name)
-
-            except Service.DoesNotExist:
-                possible_name = f'{service_name}-{human_id_parts.groups()[0]}'
+            # "name-1-2" can only be ticket 2 of a hyphenated "name-1" service, when one exists
+            possible_name = f'{service_name}-{human_id_parts.groups()[0]}'
 
-                try:
-                    Service.objects.get(name=possible_name)
-                    service_name = possible_name
-                    ticket_ctr = human_id_parts.groups()[1]
-
-                except Service.DoesNotExist:
-                    pass
+            if service_names.get(possible_name) is not None:
+                service_name = possible_name
+                ticket_ctr = human_id_parts.groups()[1]
 
         return service_name, ticket_ctr
 
@@ -86,17 +256,9 @@ class Object(models.Model):
         return f"/core/{self.service}/objects/{self.id}/"
 
     def save(self, force_insert=False, force_update=False, **kwargs):
-        if self.id:
-            update = True
-
-            try:
-                Object.objects.get(pk=self.id)
-
-            except Object.DoesNotExist:
-                pass
-
-        else:
-            update = False
+        # rows that haven't been written yet need a counter for the service, even when
+        # their pk was assigned up front (Django then tries an UPDATE before the INSERT)
+        update = not force_insert and (force_update or not self._state.adding)
 
         # need counter for project
         if not update:
@@ -105,25 +267,17 @@ class Object(models.Model):
         else:
             super(Object, self).save(force_insert, force_update, **kwargs)
 
+    @staticmethod
+    def reserve_object_counters(service: Service, count: int) -> int:
+        """
+        Reserves a contiguous block of ``count`` object counters for ``service``
+        and returns the first one.
+        """
+        return ObjectCounter.reserve(service, count)
+
     def allocate_next_object_counter(self, force_insert, force_update, **kwargs) -> None:
-        similar_objects = Object.objects.filter(service=self.service)
-        similar_objects = similar_objects.select_for_update().order_by("-object_counter")
-
-        with Object.counter_lock, transaction.atomic():
-            max_counter = 0
-
-            """
-            @NOTE
-            It's possible that no objects may be returned and an attribute error
-            will be thrown when accessing the object_counter of a non-existing first() element
-            of a query set, so just catch and pass the error, it's non fatal but does have
-            to be handled.
-            """
-            with contextlib.suppress(AttributeError):
-                max_counter = similar_objects.first().object_counter
-
-            self.object_counter = max_counter + 1
-            super(Object, self).save(force_insert, force_update, **kwargs)
+        self.object_counter = Object.reserve_object_counters(self.service, 1)
+        super(Object, self).save(force_insert, force_update, **kwargs)
 
     def __str__(self):
         return f"{self.service}-{self.object_counter}"
@@ -131,6 +285,98 @@ class Object(models.Model):
     def __repr__(self):
         return f"<Object: {str(self)}>"
 
+class ObjectCounter(models.Model):
+    """
+    The last object counter handed out for a service, bumped with a single
+    ``UPDATE ... RETURNING`` so allocating is O(1) and safe across processes.
+    """
+    service = models.OneToOneField(Service, on_delete=models.CASCADE, primary_key=True)
+    last_counter = models.IntegerField(default=0)
+
+    @classmethod
+    def reserve(cls, service: Service, count: int = 1) -> int:
+        db = router.db_for_write(cls)
+        last_counter = cls._increment(service.pk, count, db)
+
+        if last_counter is None:
+            # first allocation for this service, seed the row from any objects it already has
+            existing = Object.objects.using(db).filter(service_id=service.pk).aggregate(
+                models.Max("object_counter")
+            )["object_counter__max"]
+            cls.objects.using(db).bulk_create(
+                [cls(service_id=service.pk, last_counter=existing or 0)], ignore_conflicts=True
+            )
+            last_counter = cls._increment(service.pk, count, db)
+
+        return last_counter - count + 1
+
+    @classmethod
+    def _increment(cls, service_id: int, count: int, db: str) -> Optional[int]:
+        connection = connections[db]
+
+        if connection.vendor == "postgresql" or (
+            connection.vendor == "sqlite" and connection.features.can_return_columns_from_insert
+        ):
+            qn = connection.ops.quote_name
+            column = qn(cls._meta.get_field("last_counter").column)
+
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {qn(cls._meta.db_table)} SET {column} = {column} + %s "
+                    f"WHERE {qn(cls._meta.pk.column)} = %s RETURNING {column}",
+                    [count, service_id],
+                )
+                row = cursor.fetchone()
+
+            return row[0] if row else None
+
+        # no UPDATE ... RETURNING (e.g. MySQL), the updated row stays locked until the read
+        with transaction.atomic(using=db):
+            counters = cls.objects.using(db).filter(service_id=service_id)
+
+            if not counters.update(last_counter=models.F("last_counter") + count):
+                return None
+
+            return counters.values_list("last_counter", flat=True).get()
+
+    def __str__(self):
+        return f"{self.service}: {self.last_counter}"
+
+    def __repr__(self):
+        return f"<ObjectCounter: {str(self)}>"
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of an unfinished import of a source into a service, written in
+    the transaction of every batch so an interrupted import can resume from
+    the page of its last committed row. Deleted when the import is published.
+    """
+    source = models.CharField(max_length=255, unique=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    generation = models.IntegerField()
+    # the request of the page the last committed row came from
+    cursor = models.JSONField(null=True, blank=True)
+    last_natural_key = models.CharField(max_length=255, null=True, blank=True)
+    rows = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source}: generation {self.generation}, {self.rows} rows"
+
+    def __repr__(self):
+        return f"<ImportCheckpoint: {str(self)}>"
+
+class ImportCheckpointKey(models.Model):
+    """
+    A natural key read by the import of a checkpoint. When the import is
+    published the keyed objects missing from here vanished upstream.
+    """
+    checkpoint = models.ForeignKey(ImportCheckpoint, on_delete=models.CASCADE, related_name="seen_keys")
+    natural_key = models.CharField(max_length=255)
+
+    class Meta:
+        indexes = [models.Index(fields=["checkpoint", "natural_key"])]
+
 class Field(models.Model):
     CHAR = "CHAR"
     TEXT = "TEXT"
@@ -157,8 +403,12 @@ class Field(models.Model):
     order = models.IntegerField(default=1)
 
     def save(self, **kwargs):
-        if not self.id and (max_counter := Field.objects.filter(service=self.service).order_by("-order")):
-            self.order = max_counter[0].order + 1 if max_counter else 1
+        # a new field goes after the last one of its service
+        if not self.id:
+            last_order = Field.objects.filter(service=self.service).aggregate(last=models.Max("order"))["last"]
+
+            if last_order is not None:
+                self.order = last_order + 1
 
         super(Field, self).save(**kwargs)
 
@@ -168,38 +418,114 @@ class Field(models.Model):
     def __repr__(self):
         return f"<Field: {str(self)}>"
 
+class FormQuerySet(PolymorphicQuerySet):
+    def published(self) -> "FormQuerySet":
+        """The published forms of published objects, see ``ObjectQuerySet.published``."""
+        return self.filter(
+            object__generation__lte=models.F("object__service__generation"),
+            generation__lte=models.F("object__service__generation"),
+        )
+
+
 class Form(PolymorphicModel):
     object = models.ForeignKey(Object, on_delete=models.CASCADE)
     field = models.ForeignKey(Field, on_delete=models.CASCADE)
+    # the import that wrote the form, the new value of a changed record stays hidden next to the
+    # published one until the service publishes that generation
+    generation = models.IntegerField(default=0, editable=False)
     value = None
 
+    objects = PolymorphicManager.from_queryset(FormQuerySet)()
+
     def __str__(self):
         return f"{self.object}: {self.field.name} - {self.value}"
 
-class IntegerForm(Form):
+class ValueIndex(models.Model):
+    """
+    A copy of ``Form.field`` in the table of a form type, next to the value,
+    so the cells of a field can be looked up by value with a composite
+    ``(value_field, value)`` index instead of a join to ``core_form``.
+    """
+    value_field = models.ForeignKey(
+        Field, on_delete=models.CASCADE, related_name="+", null=True, editable=False, db_index=False
+    )
+
+    class Meta:
+        abstract = True
+        # what django-polymorphic sets on the form types without a Meta of their own
+        base_manager_name = "objects"
+        indexes = [models.Index(fields=["value_field", "value"], name="%(app_label)s_%(class)s_value")]
+
+    def save(self, *args, **kwargs):
+        self.value_field_id = self.field_id
+        super().save(*args, **kwargs)
+
+class IntegerForm(ValueIndex, Form):
     type = models.CharField(default="int", editable=False, max_length=3)
     value = models.IntegerField(default=0, null=True, blank=True)
 
-class FloatForm(Form):
+class FloatForm(ValueIndex, Form):
     type = models.CharField(default="float", editable=False, max_length=5)
     value = models.FloatField(default=0.0, null=True, blank=True)
 
-class CharacterForm(Form):
+class CharacterForm(ValueIndex, Form):
     type = models.CharField(default="char", editable=False, max_length=4)
     value = models.CharField(max_length=255, default="", null=True, blank=True)
 
-class TextForm(Form):
+# long values would bloat the index, only their first characters are indexed
+TEXT_INDEX_PREFIX = 64
+
+class TextForm(ValueIndex, Form):
     type = models.CharField(default="text", editable=False, max_length=4)
     value = models.TextField(default="", null=True, blank=True)
 
-class BooleanForm(Form):
+    class Meta(ValueIndex.Meta):
+        indexes = [
+            models.Index(
+                models.F("value_field"), Substr("value", 1, TEXT_INDEX_PREFIX), name="core_textform_value_prefix"
+            ),
+        ]
+
+    @staticmethod
+    def prefix_filter(cells: models.QuerySet, op: str, value) -> models.QuerySet:
+        """
+        Adds the condition on the indexed prefix that ``op`` implies, the
+        condition on the whole value still decides.
+        """
+        cells = cells.annotate(value_prefix=Substr("value", 1, TEXT_INDEX_PREFIX))
+
+        if op == "in":
+            return cells.filter(value_prefix__in=[item[:TEXT_INDEX_PREFIX] for item in value])
+
+        prefix = value[:TEXT_INDEX_PREFIX]
+
+        if op == "startswith" and len(value) < TEXT_INDEX_PREFIX:
+            return cells.filter(value_prefix__gte=prefix, value_prefix__lt=prefix + chr(0x10FFFF))
+
+        # a value > x (or < x) has a prefix >= (or <=) the prefix of x
+        lookup = {"eq": "exact", "startswith": "exact", "gt": "gte", "gte": "gte", "lt": "lte", "lte": "lte"}[op]
+
+        return cells.filter(**{f"value_prefix__{lookup}": prefix})
+
+class BooleanForm(ValueIndex, Form):
     type = models.CharField(default="bool", editable=False, max_length=4)
     value = models.BooleanField(default=False, null=True, blank=True)
 
-class DateForm(Form):
+class DateForm(ValueIndex, Form):
     type = models.CharField(default="date", editable=False, max_length=4)
     value = models.DateField()
 
-class URLForm(Form):
+class URLForm(ValueIndex, Form):
     type = models.CharField(default="url", editable=False, max_length=4)
     value = models.URLField()
+
+# map the form type to the corresponding form class
+FORM_TYPE_MAP = {
+    Field.CHAR: CharacterForm,
+    Field.TEXT: TextForm,
+    Field.INTEGER: IntegerForm,
+    Field.FLOAT: FloatForm,
+    Field.BOOLEAN: BooleanForm,
+    Field.DATE: DateForm,
+    Field.URL: URLForm,
+}
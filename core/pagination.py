@@ -0,0 +1,158 @@
+"""
+Keyset (cursor) pagination for the DRF endpoints.
+
+A page is fetched with ``WHERE (ordering) > (cursor) ORDER BY ordering LIMIT n``
+so a deep page costs the same index seek as the first one, unlike
+``OFFSET``. The cursor is the ordering key of the last (or first) row of the
+current page.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    # views may set ``keyset_ordering``, it must be unique across rows (end with the pk)
+    ordering = ("pk",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, "keyset_ordering", self.ordering))
+
+        cursor = self.decode_cursor(request, queryset.model)
+        key, reverse = cursor if cursor else (None, False)
+        ordering = [f"-{name}" for name in self.ordering] if reverse else list(self.ordering)
+
+        queryset = queryset.order_by(*ordering)
+
+        if key is not None:
+            queryset = queryset.filter(self.after(key, reverse))
+
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+
+        if reverse:
+            page.reverse()
+
+        self.has_next = cursor is not None if reverse else has_more
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = page
+
+        return page
+
+    def after(self, key: list, reverse: bool) -> Q:
+        """
+        ``(a, b, c) > (x, y, z)`` spelled out for the ORM, led by ``a >= x``
+        so the database can start with a range seek on the index.
+        """
+        lookup = "lt" if reverse else "gt"
+        condition = None
+
+        for name, value in reversed(list(zip(self.ordering, key))):
+            strict = Q(**{f"{name}__{lookup}": value})
+            condition = strict if condition is None else strict | (Q(**{name: value}) & condition)
+
+        return Q(**{f"{self.ordering[0]}__{lookup}e": key[0]}) & condition
+
+    def get_page_size(self, request) -> int:
+        page_size = api_settings.PAGE_SIZE or 100
+
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+
+            if requested > 0:
+                page_size = min(requested, self.max_page_size)
+
+        except (KeyError, ValueError):
+            pass
+
+        return page_size
+
+    def decode_cursor(self, request, model) -> Optional[tuple[list, bool]]:
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if not encoded:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            key, reverse = cursor["k"], bool(cursor.get("r"))
+
+            if not isinstance(key, list) or len(key) != len(self.ordering):
+                raise ValueError
+
+            key = [self.to_python(model, name, value) for name, value in zip(self.ordering, key)]
+
+        except (binascii.Error, KeyError, TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return key, reverse
+
+    @staticmethod
+    def to_python(model, name: str, value):
+        """A key value of the cursor as the type of its ordering field."""
+        # the cursor comes from the client, a value the database can't compare would fail the query
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError
+
+        field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+
+        return field.to_python(value)
+
+    def encode_cursor(self, row, reverse: bool) -> str:
+        key = [getattr(row, name) for name in self.ordering]
+        encoded = base64.urlsafe_b64encode(json.dumps({"k": key, "r": int(reverse)}).encode()).decode("ascii")
+
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous:
+            return None
+
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,236 @@
+"""
+Ingest pipeline: fetch, convert and write as separate stages.
+
+The fetch and convert stages run on their own threads and hand batches on
+through bounded queues, while the caller's thread writes. A slow upstream page
+and a slow commit then overlap instead of adding up. A full queue blocks the
+stage feeding it (backpressure), so at most ``queue_size`` batches wait between
+two stages.
+
+Every stage records how long it was busy, starved (waiting for input) and
+blocked (waiting for room downstream), with the depth of the queue it feeds,
+which shows the bottleneck: the stage that is busy while the others wait.
+
+With ``cursors`` the records come as ``(cursor, record)`` pairs and every
+batch carries the cursor of its last record, for the import checkpoint.
+"""
+import queue
+import threading
+import time
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from django.conf import settings
+
+from core.ingest import ColumnBatch, get_batch_size
+
+DEFAULT_QUEUE_SIZE = 4
+
+# end of the stream marker
+DONE = object()
+
+
+class StageFailed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.batches = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    def add(self, rows: int, busy: float) -> None:
+        self.batches += 1
+        self.rows += rows
+        self.busy += busy
+
+    def sample_depth(self, depth: int) -> None:
+        self.max_depth = max(self.max_depth, depth)
+        self.depth_total += depth
+        self.depth_samples += 1
+
+    @property
+    def throughput(self) -> float:
+        """Rows per second of busy time."""
+        return self.rows / self.busy if self.busy else 0.0
+
+    @property
+    def mean_depth(self) -> float:
+        return self.depth_total / self.depth_samples if self.depth_samples else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "busy_ms": round(self.busy * 1000, 1),
+            "starved_ms": round(self.starved * 1000, 1),
+            "blocked_ms": round(self.blocked * 1000, 1),
+            "rows_per_second": round(self.throughput, 1),
+            "queue_depth": {"max": self.max_depth, "mean": round(self.mean_depth, 2)},
+        }
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.rows} rows in {self.batches} batches, {self.throughput:.0f} rows/s, "
+            f"busy {self.busy:.2f}s, starved {self.starved:.2f}s, blocked {self.blocked:.2f}s, "
+            f"queue depth max {self.max_depth} mean {self.mean_depth:.1f}"
+        )
+
+
+class Pipeline:
+    def __init__(
+        self,
+        records: Iterable[dict],
+        convert: Callable[[list[dict]], ColumnBatch],
+        batch_size: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        cursors: bool = False,
+    ):
+        self.records = records
+        self.convert = convert
+        self.cursors = cursors
+        self.batch_size = get_batch_size(batch_size)
+        queue_size = queue_size or getattr(settings, "INGEST_PIPELINE_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)
+
+        self.fetched: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.converted: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stats = {name: StageStats(name) for name in ("fetch", "convert", "write")}
+        self._stop = threading.Event()
+
+    def batches(self) -> Iterator[ColumnBatch]:
+        """
+        Starts the fetch and convert stages and yields the converted batches,
+        the time the caller takes between two batches is the write stage's.
+        """
+        threads = [
+            threading.Thread(target=self._fetch, name="pipeline-fetch", daemon=True),
+            threading.Thread(target=self._convert, name="pipeline-convert", daemon=True),
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        stats = self.stats["write"]
+
+        try:
+            while True:
+                batch = self._get(self.converted, stats)
+
+                if batch is DONE or batch is None:
+                    return
+
+                if isinstance(batch, StageFailed):
+                    raise batch.error
+
+                start = time.perf_counter()
+                yield batch
+                stats.add(len(batch.keys), time.perf_counter() - start)
+
+        finally:
+            # the writer is done (or failed), the other stages stop at their next queue operation
+            self._stop.set()
+
+            for thread in threads:
+                thread.join()
+
+    def report(self) -> str:
+        return "\n".join(str(stats) for stats in self.stats.values())
+
+    def _fetch(self) -> None:
+        stats = self.stats["fetch"]
+        records = iter(self.records)
+
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                batch = list(islice(records, self.batch_size))
+
+                if not batch:
+                    break
+
+                stats.add(len(batch), time.perf_counter() - start)
+
+                if not self._put(self.fetched, batch, stats):
+                    return
+
+        except Exception as e:
+            self._put(self.fetched, StageFailed(e), stats)
+            return
+
+        self._put(self.fetched, DONE, stats)
+
+    def _convert(self) -> None:
+        stats = self.stats["convert"]
+
+        while True:
+            batch = self._get(self.fetched, stats)
+
+            if batch is None:
+                return
+
+            if batch is DONE or isinstance(batch, StageFailed):
+                self._put(self.converted, batch, stats)
+                return
+
+            start = time.perf_counter()
+
+            try:
+                if self.cursors:
+                    cursor = batch[-1][0]
+                    converted = self.convert([record for _, record in batch])._replace(cursor=cursor)
+
+                else:
+                    converted = self.convert(batch)
+
+            except Exception as e:
+                self._put(self.converted, StageFailed(e), stats)
+                return
+
+            stats.add(len(batch), time.perf_counter() - start)
+
+            if not self._put(self.converted, converted, stats):
+                return
+
+    def _put(self, target: queue.Queue, item: Any, stats: StageStats) -> bool:
+        start = time.perf_counter()
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+
+                except queue.Full:
+                    continue
+
+                stats.sample_depth(target.qsize())
+
+                return True
+
+            return False
+
+        finally:
+            stats.blocked += time.perf_counter() - start
+
+    def _get(self, source: queue.Queue, stats: StageStats) -> Any:
+        start = time.perf_counter()
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    return source.get(timeout=0.1)
+
+                except queue.Empty:
+                    continue
+
+            return None
+
+        finally:
+            stats.starved += time.perf_counter() - start
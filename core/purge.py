@@ -0,0 +1,113 @@
+"""
+Set based deletion of services, objects and their forms.
+
+``QuerySet.delete()`` collects every row in Python to cascade and send
+signals, and deleting a Form subclass row doesn't reach its ``core_form``
+parent the other way round. Here every table is emptied with a single
+``DELETE ... WHERE`` in dependency order: the Form subclass tables, then
+``core_form``, then the objects, fields, counters, import checkpoints (with
+their keys) and services.
+
+Like ``delete()`` the functions return the total number of deleted rows and
+a count per model label. No ``pre_delete``/``post_delete`` signals are sent.
+"""
+from django.db import transaction
+from django.db.models import QuerySet
+
+from core import response_cache
+from core.models import (
+    FORM_TYPE_MAP, Field, Form, ImportCheckpoint, ImportCheckpointKey, Object, ObjectCounter, Service, service_names,
+)
+from core.schema import schemas
+
+# each subclass once, in a stable order
+FORM_CLASSES = list(dict.fromkeys(FORM_TYPE_MAP.values()))
+
+
+def _delete_in_order(querysets: list[QuerySet]) -> tuple[int, dict[str, int]]:
+    counts: dict[str, int] = {}
+
+    with transaction.atomic():
+        for queryset in querysets:
+            label = queryset.model._meta.label
+            counts[label] = counts.get(label, 0) + queryset._raw_delete(queryset.db)
+
+    return sum(counts.values()), counts
+
+
+def _form_querysets(**filters) -> list[QuerySet]:
+    return [form_cls.objects.non_polymorphic().filter(**filters) for form_cls in FORM_CLASSES] + [
+        Form.objects.non_polymorphic().filter(**filters)
+    ]
+
+
+def purge_objects(objects: QuerySet) -> tuple[int, dict[str, int]]:
+    """Deletes the Objects of the ``objects`` queryset with all their forms."""
+    # a subquery, so the ids never travel through Python
+    object_ids = objects.order_by().values("id")
+    # no post_delete either
+    response_cache.bump(*objects.order_by().values_list("service_id", flat=True).distinct())
+
+    return _delete_in_order(
+        _form_querysets(object_id__in=object_ids) + [Object.objects.filter(id__in=object_ids)]
+    )
+
+
+def purge_forms(forms: QuerySet) -> tuple[int, dict[str, int]]:
+    """Deletes the Forms of the ``forms`` queryset, subclass rows first."""
+    form_ids = forms.order_by().values("id")
+    response_cache.bump(*forms.order_by().values_list("object__service_id", flat=True).distinct())
+
+    return _delete_in_order(_form_querysets(id__in=form_ids))
+
+
+def purge_services(services: QuerySet) -> tuple[int, dict[str, int]]:
+    """Deletes the ``services`` with their objects, forms, fields, counters and checkpoints."""
+    service_ids = list(services.values_list("id", flat=True))
+
+    if not service_ids:
+        return 0, {}
+
+    purged = _delete_in_order(
+        _form_querysets(object__service_id__in=service_ids)
+        + [
+            Object.objects.filter(service_id__in=service_ids),
+            Field.objects.filter(service_id__in=service_ids),
+            ObjectCounter.objects.filter(service_id__in=service_ids),
+            ImportCheckpointKey.objects.filter(checkpoint__service_id__in=service_ids),
+            ImportCheckpoint.objects.filter(service_id__in=service_ids),
+            Service.objects.filter(id__in=service_ids),
+        ]
+    )
+    service_names.invalidate()
+    response_cache.bump(*service_ids)
+
+    for service_id in service_ids:
+        schemas.invalidate(service_id)
+
+    return purged
+
+
+def purge_service(service: Service) -> tuple[int, dict[str, int]]:
+    return purge_services(Service.objects.filter(pk=service.pk))
+
+
+def purge_all() -> tuple[int, dict[str, int]]:
+    """Empties every core table, without the lookups of ``purge_services``."""
+    purged = _delete_in_order(
+        [form_cls.objects.non_polymorphic().all() for form_cls in FORM_CLASSES]
+        + [
+            Form.objects.non_polymorphic().all(),
+            Object.objects.all(),
+            Field.objects.all(),
+            ObjectCounter.objects.all(),
+            ImportCheckpointKey.objects.all(),
+            ImportCheckpoint.objects.all(),
+            Service.objects.all(),
+        ]
+    )
+    service_names.invalidate()
+    schemas.invalidate()
+    response_cache.bump_all()
+
+    return purged
@@ -0,0 +1,151 @@
+"""
+Cache of the serialized responses of the read endpoints.
+
+Every service has a version counter in the Django cache, bumped by every
+write to its objects, fields or forms: the model signals for single saves
+and deletes, and explicit ``bump`` calls in the bulk paths that bypass them
+(``core.ingest``, ``core.purge``, ``core.schema``). A response is cached
+under the version of the service it depends on, or under the version of all
+services, so a write makes the stale entries unreachable instead of having
+to find and delete them.
+
+The key also gives the response an ``ETag``, a client revalidating with
+``If-None-Match`` gets a ``304 Not Modified`` without the view being run.
+
+The counters live in the cache, the bizrule command and the web workers
+only see each other's bumps through a cache backend they share (file,
+memcached, Redis), with a per-process backend the entries expire after
+``RESPONSE_CACHE["TIMEOUT"]``.
+"""
+import hashlib
+import json
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+DEFAULTS = {
+    "ALIAS": "default",
+    # seconds
+    "TIMEOUT": 60,
+}
+
+# bumped with every service, for responses spanning all of them
+ALL = "all"
+# bumped when everything is purged at once, part of every key
+EPOCH = "epoch"
+
+
+def _options() -> dict:
+    return {**DEFAULTS, **getattr(settings, "RESPONSE_CACHE", {})}
+
+
+def _cache():
+    return caches[_options()["ALIAS"]]
+
+
+def _version_key(scope) -> str:
+    return f"core:version:{scope}"
+
+
+def version(scope) -> int:
+    cache = _cache()
+    key = _version_key(scope)
+    current = cache.get(key)
+
+    if current is None:
+        # an evicted counter must not restart at a number whose entries may still be cached
+        cache.add(key, time.time_ns(), timeout=None)
+        current = cache.get(key)
+
+    return current
+
+
+def _increment(scope) -> None:
+    cache = _cache()
+    key = _version_key(scope)
+
+    try:
+        cache.incr(key)
+
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def _bump(scopes: tuple) -> None:
+    for scope in scopes:
+        _increment(scope)
+
+
+def bump(*service_ids: int) -> None:
+    """
+    Invalidates the cached responses of the services, now and again when the
+    current transaction commits (a response cached in between was read
+    before the write was visible).
+    """
+    if not service_ids:
+        return
+
+    scopes = tuple(dict.fromkeys(service_ids)) + (ALL,)
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def bump_all() -> None:
+    _bump((EPOCH,))
+    transaction.on_commit(lambda: _bump((EPOCH,)))
+
+
+def response_key(request, service_id: Optional[int] = None) -> str:
+    versions = [version(EPOCH), version(ALL if service_id is None else service_id)]
+    # hyperlinks embed the host, the renderer follows the Accept header
+    parts = [request.build_absolute_uri(), request.META.get("HTTP_ACCEPT", ""), *map(str, versions)]
+
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of the ``list`` and ``retrieve`` responses of a viewset,
+    rendered again for every request.
+    """
+
+    def cache_service_id(self, request) -> Optional[int]:
+        """The service the response only depends on, ``None`` for all of them."""
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, view, *args, **kwargs):
+        key = response_key(request, self.cache_service_id(request))
+        etag = f'"{key[:32]}"'
+
+        if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        cache = _cache()
+        data = cache.get(f"core:response:{key}")
+
+        if data is None:
+            response = view(request, *args, **kwargs)
+
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+            # plain JSON types, pickling DRF's Hyperlink values would call str() on their objects
+            data = json.loads(json.dumps(response.data, cls=JSONEncoder))
+            cache.set(f"core:response:{key}", data, _options()["TIMEOUT"])
+            response["ETag"] = etag
+
+            return response
+
+        return Response(data, headers={"ETag": etag})
@@ -0,0 +1,161 @@
+"""
+In-process cache of the Fields of every Service.
+
+A service's schema is read with one query on first use and reused by every
+import and view until a Field (or the Service) is saved or deleted (see
+``core.signals``) or the service is purged. Only the writes of this process
+invalidate it, a lookup that misses refreshes it before giving up. Missing fields are created
+in one bulk insert with their ``order`` assigned in a single pass.
+
+A schema changed inside a transaction isn't cached again before the
+transaction commits, so a rollback can't leave fields in the cache that
+don't exist.
+"""
+from threading import Lock
+from typing import Iterable, NamedTuple, Optional
+
+from django.db import transaction
+
+from core import response_cache
+from core.models import FORM_TYPE_MAP, Field, Service
+
+
+class FieldSpec(NamedTuple):
+    name: str
+    # None matches a field of any type, but can't be created
+    form_type: Optional[str]
+    description: str = ""
+
+
+class ServiceSchema:
+    """The Fields of a service in ``(order, id)`` order."""
+
+    def __init__(self, fields: list[Field]):
+        self.fields = fields
+        self.by_name: dict[str, list[Field]] = {}
+
+        for field in fields:
+            self.by_name.setdefault(field.name, []).append(field)
+
+    @property
+    def next_order(self) -> int:
+        return max((field.order for field in self.fields), default=0) + 1
+
+    def find(self, name: str, form_type: Optional[str] = None) -> Optional[Field]:
+        return next(
+            (field for field in self.by_name.get(name, ()) if form_type in (None, field.form_type)),
+            None,
+        )
+
+
+class SchemaCache:
+    def __init__(self):
+        self._schemas: dict[int, ServiceSchema] = {}
+        # services whose fields changed in a transaction that hasn't committed yet
+        self._uncommitted: set[int] = set()
+        self._lock = Lock()
+
+    def get(self, service: Service) -> ServiceSchema:
+        schema = self._schemas.get(service.pk)
+
+        if schema is None:
+            schema = self.refresh(service)
+
+        return schema
+
+    def refresh(self, service: Service) -> ServiceSchema:
+        schema = ServiceSchema(list(Field.objects.filter(service=service).order_by("order", "id")))
+
+        if not transaction.get_connection().in_atomic_block:
+            # read outside a transaction, the fields are committed whatever happened before
+            self._uncommitted.discard(service.pk)
+
+        if service.pk not in self._uncommitted:
+            self._schemas[service.pk] = schema
+
+        return schema
+
+    def resolve(self, service: Service, specs: Iterable[FieldSpec]) -> dict[tuple[str, Optional[str]], Field]:
+        """
+        Maps each ``(name, form_type)`` of ``specs`` to a Field of the service,
+        creating the missing ones. Specs that match no field and can't be
+        created (unknown form type) are left out of the result.
+        """
+        specs = list(dict.fromkeys(specs))
+        schema = self.get(service)
+
+        if any(schema.find(spec.name, spec.form_type) is None for spec in specs):
+            # another process may have added them since the schema was read
+            schema = self.refresh(service)
+
+        # a copy, the cached schema only learns about the new fields from the database
+        schema = ServiceSchema(list(schema.fields))
+        next_order = schema.next_order
+        resolved = {}
+        missing = []
+
+        for spec in specs:
+            key = (spec.name, spec.form_type)
+
+            if key in resolved:
+                continue
+
+            if (field := schema.find(spec.name, spec.form_type)) is None:
+                if spec.form_type not in FORM_TYPE_MAP:
+                    continue
+
+                field = Field(service=service, name=spec.name, description=spec.description, form_type=spec.form_type)
+                missing.append(field)
+                schema.by_name.setdefault(field.name, []).append(field)
+
+            resolved[key] = field
+
+        if missing:
+            self.create(service, next_order, missing)
+
+        return resolved
+
+    def create(self, service: Service, next_order: int, fields: list[Field]) -> None:
+        for position, field in enumerate(fields):
+            field.order = next_order + position
+
+        # bulk_create sends no post_save
+        Field.objects.bulk_create(fields)
+        self.changed(service.pk)
+
+        if any(field.pk is None for field in fields):
+            # backends that can't return the new ids, read them back
+            fresh = self.refresh(service)
+
+            for field in fields:
+                field.pk = fresh.find(field.name, field.form_type).pk
+
+    def changed(self, service_id: int) -> None:
+        """
+        Drops the schema of a service whose fields were written, it is only
+        cached again once the current transaction (if any) commits.
+        """
+        with self._lock:
+            self._schemas.pop(service_id, None)
+            self._uncommitted.add(service_id)
+
+        transaction.on_commit(lambda: self._committed(service_id))
+        # the field listings change too
+        response_cache.bump(service_id)
+
+    def _committed(self, service_id: int) -> None:
+        with self._lock:
+            # another thread may have cached the schema before the commit
+            self._schemas.pop(service_id, None)
+            self._uncommitted.discard(service_id)
+
+    def invalidate(self, service_id: Optional[int] = None) -> None:
+        with self._lock:
+            if service_id is None:
+                self._schemas.clear()
+
+            else:
+                self._schemas.pop(service_id, None)
+
+
+schemas = SchemaCache()
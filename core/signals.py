@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import response_cache
+from core.models import FORM_TYPE_MAP, Field, Form, Object, Service, service_names
+from core.schema import schemas
+
+
+@receiver([post_save, post_delete], sender=Service)
+def invalidate_service_names(sender, **kwargs):
+    service_names.invalidate()
+
+
+@receiver(post_delete, sender=Service)
+def invalidate_service_schema(sender, instance, **kwargs):
+    schemas.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Field)
+def invalidate_field_schema(sender, instance, **kwargs):
+    schemas.changed(instance.service_id)
+
+
+@receiver([post_save, post_delete], sender=Service)
+def invalidate_service_responses(sender, instance, **kwargs):
+    response_cache.bump(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Object)
+def invalidate_object_responses(sender, instance, **kwargs):
+    response_cache.bump(instance.service_id)
+
+
+def invalidate_form_responses(sender, instance, **kwargs):
+    # the related objects are usually at hand, look the service up otherwise
+    if Form.object.is_cached(instance):
+        service_id = instance.object.service_id
+
+    elif Form.field.is_cached(instance):
+        service_id = instance.field.service_id
+
+    else:
+        service_id = Object.objects.filter(pk=instance.object_id).values_list("service_id", flat=True).first()
+
+    if service_id is not None:
+        response_cache.bump(service_id)
+
+
+# signals are sent for the saved class, not its parents
+for form_cls in {Form, *FORM_TYPE_MAP.values()}:
+    post_save.connect(invalidate_form_responses, sender=form_cls)
+    post_delete.connect(invalidate_form_responses, sender=form_cls)
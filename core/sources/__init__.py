@@ -0,0 +1,15 @@
+"""
+The APIs the bizrule command can ingest, one module per source.
+
+A source module defines ``MAPPING`` (a ``core.mapping.SourceMapping``) and
+``fetcher(timeout=None, cache=None)`` returning the paginated
+``core.fetchers.Fetcher`` of its API. Adding a source is adding a module
+here and listing it below.
+"""
+from core.sources import marvel, pokemon, scryfall
+
+SOURCE_MODULES = {
+    "pokemon": pokemon,
+    "marvel": marvel,
+    "scryfall": scryfall,
+}
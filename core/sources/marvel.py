@@ -0,0 +1,30 @@
+from core.fetchers import MarvelFetcher
+from core.mapping import FieldMapping, SourceMapping
+from core.models import Field
+from core.secret import api_key
+
+
+# the comic lists a price per format, the print one is kept
+def print_price(prices: list[dict]) -> float:
+    return next((price.get("price", 0.0) for price in prices if price.get("type") == "printPrice"), 0.0)
+
+
+MAPPING = SourceMapping(
+    service="MarvelComicCollection",
+    description="Collection of Marvel Comics books",
+    key="id",
+    fields=[
+        FieldMapping("title", "Name of the Marvel comic book", Field.TEXT, "title", default=""),
+        FieldMapping("pageCount", "The number of pages of the Marvel comic book", Field.INTEGER, "pageCount"),
+        FieldMapping("resourceURI", "The resource URI of the Marvel comic book", Field.URL, "resourceURI", default=""),
+        FieldMapping("price", "The print price of the Marvel comic book", Field.FLOAT, "prices", print_price, 0.0),
+    ],
+)
+
+
+def fetcher(timeout=None, cache=None) -> MarvelFetcher:
+    # API KEYS
+    public_key = api_key.get("marvel_public_key", "")
+    private_key = api_key.get("marvel_private_key", "")
+
+    return MarvelFetcher(public_key, private_key, timeout=timeout, cache=cache)
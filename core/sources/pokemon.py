@@ -0,0 +1,21 @@
+from core.fetchers import PokemonFetcher
+from core.mapping import FieldMapping, SourceMapping, slash_date
+from core.models import Field
+from core.secret import api_key
+
+MAPPING = SourceMapping(
+    service="pokemonSetCollection",
+    description="Collection of pokemon Card Sets",
+    key="id",
+    fields=[
+        FieldMapping("SetName", "Name of the pokemon set", Field.TEXT, "name", default=""),
+        FieldMapping("Series", "Series of the pokemon set", Field.TEXT, "series", default=""),
+        FieldMapping("TotalCards", "Total number of cards in the set", Field.INTEGER, "printedTotal", default=0),
+        FieldMapping("ReleaseDate", "Release date of the pokemon set", Field.DATE, "releaseDate", slash_date),
+        FieldMapping("symbol", "Pokemon set symbol URL", Field.URL, "images.symbol", default=""),
+    ],
+)
+
+
+def fetcher(timeout=None, cache=None) -> PokemonFetcher:
+    return PokemonFetcher(api_key.get("pokemon_key", ""), timeout=timeout, cache=cache)
@@ -0,0 +1,19 @@
+from core.fetchers import ScryfallFetcher
+from core.mapping import FieldMapping, SourceMapping, iso_date
+from core.models import Field
+
+MAPPING = SourceMapping(
+    service="scryfallSets",
+    description="List of all Scryfall Card Sets",
+    key="code",
+    fields=[
+        FieldMapping("SetName", "Name of the scryfall set", Field.TEXT, "name", default=""),
+        FieldMapping("SetType", "Type of the scryfall set", Field.TEXT, "set_type", default=""),
+        FieldMapping("CardCount", "Total number of cards in the set", Field.INTEGER, "card_count", default=0),
+        FieldMapping("ReleaseDate", "Release date of the scryfall set", Field.DATE, "released_at", iso_date),
+    ],
+)
+
+
+def fetcher(timeout=None, cache=None) -> ScryfallFetcher:
+    return ScryfallFetcher(timeout=timeout, cache=cache)
@@ -0,0 +1,231 @@
+"""
+Incremental JSON parsing for request bodies too large to load in one go.
+
+Only one chunk of the stream and the value currently being decoded are held in
+memory, array values can be consumed element by element as they are read.
+"""
+import codecs
+import json
+from itertools import chain
+from typing import Any, BinaryIO, Iterable, Iterator, Optional
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+
+class ImportFormatError(ValueError):
+    """The body is valid JSON but not an import, e.g. an object that isn't a JSON object."""
+
+
+class JSONStreamReader:
+    def __init__(self, stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+
+        data = self.stream.read(self.chunk_size)
+
+        if not data:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b"", final=True)
+
+        else:
+            self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(data)
+
+        self.pos = 0
+
+        return not self.eof
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, *chars: str) -> str:
+        char = self.peek()
+
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.buffer, self.pos)
+
+        self.pos += 1
+
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+            except json.JSONDecodeError as err:
+                # only a value cut off by the end of the chunk is worth reading more for,
+                # a syntax error is raised before the rest of the body is buffered
+                if self.eof or not self.truncated(err):
+                    raise
+
+                self.fill()
+                continue
+
+            # a number (or literal) running to the end of the buffer may continue in the next chunk,
+            # so may one whose exponent or fraction was cut, "1.", "1e" and "1e+" are decoded as 1
+            rest = self.buffer[end:]
+            cut_number = isinstance(value, (int, float)) and len(rest) <= 2 and NUMBER_CHARS.issuperset(rest)
+
+            if (not rest or cut_number) and not self.eof:
+                self.fill()
+                continue
+
+            self.pos = end
+
+            return value
+
+    def truncated(self, err: json.JSONDecodeError) -> bool:
+        """Whether more of the stream could complete the value ``err`` was raised for."""
+        rest = self.buffer[err.pos:]
+
+        return (
+            err.pos == len(self.buffer)
+            or err.msg.startswith("Unterminated string")
+            # at the "u", an escape ending the buffer is rejected even once its 4 hex digits are read
+            or (err.msg.startswith("Invalid \\uXXXX escape") and len(rest) <= 5)
+            or any(literal.startswith(rest) for literal in LITERALS)
+        )
+
+    def array(self) -> Iterator[Any]:
+        self.expect("[")
+
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+
+            if self.expect(",", "]") == "]":
+                return
+
+    def items(self, streamed_keys: Iterable[str] = ()) -> Iterator[tuple[str, Any]]:
+        """
+        Yields the ``(key, value)`` pairs of a top-level object, arrays under
+        ``streamed_keys`` are yielded as iterators that must be consumed before
+        the next pair is read (any remainder is skipped).
+        """
+        self.expect("{")
+
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(":")
+
+            if key in streamed_keys and self.peek() == "[":
+                elements = self.array()
+                yield key, elements
+
+                for _ in elements:
+                    pass
+
+            else:
+                yield key, self.value()
+
+            if self.expect(",", "}") == "}":
+                return
+
+
+def iter_ndjson(stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    buffer = b""
+
+    while True:
+        data = stream.read(chunk_size)
+        lines = (buffer + data).split(b"\n")
+        buffer = lines.pop() if data else b""
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+        if not data:
+            return
+
+
+def read_json_import(stream: BinaryIO, service: Optional[str] = None) -> tuple[Optional[str], Iterator[dict]]:
+    """
+    Returns the service name and an iterator over the ``objects`` of a
+    ``{"service": ..., "objects": [...]}`` body, reading the objects lazily when
+    the service is known before the array starts.
+    """
+    items = JSONStreamReader(stream).items(streamed_keys=["objects"])
+    buffered: list = []
+
+    for key, value in items:
+        if key == "service":
+            service = service or _service_name(value)
+
+        elif key == "objects":
+            # arrays under "objects" come as iterators, anything else isn't a list of objects
+            if not isinstance(value, Iterator):
+                raise ImportFormatError("objects must be an array")
+
+            if service:
+                return service, _objects(chain(value, _exhaust(items)))
+
+            # the service comes after the objects, nothing can be written until it is known
+            buffered = list(value)
+
+    return service, _objects(iter(buffered))
+
+
+def read_ndjson_import(stream: BinaryIO, service: Optional[str] = None) -> tuple[Optional[str], Iterator[dict]]:
+    """
+    Returns the service name and an iterator over the objects of a newline
+    delimited body, the first line may be a ``{"service": ...}`` header (required
+    unless the service is passed in).
+    """
+    lines = iter_ndjson(stream)
+    first = next(lines, None)
+
+    if isinstance(first, dict) and "service" in first:
+        service = service or _service_name(first["service"])
+
+    elif first is not None:
+        lines = chain([first], lines)
+
+    return service, _objects(lines)
+
+
+def _service_name(value: Any) -> Optional[str]:
+    if value is not None and not isinstance(value, str):
+        raise ImportFormatError("service must be a string")
+
+    return value
+
+
+def _objects(values: Iterator[Any]) -> Iterator[dict]:
+    for value in values:
+        if not isinstance(value, dict):
+            raise ImportFormatError(f"objects must be JSON objects, got {type(value).__name__}")
+
+        yield value
+
+
+def _exhaust(iterator: Iterator) -> Iterator:
+    for _ in iterator:
+        pass
+
+    yield from ()
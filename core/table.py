@@ -0,0 +1,112 @@
+"""
+A Service read back as the table it models: one row per Object keyed by its
+human ID and one column per Field (in ``Field.order``).
+
+Every form type is read with a single query ordered by object, and the
+per-type streams are merged, so rows come out one at a time without holding
+the whole service in memory.
+"""
+import csv
+import heapq
+import io
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.models import FORM_TYPE_MAP, Field, Object, Service
+
+CHUNK_SIZE = 2000
+
+
+class ServiceTable:
+    def __init__(self, service: Service):
+        self.service = service
+        # read on every request, the schema cache only sees the field changes of its own process
+        self.fields = list(Field.objects.filter(service=service).order_by("order", "id"))
+
+    @property
+    def columns(self) -> list[str]:
+        return [field.name for field in self.fields]
+
+    def _cells(self) -> Iterator[tuple[int, int, Any]]:
+        streams = [
+            form_cls.objects.non_polymorphic()
+            .filter(object__service=self.service, generation__lte=self.service.generation)
+            .order_by("object_id")
+            .values_list("object_id", "field_id", "value")
+            .iterator(chunk_size=CHUNK_SIZE)
+            for form_cls in {FORM_TYPE_MAP[field.form_type] for field in self.fields}
+        ]
+
+        return heapq.merge(*streams, key=itemgetter(0))
+
+    def rows(self) -> Iterator[tuple[str, list]]:
+        """
+        Yields ``(human_id, values)`` with one value per column (``None`` for
+        a missing cell).
+        """
+        positions = {field.id: position for position, field in enumerate(self.fields)}
+        cells = groupby(self._cells(), key=itemgetter(0))
+        object_id, object_cells = next(cells, (None, ()))
+
+        objects = (
+            # objects of an import that isn't published yet are left out, their cells skipped below
+            Object.objects.filter(service=self.service, generation__lte=self.service.generation)
+            .order_by("id")
+            .values_list("id", "object_counter")
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+
+        for id_, object_counter in objects:
+            values = [None] * len(self.fields)
+
+            # skip cells of objects that aren't part of the listing
+            while object_id is not None and object_id < id_:
+                object_id, object_cells = next(cells, (None, ()))
+
+            if object_id == id_:
+                for _, field_id, value in object_cells:
+                    if field_id in positions:
+                        values[positions[field_id]] = value
+
+                object_id, object_cells = next(cells, (None, ()))
+
+            yield f"{self.service.name}-{object_counter}", values
+
+    def iter_json(self) -> Iterator[str]:
+        encoder = DjangoJSONEncoder()
+
+        yield '{"service": %s, "columns": %s, "rows": [' % (
+            encoder.encode(self.service.name),
+            encoder.encode(["human_id"] + self.columns),
+        )
+
+        for position, (human_id, values) in enumerate(self.rows()):
+            yield ("," if position else "") + encoder.encode([human_id] + values)
+
+        yield "]}"
+
+    def iter_json_lines(self) -> Iterator[str]:
+        encoder = DjangoJSONEncoder()
+        columns = ["human_id"] + self.columns
+
+        for human_id, values in self.rows():
+            yield encoder.encode(dict(zip(columns, [human_id] + values))) + "\n"
+
+    def iter_csv(self) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        writer.writerow(["human_id"] + self.columns)
+
+        for human_id, values in self.rows():
+            writer.writerow([human_id] + ["" if value is None else value for value in values])
+
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
@@ -1,6 +1,1575 @@
+import base64
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import (
+    benchmarks, biz_rule, fetchers, http_cache, http_client, ingest, instrumentation, mapping, models, purge, response_cache,
+    schema, sources, streaming,
+)
+from core.pipeline import Pipeline
+from core.views import IdSpans, ImportResult
 
 
 class BizRuleTests(TestCase):
     def test_fail(self):
         self.fail()
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Answers each ``get`` with the next payload, recording the requests."""
+
+    def __init__(self, payloads):
+        self.payloads = list(payloads)
+        self.requests = []
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append((url, dict(params or {})))
+        return FakeResponse(self.payloads.pop(0))
+
+
+class ListFetcher(fetchers.Fetcher):
+    """Serves ``pages`` of records, raising ``error`` instead if given."""
+
+    def __init__(self, pages, error=None, barrier=None, **kwargs):
+        super().__init__(**kwargs)
+        self.listed = pages
+        self.error = error
+        self.barrier = barrier
+
+    def first_request(self):
+        return {"url": "page", "params": {"page": 0}}
+
+    def fetch_page(self, request):
+        if self.barrier:
+            self.barrier.wait()
+
+        if self.error:
+            raise self.error
+
+        page = request["params"]["page"]
+        next_request = {"url": "page", "params": {"page": page + 1}} if page + 1 < len(self.listed) else None
+
+        return fetchers.Page(self.listed[page], next_request, request=request)
+
+
+class FetcherTests(TestCase):
+    def test_pokemon_follows_page_numbers(self):
+        fetcher = fetchers.PokemonFetcher("key", page_size=2)
+        fetcher.session = FakeSession([
+            {"data": [{"id": 1}, {"id": 2}], "totalCount": 3},
+            {"data": [{"id": 3}], "totalCount": 3},
+        ])
+
+        self.assertEqual([record["id"] for record in fetcher.records()], [1, 2, 3])
+        self.assertEqual([params["page"] for _, params in fetcher.session.requests], [1, 2])
+
+    def test_marvel_follows_offsets(self):
+        fetcher = fetchers.MarvelFetcher("public", "private", page_size=2)
+        fetcher.session = FakeSession([
+            {"data": {"offset": 0, "count": 2, "total": 3, "results": [{"id": 1}, {"id": 2}]}},
+            {"data": {"offset": 2, "count": 1, "total": 3, "results": [{"id": 3}]}},
+        ])
+
+        self.assertEqual([record["id"] for record in fetcher.records()], [1, 2, 3])
+        self.assertEqual([params["offset"] for _, params in fetcher.session.requests], [0, 2])
+        self.assertEqual(fetcher.session.requests[0][1]["apikey"], "public")
+
+    def test_scryfall_follows_next_page(self):
+        fetcher = fetchers.ScryfallFetcher()
+        fetcher.session = FakeSession([
+            {"data": [{"id": 1}], "has_more": True, "next_page": "https://api.scryfall.com/sets?page=2"},
+            {"data": [{"id": 2}], "has_more": False},
+        ])
+
+        self.assertEqual([record["id"] for record in fetcher.records()], [1, 2])
+        self.assertEqual(fetcher.session.requests[1][0], "https://api.scryfall.com/sets?page=2")
+
+    def test_next_page_is_requested_while_the_current_one_is_consumed(self):
+        requested = threading.Event()
+
+        class RecordingFetcher(ListFetcher):
+            def fetch_page(self, request):
+                if request["params"]["page"] == 1:
+                    requested.set()
+
+                return super().fetch_page(request)
+
+        records = RecordingFetcher([[1, 2], [3]]).records()
+
+        self.assertEqual(next(records), 1)
+        self.assertTrue(requested.wait(5))
+        self.assertEqual(list(records), [2, 3])
+
+
+class StatusSession:
+    """Answers each ``get`` with the next ``(status, headers)`` or raises it if it is an exception."""
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def get(self, url, params=None, **kwargs):
+        self.calls += 1
+        answer = self.answers.pop(0)
+
+        if isinstance(answer, Exception):
+            raise answer
+
+        response = requests.Response()
+        response.status_code, headers = answer
+        response.headers.update(headers)
+
+        return response
+
+
+class HTTPClientTests(TestCase):
+    URL = "https://api.example.com/sets"
+
+    def setUp(self):
+        patcher = mock.patch.object(http_client.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def http_client(self, *answers, **options):
+        return http_client.HTTPClient(StatusSession(answers), **options)
+
+    def test_retries_server_errors_with_backoff(self):
+        client = self.http_client((503, {}), requests.ConnectionError(), (200, {}), BACKOFF=1)
+
+        self.assertEqual(client.get(self.URL).status_code, 200)
+
+        metrics = client.metrics.hosts["api.example.com"]
+        self.assertEqual((metrics.requests, metrics.retries, metrics.failures), (3, 2, 0))
+        # full jitter, the nth retry waits at most BACKOFF * 2 ** n
+        first, second = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertLessEqual(first, 1)
+        self.assertLessEqual(second, 2)
+
+    def test_honours_retry_after(self):
+        client = self.http_client((429, {"Retry-After": "3"}), (200, {}))
+
+        client.get(self.URL)
+
+        self.sleep.assert_called_once_with(3.0)
+
+    def test_gives_up_after_the_last_retry(self):
+        client = self.http_client((500, {}), (500, {}), (500, {}), MAX_RETRIES=2)
+
+        self.assertEqual(client.get(self.URL).status_code, 500)
+        self.assertEqual(client.metrics.hosts["api.example.com"].failures, 1)
+        self.assertEqual(client.session.calls, 3)
+
+    def test_long_retry_after_is_not_waited_for(self):
+        client = self.http_client((429, {"Retry-After": "3600"}), (200, {}))
+
+        self.assertEqual(client.get(self.URL).status_code, 429)
+        self.sleep.assert_not_called()
+
+    def test_rate_limit_is_per_host(self):
+        client = self.http_client(*[(200, {})] * 3, RATE_LIMITS={"api.example.com": 10})
+
+        client.get(self.URL)
+        client.get(self.URL)
+        client.get("https://other.example.com/sets")
+
+        # the second call to the limited host waits for a token, the other host isn't limited
+        self.assertEqual(len(self.sleep.call_args_list), 1)
+        self.assertAlmostEqual(self.sleep.call_args.args[0], 0.1, delta=0.01)
+        self.assertGreater(client.metrics.hosts["api.example.com"].throttled, 0)
+
+    def test_metrics_are_counted_across_threads(self):
+        client = self.http_client(*[(200, {})] * 400)
+
+        def fetch():
+            for _ in range(50):
+                client.get(self.URL)
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(client.metrics.hosts["api.example.com"].requests, 400)
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    """Serves ``server.body`` with its validators, honouring conditional requests."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if (server.etag and self.headers.get("If-None-Match") == server.etag) or (
+            server.last_modified and self.headers.get("If-Modified-Since") == server.last_modified
+        ):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps(server.body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        if server.etag:
+            self.send_header("ETag", server.etag)
+
+        if server.last_modified:
+            self.send_header("Last-Modified", server.last_modified)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPCacheTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPIHandler)
+        self.server.requests = []
+        self.server.body = {"data": [{"code": "a", "name": "Set a"}], "has_more": False}
+        self.server.etag = '"v1"'
+        self.server.last_modified = None
+        self.url = f"http://127.0.0.1:{self.server.server_port}/sets"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = http_cache.HTTPCache(directory.name)
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+
+    def test_revalidates_with_etag(self):
+        first = self.cache.get(self.session, self.url)
+        second = self.cache.get(self.session, self.url)
+
+        self.assertFalse(first.not_modified)
+        self.assertTrue(second.not_modified)
+        self.assertEqual(second.json(), self.server.body)
+        self.assertEqual(self.server.requests[1]["If-None-Match"], '"v1"')
+
+    def test_revalidates_with_last_modified(self):
+        self.server.etag = None
+        self.server.last_modified = "Sun, 18 Oct 2026 10:00:00 GMT"
+
+        self.cache.get(self.session, self.url)
+        second = self.cache.get(self.session, self.url)
+
+        self.assertTrue(second.not_modified)
+        self.assertEqual(self.server.requests[1]["If-Modified-Since"], self.server.last_modified)
+
+    def test_changed_body_replaces_the_entry(self):
+        self.cache.get(self.session, self.url)
+        self.server.body = {"data": [], "has_more": False}
+        self.server.etag = '"v2"'
+
+        response = self.cache.get(self.session, self.url)
+
+        self.assertFalse(response.not_modified)
+        self.assertEqual(self.cache.get(self.session, self.url).json(), {"data": [], "has_more": False})
+
+    def test_max_age_skips_the_request(self):
+        self.cache.max_age = 60
+
+        self.cache.get(self.session, self.url)
+        response = self.cache.get(self.session, self.url)
+
+        self.assertTrue(response.not_modified)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_ignored_params_share_an_entry(self):
+        self.cache.get(self.session, self.url, params={"offset": 0, "ts": "1"}, ignore_params={"ts"})
+        response = self.cache.get(self.session, self.url, params={"offset": 0, "ts": "2"}, ignore_params={"ts"})
+
+        self.assertTrue(response.not_modified)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get(self.session, self.url, params={"page": 1})
+        self.cache.get(self.session, self.url, params={"page": 2})
+        self.cache.max_size = len(json.dumps(self.server.body)) * 2
+
+        # touch page 1 so page 2 is the least recently used
+        self.cache._read_body(self.cache.key(self.url, {"page": 1}))
+        os.utime(self.cache.directory / f"{self.cache.key(self.url, {'page': 2})}.body", (0, 0))
+        self.cache.get(self.session, self.url, params={"page": 3})
+
+        self.assertIsNotNone(self.cache._read_meta(self.cache.key(self.url, {"page": 1})))
+        self.assertIsNone(self.cache._read_meta(self.cache.key(self.url, {"page": 2})))
+        self.assertIsNotNone(self.cache._read_meta(self.cache.key(self.url, {"page": 3})))
+
+    def test_unchanged_source_skips_the_ingest(self):
+        written = []
+
+        class StubFetcher(fetchers.ScryfallFetcher):
+            url = self.url
+
+        sources = {
+            "scryfall": (
+                lambda timeout, cache: StubFetcher(timeout=timeout, cache=cache),
+                lambda records, batch_size, resume: written.append(list(records)) or True,
+            ),
+        }
+
+        with mock.patch.object(biz_rule, "SOURCES", sources), mock.patch.object(
+            biz_rule, "_http_cache", lambda max_age: self.cache
+        ):
+            biz_rule.main(sources=["scryfall"])
+            biz_rule.main(sources=["scryfall"])
+
+        self.assertEqual(len(written), 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class BizRuleMainTests(TestCase):
+    def test_fetches_overlap_and_writes_stay_on_main_thread(self):
+        # both first pages must be in flight at once for either to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        written = []
+
+        def write(records, batch_size, resume):
+            written.append((threading.current_thread() is threading.main_thread(), [record for _, record in records]))
+
+        sources = {
+            "a": (lambda timeout, cache: ListFetcher([[1]], barrier=barrier), write),
+            "b": (lambda timeout, cache: ListFetcher([[2]], barrier=barrier), write),
+        }
+
+        with mock.patch.object(biz_rule, "SOURCES", sources):
+            biz_rule.main(sources=["a", "b"], max_workers=2, use_cache=False)
+
+        self.assertEqual(sorted(records for _, records in written), [[1], [2]])
+        self.assertTrue(all(on_main_thread for on_main_thread, _ in written))
+
+    def test_failed_fetch_skips_only_that_source(self):
+        written = []
+
+        sources = {
+            "a": (
+                lambda timeout, cache: ListFetcher([], error=ConnectionError("unreachable")),
+                lambda records, batch_size, resume: written.append("a"),
+            ),
+            "b": (lambda timeout, cache: ListFetcher([[]]), lambda records, batch_size, resume: written.append("b")),
+        }
+
+        with mock.patch.object(biz_rule, "SOURCES", sources):
+            biz_rule.main(sources=["a", "b"], use_cache=False)
+
+        self.assertEqual(written, ["b"])
+
+    def test_resume_starts_at_the_checkpoint_cursor(self):
+        service = models.Service.objects.create(name="a", description="a")
+        models.ImportCheckpoint.objects.create(
+            source="a", service=service, generation=1, cursor={"url": "page", "params": {"page": 1}}, rows=1
+        )
+        written = []
+
+        sources = {
+            "a": (
+                lambda timeout, cache: ListFetcher([[1], [2], [3]]),
+                lambda records, batch_size, resume: written.extend((record, resume) for _, record in records),
+            ),
+        }
+
+        with mock.patch.object(biz_rule, "SOURCES", sources):
+            biz_rule.main(sources=["a"], use_cache=False, resume=True)
+
+        self.assertEqual(written, [(2, True), (3, True)])
+
+
+class BulkIngestTests(TestCase):
+    COLUMNS = [
+        ingest.Column("SetName", "Name of the set", models.Field.TEXT),
+        ingest.Column("CardCount", "Total number of cards in the set", models.Field.INTEGER),
+        ingest.Column("ReleaseDate", "Release date of the set", models.Field.DATE),
+    ]
+
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+
+    def rows(self, count):
+        return [
+            {"SetName": f"Set {i}", "CardCount": i, "ReleaseDate": "2023-01-01"}
+            for i in range(count)
+        ]
+
+    def test_bulk_ingest_writes_objects_and_forms(self):
+        objects = ingest.bulk_ingest(self.service, self.COLUMNS, self.rows(5), batch_size=2)
+
+        self.assertEqual([obj.object_counter for obj in objects], [1, 2, 3, 4, 5])
+        self.assertEqual(models.Field.objects.filter(service=self.service).count(), 3)
+        self.assertEqual(models.Form.objects.count(), 15)
+
+        obj = models.Object.load("sets-3")
+        values = {form.field.name: form.value for form in obj.form_set.all()}
+        self.assertEqual(values["SetName"], "Set 2")
+        self.assertEqual(values["CardCount"], 2)
+        self.assertIsInstance(obj.form_set.get(field__name="ReleaseDate"), models.DateForm)
+
+    def test_bulk_ingest_continues_object_counter(self):
+        models.Object(service=self.service).save()
+
+        objects = ingest.bulk_ingest(self.service, self.COLUMNS, self.rows(2))
+
+        self.assertEqual([obj.object_counter for obj in objects], [2, 3])
+
+    def test_bulk_ingest_queries_scale_with_batches(self):
+        ingest.resolve_fields(self.service, self.COLUMNS)
+
+        models.ObjectCounter.reserve(self.service, 0)
+
+        # the schema, then per batch: savepoint pair, counter, objects, and parent + subclass insert per form type
+        with self.assertNumQueries(1 + 2 * (2 + 1 + 1 + 2 * 3)):
+            ingest.bulk_ingest(self.service, self.COLUMNS, self.rows(40), batch_size=20)
+
+
+class SyncIngestTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+
+    def rows(self, *codes, count=1):
+        return [(code, {"SetName": f"Set {code}", "CardCount": count, "ReleaseDate": "2023-01-01"}) for code in codes]
+
+    def values(self):
+        return {
+            obj.natural_key: (obj.object_counter, {form.field.name: form.value for form in obj.form_set.all()}["CardCount"])
+            for obj in models.Object.objects.filter(service=self.service)
+        }
+
+    def test_first_run_creates_everything(self):
+        result = ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a", "b", "c"), batch_size=2)
+
+        self.assertEqual(result, ingest.SyncResult(created=3, updated=0, unchanged=0, deleted=0))
+        self.assertEqual(self.values(), {"a": (1, 1), "b": (2, 1), "c": (3, 1)})
+
+    def test_unchanged_run_writes_nothing(self):
+        ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a", "b", "c"))
+
+        with CaptureQueriesContext(connection) as queries:
+            result = ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a", "b", "c"))
+
+        self.assertEqual(result, ingest.SyncResult(created=0, updated=0, unchanged=3, deleted=0))
+        self.assertFalse([query for query in queries if not query["sql"].startswith(("SELECT", "SAVEPOINT", "RELEASE"))])
+
+    def test_only_the_delta_is_written(self):
+        ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a", "b", "c"))
+
+        rows = self.rows("a") + self.rows("b", count=5) + self.rows("d")
+        result = ingest.sync_ingest(self.service, self.COLUMNS, rows)
+
+        self.assertEqual(result, ingest.SyncResult(created=1, updated=1, unchanged=1, deleted=1))
+        # changed rows keep their human ID, new ones continue the counter
+        self.assertEqual(self.values(), {"a": (1, 1), "b": (2, 5), "d": (4, 1)})
+        self.assertEqual(models.Form.objects.count(), 9)
+
+    def test_changed_rows_keep_their_object(self):
+        ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a", "b"))
+        obj = models.Object.objects.get(natural_key="b")
+        note = models.Field.objects.create(service=self.service, name="Note", form_type=models.Field.CHAR)
+        models.CharacterForm.objects.create(object=obj, field=note, value="reprinted")
+
+        result = ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a") + self.rows("b", count=5))
+
+        self.assertEqual(result, ingest.SyncResult(created=0, updated=1, unchanged=1, deleted=0))
+        self.assertEqual(models.Object.objects.get(natural_key="b").pk, obj.pk)
+        # forms outside the mapping aren't touched by the sync
+        self.assertEqual(obj.form_set.get(field=note).value, "reprinted")
+        self.assertEqual(self.values(), {"a": (1, 1), "b": (2, 5)})
+
+    def test_unkeyed_objects_are_kept(self):
+        # objects of the customer API have no natural key, a sync can't tell whether they vanished
+        ingest.bulk_ingest(self.service, self.COLUMNS, [row for _, row in self.rows("x")])
+
+        result = ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a"))
+
+        self.assertEqual(result, ingest.SyncResult(created=1, updated=0, unchanged=0, deleted=0))
+        self.assertEqual(self.values(), {None: (1, 1), "a": (2, 1)})
+
+    def test_first_keyed_import_replaces_legacy_rows(self):
+        # written by bizrule before the imports had natural keys
+        ingest.bulk_ingest(self.service, self.COLUMNS, [row for _, row in self.rows("a", "b")])
+
+        def sync():
+            batch = ingest.ColumnBatch(["a"], [["Set a"], [1], ["2023-01-01"]])
+
+            return ingest.sync_ingest_columns(self.service, self.COLUMNS, [batch], replace_legacy=True)
+
+        self.assertEqual(ingest.legacy_objects(self.service).count(), 2)
+        self.assertEqual(sync(), ingest.SyncResult(created=1, updated=0, unchanged=0, deleted=2))
+        self.assertEqual(self.values(), {"a": (3, 1)})
+
+        # once the service has keyed rows, an unkeyed one comes from somewhere else and is kept
+        models.Object(service=self.service).save()
+
+        self.assertFalse(ingest.legacy_objects(self.service).exists())
+        self.assertEqual(sync(), ingest.SyncResult(created=0, updated=0, unchanged=1, deleted=0))
+        self.assertEqual(models.Object.objects.filter(service=self.service).count(), 2)
+
+    def test_sync_keeps_customer_api_objects(self):
+        self.service.name = "crm"
+        self.service.save()
+        ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a"))
+        self.client.post(
+            reverse("customer_api"),
+            data={"service": "crm", "objects": [{"fields": [{"name": "CardCount", "value": 7}]}]},
+            content_type="application/json",
+        )
+
+        result = ingest.sync_ingest(self.service, self.COLUMNS, self.rows("a"))
+
+        self.assertEqual(result, ingest.SyncResult(created=0, updated=0, unchanged=1, deleted=0))
+        self.assertEqual(self.values(), {"a": (1, 1), None: (2, 7)})
+
+
+class ImportCheckpointTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+        ingest.sync_ingest(self.service, self.COLUMNS, SyncIngestTests.rows(None, "a", "b"))
+
+    # one row per batch, the cursor being the position of its page
+    def batches(self, *codes, count, fail_at=None):
+        for position, code in enumerate(codes):
+            if position == fail_at:
+                raise ConnectionError("interrupted")
+
+            yield ingest.ColumnBatch([code], [[f"Set {code}"], [count], ["2023-01-01"]], cursor={"page": position})
+
+    def published(self):
+        return {
+            obj.natural_key: (obj.object_counter, {form.field.name: form.value for form in obj.form_set.published()}["CardCount"])
+            for obj in models.Object.objects.published().filter(service=self.service)
+        }
+
+    def interrupted_import(self):
+        checkpoint = ingest.begin_import(self.service, "sets")
+
+        with self.assertRaises(ConnectionError):
+            ingest.sync_ingest_columns(
+                self.service, self.COLUMNS, self.batches("a", "c", "b", count=5, fail_at=2), checkpoint=checkpoint
+            )
+
+        return checkpoint
+
+    def test_interrupted_import_stays_hidden(self):
+        checkpoint = self.interrupted_import()
+
+        checkpoint.refresh_from_db()
+        self.assertEqual((checkpoint.cursor, checkpoint.last_natural_key, checkpoint.rows), ({"page": 1}, "c", 2))
+        self.assertEqual(self.published(), {"a": (1, 1), "b": (2, 1)})
+        self.assertEqual(models.Object.load("sets-1").generation, 1)
+
+    def test_resume_continues_the_import(self):
+        self.interrupted_import()
+
+        checkpoint = ingest.begin_import(self.service, "sets", resume=True)
+        result = ingest.sync_ingest_columns(self.service, self.COLUMNS, self.batches("c", "b", count=5), checkpoint=checkpoint)
+
+        # c was written before the interruption
+        self.assertEqual(result, ingest.SyncResult(created=0, updated=1, unchanged=1, deleted=0))
+        self.assertEqual(self.published(), {"a": (1, 5), "b": (2, 5), "c": (3, 5)})
+        self.assertEqual(models.Object.objects.count(), 3)
+        self.assertFalse(models.ImportCheckpoint.objects.exists())
+
+    def test_new_import_abandons_the_unfinished_one(self):
+        self.interrupted_import()
+
+        checkpoint = ingest.begin_import(self.service, "sets")
+        result = ingest.sync_ingest_columns(self.service, self.COLUMNS, self.batches("a", count=1), checkpoint=checkpoint)
+
+        self.assertEqual(result, ingest.SyncResult(created=0, updated=0, unchanged=1, deleted=1))
+        self.assertEqual(self.published(), {"a": (1, 1)})
+        self.assertEqual(self.service.generation, 3)
+
+
+class MappingTests(TestCase):
+    MAPPING = mapping.SourceMapping(
+        service="sets",
+        description="Card sets",
+        key="code",
+        fields=[
+            mapping.FieldMapping("SetName", "Name of the set", models.Field.TEXT, "name", default=""),
+            mapping.FieldMapping("CardCount", "Total number of cards", models.Field.INTEGER, "counts.cards", default=0),
+            mapping.FieldMapping("ReleaseDate", "Release date", models.Field.DATE, "released", mapping.slash_date),
+        ],
+    )
+
+    RECORDS = [
+        {"code": "a", "name": "Set a", "counts": {"cards": 3}, "released": "2023/01/02"},
+        {"code": "b", "counts": "unknown", "released": ""},
+    ]
+
+    def test_converter_fills_columns(self):
+        batch = self.MAPPING.compile()(self.RECORDS)
+
+        self.assertEqual(batch.keys, ["a", "b"])
+        self.assertEqual(batch.values, [["Set a", ""], [3, 0], [datetime.date(2023, 1, 2), None]])
+
+    def test_converted_batches_are_ingested(self):
+        service = models.Service.objects.create(name="sets", description="Card sets")
+        converter = self.MAPPING.compile()
+
+        result = ingest.sync_ingest_columns(service, converter.columns, converter.batches(self.RECORDS, 1))
+
+        self.assertEqual(result.created, 2)
+        # the empty release date leaves the cell out
+        self.assertEqual(models.Form.objects.filter(object__natural_key="b").count(), 2)
+        self.assertEqual(
+            models.DateForm.objects.get(object__natural_key="a").value, datetime.date(2023, 1, 2)
+        )
+
+    def test_records_without_a_key_are_skipped(self):
+        service = models.Service.objects.create(name="sets", description="Card sets")
+        converter = self.MAPPING.compile()
+        records = self.RECORDS + [{"name": "No code"}, {"code": None, "name": "Null code"}]
+
+        with self.assertLogs("core.mapping", "WARNING"):
+            batch = converter(records)
+            result = ingest.sync_ingest_columns(service, converter.columns, [converter([{"name": "No code"}]), batch])
+
+        self.assertEqual(batch.keys, ["a", "b"])
+        self.assertEqual(converter.skipped, 3)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(sorted(models.Object.objects.values_list("natural_key", flat=True)), ["a", "b"])
+
+    def test_source_mappings_match_their_services(self):
+        for name, module in sources.SOURCE_MODULES.items():
+            with self.subTest(name):
+                self.assertEqual(len(module.MAPPING.columns), len({column.name for column in module.MAPPING.columns}))
+                self.assertTrue(all(column.form_type in models.FORM_TYPE_MAP for column in module.MAPPING.columns))
+
+
+class SchemaCacheTests(TestCase):
+    SPECS = [
+        schema.FieldSpec("SetName", models.Field.TEXT, "Name of the set"),
+        schema.FieldSpec("CardCount", models.Field.INTEGER, "Total number of cards"),
+    ]
+
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+        schema.schemas.invalidate()
+
+    def test_resolve_creates_fields_in_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            fields = schema.schemas.resolve(self.service, self.SPECS)
+
+        self.assertEqual([field.order for field in fields.values()], [1, 2])
+        self.assertEqual(models.Field.objects.filter(service=self.service).count(), 2)
+
+        # committed, the next import doesn't touch the database
+        schema.schemas.get(self.service)
+
+        with self.assertNumQueries(0):
+            resolved = schema.schemas.resolve(self.service, self.SPECS)
+
+        self.assertEqual({field.pk for field in resolved.values()}, {field.pk for field in fields.values()})
+
+    def test_field_signals_invalidate_the_schema(self):
+        schema.schemas.get(self.service)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Field.objects.create(service=self.service, name="Extra", form_type=models.Field.TEXT)
+
+        self.assertEqual([field.name for field in schema.schemas.get(self.service).fields], ["Extra"])
+
+    def test_rolled_back_fields_are_not_cached(self):
+        try:
+            with transaction.atomic():
+                schema.schemas.resolve(self.service, self.SPECS)
+                schema.schemas.get(self.service)
+                raise RuntimeError
+
+        except RuntimeError:
+            pass
+
+        self.assertEqual(schema.schemas.get(self.service).fields, [])
+
+    def test_field_save_reads_only_the_last_order(self):
+        models.Field.objects.create(service=self.service, name="A", form_type=models.Field.TEXT, order=5)
+
+        with self.assertNumQueries(2):
+            field = models.Field.objects.create(service=self.service, name="B", form_type=models.Field.TEXT)
+
+        self.assertEqual(field.order, 6)
+
+
+class PipelineTests(TestCase):
+    def convert(self, records):
+        return ingest.ColumnBatch([str(record) for record in records], [list(records)])
+
+    def test_batches_keep_their_order(self):
+        pipeline = Pipeline(range(10), self.convert, batch_size=3)
+
+        batches = list(pipeline.batches())
+
+        self.assertEqual([batch.keys for batch in batches], [["0", "1", "2"], ["3", "4", "5"], ["6", "7", "8"], ["9"]])
+        self.assertEqual({stats.rows for stats in pipeline.stats.values()}, {10})
+        self.assertEqual(pipeline.stats["write"].batches, 4)
+
+    def test_errors_reach_the_writer(self):
+        def records():
+            yield 1
+            raise ConnectionError("page 2 failed")
+
+        pipeline = Pipeline(records(), self.convert, batch_size=1)
+
+        with self.assertRaises(ConnectionError):
+            list(pipeline.batches())
+
+    def test_batches_carry_the_cursor_of_their_last_record(self):
+        pipeline = Pipeline([(page, record) for page in (1, 2) for record in range(2)], self.convert, batch_size=3, cursors=True)
+
+        self.assertEqual([(batch.keys, batch.cursor) for batch in pipeline.batches()], [(["0", "1", "0"], 2), (["1"], 2)])
+
+    def test_slow_writer_applies_backpressure(self):
+        pipeline = Pipeline(range(100), self.convert, batch_size=1, queue_size=2)
+        batches = pipeline.batches()
+
+        next(batches)
+        # give the producers time to fill both queues
+        time.sleep(0.3)
+
+        self.assertLessEqual(pipeline.stats["fetch"].rows, 1 + 2 + 1 + 2 + 1)
+        self.assertEqual(pipeline.stats["convert"].max_depth, 2)
+
+        batches.close()
+        self.assertGreater(pipeline.stats["convert"].blocked, 0)
+
+
+class PurgeTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        self.services = []
+
+        for name in ("sets", "cards"):
+            service = models.Service.objects.create(name=name, description=name)
+            rows = [{"SetName": f"Set {i}", "CardCount": i, "ReleaseDate": "2023-01-01"} for i in range(10)]
+            ingest.bulk_ingest(service, self.COLUMNS, rows)
+            self.services.append(service)
+
+    def test_purge_service_deletes_only_its_rows(self):
+        total, counts = purge.purge_service(self.services[0])
+
+        self.assertEqual(counts["core.TextForm"], 10)
+        self.assertEqual(counts["core.Form"], 30)
+        self.assertEqual(counts["core.Object"], 10)
+        self.assertEqual(counts["core.Service"], 1)
+        self.assertEqual(total, 3 * 10 + 30 + 10 + 3 + 1 + 1)
+        self.assertEqual(models.Form.objects.count(), 30)
+        self.assertFalse(models.Service.objects.filter(name="sets").exists())
+        self.assertEqual(models.Object.load("cards-10").object_counter, 10)
+
+    def test_purge_service_query_count_is_independent_of_rows(self):
+        # service ids, savepoint pair, and one delete per subclass, core_form, object, field, counter,
+        # checkpoint and service
+        with self.assertNumQueries(1 + 2 + len(purge.FORM_CLASSES) + 7):
+            purge.purge_services(models.Service.objects.filter(name="sets"))
+
+    def test_purge_objects(self):
+        objects = models.Object.objects.filter(service=self.services[0], object_counter__lte=4)
+
+        total, counts = purge.purge_objects(objects)
+
+        self.assertEqual(counts["core.Object"], 4)
+        self.assertEqual(counts["core.Form"], 12)
+        self.assertEqual(models.Object.objects.filter(service=self.services[0]).count(), 6)
+
+    def test_purge_all(self):
+        total, counts = purge.purge_all()
+
+        self.assertEqual(counts["core.Object"], 20)
+        self.assertFalse(models.Form.objects.exists())
+        self.assertFalse(models.Service.objects.exists())
+
+
+class ObjectCounterTests(TestCase):
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+
+    def test_reserve_returns_contiguous_blocks(self):
+        self.assertEqual(models.ObjectCounter.reserve(self.service, 10), 1)
+        self.assertEqual(models.ObjectCounter.reserve(self.service, 5), 11)
+        self.assertEqual(models.ObjectCounter.reserve(self.service), 16)
+
+    def test_counters_are_per_service(self):
+        other = models.Service.objects.create(name="comics", description="Comics")
+
+        models.ObjectCounter.reserve(self.service, 10)
+
+        self.assertEqual(models.ObjectCounter.reserve(other), 1)
+
+    def test_reserve_seeds_from_existing_objects(self):
+        models.Object.objects.bulk_create([models.Object(service=self.service, object_counter=7)])
+
+        obj = models.Object(service=self.service)
+        obj.save()
+
+        self.assertEqual(obj.object_counter, 8)
+
+    def test_reserve_is_a_single_query(self):
+        models.ObjectCounter.reserve(self.service)
+
+        with self.assertNumQueries(1):
+            models.ObjectCounter.reserve(self.service, 100)
+
+
+class ObjectSaveTests(TestCase):
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+        models.ObjectCounter.reserve(self.service, 0)
+
+    def test_create_allocates_counter_without_lookup(self):
+        obj = models.Object(service=self.service)
+
+        # counter reservation + insert
+        with self.assertNumQueries(2):
+            obj.save()
+
+        self.assertEqual(obj.object_counter, 1)
+
+    def test_update_is_a_single_query(self):
+        obj = models.Object(service=self.service)
+        obj.save()
+
+        with self.assertNumQueries(1):
+            obj.save()
+
+        self.assertEqual(models.Object.objects.get(pk=obj.pk).object_counter, 1)
+
+    def test_update_of_loaded_object_keeps_counter(self):
+        models.Object(service=self.service).save()
+        obj = models.Object.objects.get(object_counter=1)
+
+        with self.assertNumQueries(1):
+            obj.save()
+
+        self.assertEqual(models.ObjectCounter.reserve(self.service), 2)
+
+    def test_preassigned_pk_for_missing_row_is_inserted(self):
+        obj = models.Object(pk=1234, service=self.service)
+
+        # counter reservation, the UPDATE matching no row, then the insert
+        with self.assertNumQueries(3):
+            obj.save()
+
+        obj = models.Object.objects.get(pk=1234)
+        self.assertEqual(obj.object_counter, 1)
+        self.assertEqual(obj.human_id, "sets-1")
+
+
+class HumanIdTests(TestCase):
+    def setUp(self):
+        self.sets = models.Service.objects.create(name="sets", description="Card sets")
+        self.hyphenated = models.Service.objects.create(name="sets-2", description="More card sets")
+
+        for service in (self.sets, self.sets, self.hyphenated):
+            models.Object(service=service).save()
+
+    def test_load_is_a_single_query_once_indexed(self):
+        models.service_names.refresh()
+
+        with self.assertNumQueries(1):
+            obj = models.Object.load("sets-2")
+
+        self.assertEqual((obj.service, obj.object_counter), (self.sets, 2))
+
+    def test_load_disambiguates_hyphenated_service_names(self):
+        obj = models.Object.load("sets-2-1")
+
+        self.assertEqual((obj.service, obj.object_counter), (self.hyphenated, 1))
+
+    def test_load_sees_services_created_after_indexing(self):
+        models.service_names.refresh()
+        comics = models.Service.objects.create(name="comics", description="Comics")
+        models.Object(service=comics).save()
+
+        self.assertEqual(models.Object.load("comics-1").service, comics)
+
+    def service_behind_the_index(self, name):
+        # bulk_create sends no signal, like a service created by another process
+        (service,) = models.Service.objects.bulk_create([models.Service(name=name, description="Tickets")])
+        models.Object(service=service).save()
+        models.Object(service=service).save()
+
+        return service
+
+    def test_hyphenated_service_created_behind_the_index(self):
+        models.service_names.refresh()
+        crm = self.service_behind_the_index("crm-1")
+
+        # split as ticket 1 of "crm" until the index knows "crm-1"
+        self.assertEqual(models.Object.load_many(["crm-1-1", "crm-1-2"])["crm-1-2"].service, crm)
+
+        tickets = self.service_behind_the_index("tickets-1")
+
+        self.assertEqual(models.Object.load("tickets-1-2").service, tickets)
+
+    def test_load_missing_object(self):
+        for human_id in ("sets-99", "unknown-1", "sets"):
+            with self.assertRaises(models.Object.DoesNotExist):
+                models.Object.load(human_id)
+
+    def test_load_many_queries_once_per_service(self):
+        models.service_names.refresh()
+
+        # and one refresh of the index for sets-99, it could be a service created by another process
+        with self.assertNumQueries(2 + 1):
+            objects = models.Object.load_many(["sets-1", "sets-2", "sets-2-1", "sets-99", "bad"])
+
+        self.assertEqual(sorted(objects), ["sets-1", "sets-2", "sets-2-1"])
+        self.assertEqual(objects["sets-2-1"].service, self.hyphenated)
+
+
+class CustomerAPITests(TestCase):
+    def payload(self, objects):
+        return {"service": "crm", "objects": objects}
+
+    def fields(self, i):
+        return [
+            {"name": "title", "type": models.Field.CHAR, "value": f"Ticket {i}"},
+            {"name": "body", "type": models.Field.TEXT, "value": "Lorem ipsum"},
+            {"name": "priority", "type": models.Field.INTEGER, "value": i},
+            {"name": "open", "type": models.Field.BOOLEAN, "value": True},
+        ]
+
+    def post(self, payload):
+        return self.client.post(reverse("customer_api"), data=payload, content_type="application/json")
+
+    def test_post_creates_and_updates_objects(self):
+        self.post(self.payload([{"fields": self.fields(i)} for i in range(3)]))
+
+        self.assertEqual(models.Object.objects.count(), 3)
+        self.assertEqual(models.Field.objects.count(), 4)
+        self.assertEqual(
+            list(models.Field.objects.order_by("order").values_list("name", flat=True)),
+            ["title", "body", "priority", "open"],
+        )
+
+        self.post(self.payload([
+            {"human_id": "crm-2", "fields": [{"name": "priority", "value": 10}]},
+            {"fields": [{"name": "due", "type": models.Field.DATE, "value": "2024-01-31"}]},
+        ]))
+
+        obj = models.Object.load("crm-2")
+        self.assertEqual(obj.form_set.get(field__name="priority").value, 10)
+        self.assertEqual(obj.form_set.get(field__name="title").value, "Ticket 1")
+        self.assertEqual(models.Object.objects.count(), 4)
+        self.assertEqual(models.Form.objects.count(), 13)
+
+    def test_post_query_count_does_not_grow_with_payload(self):
+        self.post(self.payload([{"fields": self.fields(i)} for i in range(2)]))
+
+        def count_queries(size):
+            objects = [{"fields": self.fields(i)} for i in range(size)]
+            objects += [{"human_id": f"crm-{i}", "fields": self.fields(i)} for i in (1, 2)]
+            models.service_names.refresh()
+
+            with CaptureQueriesContext(connection) as queries:
+                self.post(self.payload(objects))
+
+            return len(queries)
+
+        self.assertEqual(count_queries(5), count_queries(50))
+
+    def test_post_reports_unknown_objects_and_types(self):
+        response = self.post(self.payload([
+            {"human_id": "crm-42", "fields": []},
+            {"fields": [{"name": "colour", "type": "COLOUR", "value": "red"}]},
+        ]))
+
+        result = response.json()["result"]
+        self.assertEqual(result["errors"], ["COLOUR does not exist", "crm-42 does not exist in crm"])
+        self.assertEqual(result["created"], {"count": 1, "ids": [[1, 1]]})
+        self.assertEqual(result["updated"], {"count": 0, "ids": []})
+
+    def test_post_accepts_date_and_url_fields(self):
+        # every form type of FORM_TYPE_MAP is written, not only the five the endpoint started out with
+        response = self.post(self.payload([{"fields": [
+            {"name": "due", "type": models.Field.DATE, "value": "2024-01-31"},
+            {"name": "link", "type": models.Field.URL, "value": "https://example.com/tickets/1"},
+        ]}]))
+
+        self.assertEqual(response.json()["result"]["errors"], [])
+        obj = models.Object.objects.get()
+        self.assertEqual(models.DateForm.objects.get(object=obj).value, datetime.date(2024, 1, 31))
+        self.assertEqual(models.URLForm.objects.get(object=obj).value, "https://example.com/tickets/1")
+
+    def test_post_result_compresses_ids(self):
+        response = self.post(self.payload([{"fields": self.fields(i)} for i in range(5)]))
+        result = response.json()["result"]
+
+        self.assertEqual(result["created"], {"count": 5, "ids": [[1, 5]]})
+        self.assertEqual(set(result["timings_ms"]), {"read", "objects", "fields", "forms"})
+
+        response = self.client.post(
+            reverse("customer_api") + "?ids=false",
+            data={"service": "crm", "objects": [{"human_id": "crm-1"}, {"human_id": "crm-3"}]},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.json()["result"]["updated"], {"count": 2})
+
+    def test_post_caps_errors(self):
+        objects = [{"human_id": f"crm-{i}"} for i in range(1, ImportResult.MAX_ERRORS + 11)]
+
+        result = self.post(self.payload(objects)).json()["result"]
+
+        self.assertEqual(len(result["errors"]), ImportResult.MAX_ERRORS)
+        self.assertEqual(result["errors_omitted"], 10)
+
+    def test_post_streams_ndjson(self):
+        lines = [{"service": "crm"}] + [{"fields": self.fields(i)} for i in range(5)]
+        body = "\n".join(json.dumps(line) for line in lines)
+
+        with self.settings(CUSTOMER_API_CHUNK_SIZE=2):
+            response = self.client.post(reverse("customer_api"), data=body, content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.Object.objects.count(), 5)
+        self.assertEqual(models.Object.load("crm-5").form_set.get(field__name="priority").value, 4)
+
+    def test_post_streams_objects_in_chunks(self):
+        with self.settings(CUSTOMER_API_CHUNK_SIZE=2):
+            response = self.post(self.payload([{"fields": self.fields(i)} for i in range(5)]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.Object.objects.count(), 5)
+
+    def test_post_accepts_service_after_objects(self):
+        self.post({"objects": [{"fields": self.fields(1)}], "service": "crm"})
+
+        self.assertEqual(models.Object.load("crm-1").form_set.count(), 4)
+
+    def test_post_keeps_chunks_before_malformed_json(self):
+        body = json.dumps(self.payload([{"fields": self.fields(i)} for i in range(3)]))[:-10]
+
+        with self.settings(CUSTOMER_API_CHUNK_SIZE=1):
+            response = self.client.post(reverse("customer_api"), data=body, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(models.Object.objects.count(), 2)
+
+    def test_post_rejects_bodies_that_are_not_imports(self):
+        bodies = [
+            ("", "application/json"),
+            ("not json", "application/json"),
+            ("[]", "application/json"),
+            (b"\xff\xfe", "application/json"),
+            (json.dumps({"service": "crm", "objects": {"fields": []}}), "application/json"),
+            (json.dumps({"service": ["crm"], "objects": []}), "application/json"),
+            (json.dumps({"objects": [{"fields": []}, 5], "service": "crm"}), "application/json"),
+            ('{"service": "crm"}\n["crm-1"]\n', "application/x-ndjson"),
+            ('{"service": "crm"}\n{"fields": [\n', "application/x-ndjson"),
+        ]
+
+        for body, content_type in bodies:
+            with self.subTest(body=body):
+                response = self.client.post(reverse("customer_api"), data=body, content_type=content_type)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(len(response.json()["result"]["errors"]), 1)
+
+        self.assertEqual(models.Object.objects.count(), 0)
+
+
+class JSONStreamReaderTests(TestCase):
+    def test_values_cut_at_every_position(self):
+        body = '[1.5, 2e3, -1e-2, true, null, "caf\\u00e9 \\ud83d\\ude00 \\"bar\\"", {"a": [false]}]'
+
+        # one byte per chunk, every value is cut somewhere
+        reader = streaming.JSONStreamReader(io.BytesIO(body.encode()), chunk_size=1)
+
+        self.assertEqual(list(reader.array()), json.loads(body))
+
+    def test_syntax_error_is_raised_without_reading_the_rest(self):
+        tail = json.dumps([{"fields": [{"name": "title", "value": "x" * 100}]}] * 10000)
+        body = ('{"service": "crm", "objects": [{"fields": [1 2]}, ' + tail[1:] + "}").encode()
+        stream = io.BytesIO(body)
+
+        with self.assertRaises(json.JSONDecodeError):
+            list(streaming.read_json_import(stream)[1])
+
+        self.assertLessEqual(stream.tell(), streaming.DEFAULT_CHUNK_SIZE)
+        self.assertGreater(len(body), 10 * streaming.DEFAULT_CHUNK_SIZE)
+
+
+class IdSpansTests(TestCase):
+    def test_add_merges_spans(self):
+        ids = IdSpans()
+
+        for id_ in (1, 2, 3, 7, 5, 3, 9, 8, 4):
+            ids.add(id_)
+
+        self.assertEqual(ids.spans, [[1, 5], [7, 9]])
+        self.assertEqual(len(ids), 8)
+        self.assertEqual(list(ids), [1, 2, 3, 4, 5, 7, 8, 9])
+
+        ids.add(6)
+
+        self.assertEqual(ids.spans, [[1, 9]])
+
+
+class ObjectViewSetTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def ingest(self, name, count):
+        service = models.Service.objects.create(name=name, description=name)
+        rows = [{"SetName": f"Set {i}", "CardCount": i, "ReleaseDate": "2023-01-01"} for i in range(count)]
+        ingest.bulk_ingest(service, self.COLUMNS, rows)
+
+    def count_list_queries(self):
+        # the queries of building the response, not of serving it from the cache
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/objects/")
+
+        self.assertEqual(response.status_code, 200)
+
+        return len(queries), response.json()["results"]
+
+    def test_list_query_count_is_independent_of_rows(self):
+        self.ingest("sets", 2)
+        self.count_list_queries()  # warm the content type cache
+        small, _ = self.count_list_queries()
+
+        self.ingest("more-sets", 50)
+        large, objects = self.count_list_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(objects), 52)
+
+    def test_list_serializes_concrete_forms(self):
+        self.ingest("sets", 1)
+
+        _, objects = self.count_list_queries()
+
+        self.assertEqual(objects[0]["human_id"], "sets-1")
+        self.assertEqual(len(objects[0]["service"]["field_set"]), 3)
+        self.assertEqual(
+            sorted(str(form["value"]) for form in objects[0]["form_set"]),
+            ["0", "2023-01-01", "Set 0"],
+        )
+
+
+class FormLoadingTests(TestCase):
+    COLUMNS = ObjectViewSetTests.COLUMNS
+
+    def setUp(self):
+        ObjectViewSetTests.ingest(self, "sets", 3)
+        # warm the content type cache
+        self.client.get("/forms/")
+
+    def test_objects_read_forms_once_per_form_type(self):
+        # page, the services' fields, and one query per form type without any downcast
+        with self.assertNumQueries(2 + 3):
+            response = self.client.get("/objects/")
+
+        forms = response.json()["results"][2]["form_set"]
+        self.assertEqual(sorted(str(form["value"]) for form in forms), ["2", "2023-01-01", "Set 2"])
+
+    def test_forms_endpoint_loads_concrete_forms(self):
+        with self.assertNumQueries(1 + 3):
+            response = self.client.get("/forms/")
+
+        self.assertEqual(len(response.json()["results"]), 9)
+        self.assertIn(2, [form["value"] for form in response.json()["results"]])
+
+    def test_detail_loads_the_concrete_form(self):
+        form = models.DateForm.objects.first()
+
+        response = self.client.get(f"/forms/{form.pk}/")
+
+        self.assertEqual(response.json()["value"], "2023-01-01")
+
+
+class ResponseCacheTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        cache.clear()
+        self.sets = models.Service.objects.create(name="sets", description="Card sets")
+        self.cards = models.Service.objects.create(name="cards", description="Cards")
+        ingest.bulk_ingest(self.sets, self.COLUMNS, [{"SetName": "Set a", "CardCount": 1}])
+        ingest.bulk_ingest(self.cards, self.COLUMNS, [{"SetName": "Card a", "CardCount": 1}])
+
+    def get(self, url, data=None, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data, **headers)
+
+        return response, len(queries)
+
+    def test_repeated_reads_are_served_from_the_cache(self):
+        for url in ("/services/", "/fields/", "/objects/", f"/services/{self.sets.pk}/"):
+            with self.subTest(url):
+                first, _ = self.get(url)
+                second, queries = self.get(url)
+
+                self.assertEqual(second.json(), first.json())
+                self.assertEqual(queries, 0)
+
+    def test_etag_revalidation(self):
+        first, _ = self.get("/services/")
+
+        second, queries = self.get("/services/", HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(queries, 0)
+
+    def test_writes_invalidate_their_service(self):
+        self.get("/objects/", {"service": "sets"})
+        self.get("/objects/", {"service": "cards"})
+
+        # a bulk write without signals
+        ingest.bulk_ingest(self.sets, self.COLUMNS, [{"SetName": "Set b", "CardCount": 2}])
+
+        sets, queries = self.get("/objects/", {"service": "sets"})
+        self.assertGreater(queries, 0)
+        self.assertEqual(len(sets.json()["results"]), 2)
+
+        _, queries = self.get("/objects/", {"service": "cards"})
+        self.assertEqual(queries, 0)
+
+    def test_signals_and_purges_invalidate(self):
+        first, _ = self.get("/fields/")
+
+        models.Field.objects.create(service=self.cards, name="Rarity", form_type=models.Field.CHAR)
+        self.assertNotEqual(self.get("/fields/")[0]["ETag"], first["ETag"])
+
+        purge.purge_service(self.cards)
+        self.assertEqual([service["name"] for service in self.get("/services/")[0].json()["results"]], ["sets"])
+
+    def test_versions_move_forward(self):
+        before = response_cache.version(self.sets.pk)
+
+        response_cache.bump(self.sets.pk)
+
+        self.assertGreater(response_cache.version(self.sets.pk), before)
+
+
+class InstrumentationTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        cache.clear()
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+        ingest.bulk_ingest(self.service, self.COLUMNS, [{"SetName": f"Set {i}", "CardCount": i} for i in range(3)])
+
+    def test_fingerprint_folds_literals(self):
+        self.assertEqual(
+            instrumentation.fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b = 12 AND c IN (%s, %s, %s)"),
+            "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)",
+        )
+
+    def test_repeated_queries_are_reported(self):
+        with instrumentation.record_queries("n+1") as recorder:
+            for obj in models.Object.objects.all():
+                obj.service.name
+
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(list(recorder.duplicates().values()), [3])
+        self.assertEqual(recorder.summary()["queries"], 4)
+
+    def test_budget(self):
+        with self.assertRaises(instrumentation.QueryBudgetExceeded):
+            with instrumentation.record_queries("objects", budget=0):
+                list(models.Object.objects.all())
+
+    def test_responses_have_server_timing(self):
+        with self.assertLogs("core.instrumentation", "INFO") as logs:
+            response = self.client.get("/services/")
+
+        self.assertIn('desc="', response["Server-Timing"])
+        summary = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((summary["label"], summary["status"]), ("service-list", 200))
+
+    def test_endpoint_budget(self):
+        with self.settings(QUERY_BUDGETS={"service-list": 0}, QUERY_BUDGETS_RAISE=True):
+            with self.assertRaises(instrumentation.QueryBudgetExceeded):
+                self.client.get("/services/")
+
+        with self.settings(QUERY_BUDGETS={"service-detail": 0}):
+            with self.assertLogs("core.instrumentation", "WARNING"):
+                self.client.get(f"/services/{self.service.pk}/")
+
+    def test_customer_api_reports_its_queries(self):
+        payload = {"service": "crm", "objects": [{"fields": [{"name": "title", "type": models.Field.CHAR, "value": "a"}]}]}
+
+        result = self.client.post(reverse("customer_api"), data=payload, content_type="application/json").json()["result"]
+
+        self.assertGreater(result["queries"]["count"], 0)
+
+
+class ValueIndexTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+        schema.schemas.invalidate()
+        rows = [
+            {"SetName": f"Set {i}", "CardCount": i * 100, "ReleaseDate": datetime.date(2020 + i, 1, 1)}
+            for i in range(5)
+        ]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.bulk_ingest(self.service, self.COLUMNS, rows)
+
+    def counters(self, queryset):
+        return sorted(queryset.values_list("object_counter", flat=True))
+
+    def test_where_compares_typed_values(self):
+        where = models.Object.objects.where
+
+        self.assertEqual(self.counters(where(self.service, "CardCount", "gt", "200")), [4, 5])
+        self.assertEqual(self.counters(where(self.service, "ReleaseDate", "lte", "2021-06-01")), [1, 2])
+        self.assertEqual(self.counters(where(self.service, "SetName", "eq", "Set 3")), [4])
+        self.assertEqual(self.counters(where(self.service, "SetName", "startswith", "Set")), [1, 2, 3, 4, 5])
+        self.assertEqual(self.counters(where(self.service, "CardCount", "in", ["0", "400"])), [1, 5])
+
+    def test_where_finds_fields_added_by_another_process(self):
+        models.Object.objects.where(self.service, "CardCount", "gt", "200")
+        # bulk_create sends no signal, like a field saved by the bizrule command
+        (artist,) = models.Field.objects.bulk_create(
+            [models.Field(service=self.service, name="Artist", description="", form_type=models.Field.TEXT, order=4)]
+        )
+        models.TextForm.objects.create(object=models.Object.objects.get(object_counter=2), field=artist, value="Quinton")
+
+        self.assertEqual(self.counters(models.Object.objects.where(self.service, "Artist", "eq", "Quinton")), [2])
+
+    def test_where_seeks_the_value_index(self):
+        for field_name, index in (("CardCount", "core_integerform_value"), ("SetName", "core_textform_value_prefix")):
+            with self.subTest(field_name):
+                query = models.Object.objects.where(self.service, field_name, "gte", "1").query
+                sql, params = query.sql_with_params()
+
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                    plan = " ".join(str(row) for row in cursor.fetchall())
+
+                self.assertIn(index, plan)
+
+    def test_forms_written_one_by_one_copy_their_field(self):
+        field = models.Field.objects.get(service=self.service, name="CardCount")
+        form = models.IntegerForm.objects.create(object=models.Object.objects.first(), field=field, value=7)
+
+        self.assertEqual(models.IntegerForm.objects.get(pk=form.pk).value_field_id, field.pk)
+        self.assertFalse(models.TextForm.objects.filter(value_field=None).exists())
+
+    def test_objects_endpoint_filters_by_value(self):
+        response = self.client.get("/objects/", {"service": "sets", "CardCount__gte": "100", "SetName__lt": "Set 3"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([obj["human_id"] for obj in response.json()["results"]], ["sets-2", "sets-3"])
+
+    def test_objects_endpoint_rejects_bad_filters(self):
+        for params in (
+            {"CardCount__gt": "1"},
+            {"service": "missing", "CardCount__gt": "1"},
+            {"service": "sets", "Missing__gt": "1"},
+            {"service": "sets", "CardCount__gt": "many"},
+        ):
+            with self.subTest(params):
+                self.assertEqual(self.client.get("/objects/", params).status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    CONFIG = benchmarks.BenchmarkConfig(rows=30, fields=7, sizes=(10,), threads=0, processes=0, samples=3)
+
+    def test_synthetic_rows_cover_the_form_types(self):
+        columns = benchmarks.synthetic_columns(9)
+        rows = list(benchmarks.synthetic_rows(columns, 3, start=5))
+
+        self.assertEqual([column.form_type for column in columns[:7]], list(models.FORM_TYPE_MAP))
+        self.assertEqual(columns[7].form_type, models.Field.CHAR)
+        self.assertEqual([row["key"] for row in rows], ["row-5", "row-6", "row-7"])
+        self.assertIsInstance(rows[0]["Field5"], datetime.date)
+
+    def test_stub_api_pages(self):
+        columns = benchmarks.synthetic_columns(2)
+
+        with benchmarks.stub_api(columns, 200) as server:
+            first = requests.get(server.url).json()
+            last = requests.get(first["next_page"]).json()
+
+        self.assertEqual(len(first["data"]), benchmarks.PAGE_SIZE)
+        self.assertEqual((len(last["data"]), last["has_more"]), (200 - benchmarks.PAGE_SIZE, False))
+
+    def test_latency_percentiles(self):
+        summary = benchmarks.latency([i / 1000 for i in range(1, 101)])
+
+        self.assertEqual((summary["p50_ms"], summary["p95_ms"], summary["max_ms"]), (50, 95, 100))
+
+    def test_run(self):
+        report = benchmarks.run(self.CONFIG)
+        finished = datetime.datetime.now(datetime.timezone.utc)
+        results = report["results"]
+
+        # the timestamp is taken before the benchmarks, the total covers all of them
+        started = datetime.datetime.fromisoformat(report["started"])
+        self.assertLessEqual(started, finished - datetime.timedelta(seconds=report["elapsed_s"] - 0.001))
+        self.assertGreaterEqual(report["elapsed_s"], sum(result["elapsed_s"] for result in results.values()) - 0.01)
+
+        self.assertEqual(results["ingest"]["created"]["result"]["created"], 30)
+        self.assertEqual(results["ingest"]["unchanged"]["result"]["unchanged"], 30)
+        self.assertEqual(results["customer_api"]["updated"]["rows"], 30)
+        self.assertEqual(results["load"]["samples"], 3)
+        self.assertEqual(results["object_list"]["10"]["cached"]["samples"], 3)
+        json.dumps(results)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        for name in ("sets", "comics"):
+            service = models.Service.objects.create(name=name, description=name)
+            ingest.bulk_ingest(service, [], [{} for _ in range(4)])
+
+    def walk(self, url, direction="next"):
+        human_ids = []
+
+        while url:
+            page = self.client.get(url).json()
+            human_ids.extend(obj["human_id"] for obj in page["results"])
+            url = page[direction]
+
+        return human_ids
+
+    def test_pages_follow_service_and_counter_order(self):
+        expected = [f"sets-{i}" for i in range(1, 5)] + [f"comics-{i}" for i in range(1, 5)]
+
+        self.assertEqual(self.walk("/objects/?page_size=3"), expected)
+
+    def test_previous_links_walk_back(self):
+        page = self.client.get("/objects/?page_size=3").json()
+        page = self.client.get(page["next"]).json()
+        page = self.client.get(page["next"]).json()
+
+        self.assertEqual([obj["human_id"] for obj in page["results"]], ["comics-3", "comics-4"])
+        self.assertIsNone(page["next"])
+
+        previous = self.client.get(page["previous"]).json()
+
+        self.assertEqual([obj["human_id"] for obj in previous["results"]], ["sets-4", "comics-1", "comics-2"])
+        self.assertIsNotNone(previous["next"])
+
+    def test_rows_added_between_pages_neither_shift_nor_repeat(self):
+        page = self.client.get("/objects/?page_size=4").json()
+        models.Object(service=models.Service.objects.get(name="sets")).save()
+
+        self.assertEqual(self.walk(page["next"]), ["sets-5"] + [f"comics-{i}" for i in range(1, 5)])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/objects/?cursor=nonsense").status_code, 404)
+
+    def test_cursor_with_wrongly_typed_values(self):
+        keys = {
+            "/services/": [["x"], [None], [["a"]], [{"a": 1}]],
+            "/fields/": [["x"], [None]],
+            "/forms/": [[["a"]], [{"a": 1}]],
+            "/objects/": [["x", "y", "z"], [1, None, 1], [1, 2, [3]]],
+        }
+
+        for url, cursors in keys.items():
+            for key in cursors:
+                with self.subTest(url=url, key=key):
+                    cursor = base64.urlsafe_b64encode(json.dumps({"k": key}).encode()).decode("ascii")
+
+                    self.assertEqual(self.client.get(url, {"cursor": cursor}).status_code, 404)
+
+
+class ServiceTableTests(TestCase):
+    COLUMNS = BulkIngestTests.COLUMNS
+
+    def setUp(self):
+        self.service = models.Service.objects.create(name="sets", description="Card sets")
+        schema.schemas.invalidate()
+        rows = [
+            {"SetName": "Alpha", "CardCount": 295, "ReleaseDate": "1993-08-05"},
+            {"SetName": "Beta", "CardCount": 302},
+        ]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.bulk_ingest(self.service, self.COLUMNS, rows)
+
+        # noise from another service must not leak into the table
+        other = models.Service.objects.create(name="comics", description="Comics")
+        ingest.bulk_ingest(other, self.COLUMNS, rows)
+
+    def get(self, output):
+        response = self.client.get(f"/services/sets/table/?format={output}")
+        self.assertEqual(response.status_code, 200)
+
+        return b"".join(response.streaming_content).decode()
+
+    def test_json(self):
+        table = json.loads(self.get("json"))
+
+        self.assertEqual(table["columns"], ["human_id", "SetName", "CardCount", "ReleaseDate"])
+        self.assertEqual(table["rows"], [["sets-1", "Alpha", 295, "1993-08-05"], ["sets-2", "Beta", 302, None]])
+
+    def test_json_lines(self):
+        rows = [json.loads(line) for line in self.get("jsonl").splitlines()]
+
+        self.assertEqual(rows[1], {"human_id": "sets-2", "SetName": "Beta", "CardCount": 302, "ReleaseDate": None})
+
+    def test_csv(self):
+        self.assertEqual(
+            self.get("csv").splitlines(),
+            ["human_id,SetName,CardCount,ReleaseDate", "sets-1,Alpha,295,1993-08-05", "sets-2,Beta,302,"],
+        )
+
+    def test_fields_added_by_another_process(self):
+        self.get("json")
+        # bulk_create sends no signal, like a field saved by the bizrule command
+        models.Field.objects.bulk_create(
+            [models.Field(service=self.service, name="Artist", description="", form_type=models.Field.TEXT, order=4)]
+        )
+
+        self.assertEqual(json.loads(self.get("json"))["columns"][-1], "Artist")
+
+    def test_one_query_per_form_type(self):
+        models.service_names.refresh()
+
+        # service, fields, objects and one query per form type
+        with self.assertNumQueries(3 + 3):
+            self.get("json")
+
+    def test_unknown_service(self):
+        self.assertEqual(self.client.get("/services/nope/table/").status_code, 404)
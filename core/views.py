@@ -1,21 +1,124 @@
+import bisect
+import contextlib
 import json
+import time
+from typing import Optional
 
+from django.conf import settings
+from django.db import transaction
 from django.views.generic import View
-from django.http import JsonResponse, HttpResponseNotAllowed
+from django.http import JsonResponse, HttpResponseNotAllowed, StreamingHttpResponse
 
-from . import models
+from . import ingest, models, streaming
+from .instrumentation import QueryRecorder, record_queries
+from .schema import FieldSpec, schemas
+from .table import ServiceTable
 
 
-class ImportResult:
+class IdSpans:
+    """
+    A set of ids stored as sorted ``[first, last]`` spans, so a run of
+    consecutive ids costs the same as a single one.
+    """
     def __init__(self):
+        self.spans: list[list[int]] = []
+        self.count = 0
+
+    def add(self, id_: int) -> None:
+        spans = self.spans
+
+        # ids normally arrive in ascending order, so most adds extend the last span
+        if spans and spans[-1][0] <= id_ <= spans[-1][1] + 1:
+            if id_ > spans[-1][1]:
+                spans[-1][1] = id_
+                self.count += 1
+
+            return
+
+        index = bisect.bisect_left(spans, [id_ + 1])
+
+        if index and spans[index - 1][1] >= id_:
+            return
+
+        spans.insert(index, [id_, id_])
+        self.count += 1
+
+        # merge with the neighbouring spans when the new id closes a gap
+        if index + 1 < len(spans) and spans[index + 1][0] == id_ + 1:
+            spans[index][1] = spans.pop(index + 1)[1]
+
+        if index and spans[index - 1][1] == id_ - 1:
+            spans[index - 1][1] = spans.pop(index)[1]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for first, last in self.spans:
+            yield from range(first, last + 1)
+
+
+class ImportResult:
+    MAX_ERRORS = 100
+
+    def __init__(self, include_ids: bool = True, max_errors: int = MAX_ERRORS):
         self.created = 0
         self.updated = 0
         self.errors = []
+        self.errors_omitted = 0
+        self.max_errors = max_errors
 
         self.service_id = 0
 
-        self.ticket_ids = []
-        self.updated_ticket_ids = []
+        self.include_ids = include_ids
+        self.ticket_ids = IdSpans()
+        self.updated_ticket_ids = IdSpans()
+
+        self.timings: dict[str, float] = {}
+        self.queries: Optional[QueryRecorder] = None
+
+    def add_created(self, ticket_id: int) -> None:
+        self.created += 1
+        self.ticket_ids.add(ticket_id)
+
+    def add_updated(self, ticket_id: int) -> None:
+        self.updated += 1
+        self.updated_ticket_ids.add(ticket_id)
+
+    def add_error(self, error: str) -> None:
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+        else:
+            self.errors_omitted += 1
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def as_dict(self) -> dict:
+        created = {"count": self.created}
+        updated = {"count": self.updated}
+
+        if self.include_ids:
+            created["ids"] = self.ticket_ids.spans
+            updated["ids"] = self.updated_ticket_ids.spans
+
+        return {
+            "service": self.service_id,
+            "created": created,
+            "updated": updated,
+            "errors": self.errors,
+            "errors_omitted": self.errors_omitted,
+            "timings_ms": {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()},
+            **({"queries": {"count": self.queries.count, "sql_ms": round(self.queries.sql_time * 1000, 3)}} if self.queries else {}),
+        }
 
     def __str__(self):
         if self.errors:
@@ -23,8 +126,8 @@ class ImportResult:
 
         return ', '.join([
             f"Service: {self.service_id}",
-            f"tickets created: {self.created} ({self.ticket_ids})",
-            f"updated: {self.updated} ({self.updated_ticket_ids})",
+            f"tickets created: {self.created} ({self.ticket_ids.spans})",
+            f"updated: {self.updated} ({self.updated_ticket_ids.spans})",
         ])
 
 
@@ -32,70 +135,129 @@ class CustomerAPI(View):
     def get(self, request, *args, **kwargs):
         return HttpResponseNotAllowed(["POST"])
 
-    def build_ticket(self, service: models.Service, obj: models.Object, payload: dict, result: ImportResult) -> JsonResponse:
-        for field_data in payload.get("fields", []):
-            lookup = {k:v for k, v in {
-                "object": obj,
-                "name": field_data["name"],
-                "form_type": field_data.get("type"),
-                "description": field_data.get("description"),
-            }.items() if v}
-
-            field, _ = models.Field.objects.get_or_create(**lookup)
-
-            if field.form_type == models.Field.CHAR:
-                form, _ = models.CharacterForm.objects.get_or_create(object=obj, field=field)
-                form.value = field_data["value"]
-                form.save()
-
-            elif field.form_type == models.Field.TEXT:
-                form, _ = models.TextForm.objects.get_or_create(object=obj, field=field)
-                form.value = field_data["value"]
-                form.save()
-
-            elif field.form_type == models.Field.INTEGER:
-                form, _ = models.IntegerForm.objects.get_or_create(object=obj, field=field)
-                form.value = field_data["value"]
-                form.save()
-
-            elif field.form_type == models.Field.FLOAT:
-                form, _ = models.FloatForm.objects.get_or_create(object=obj, field=field)
-                form.value = field_data["value"]
-                form.save()
-
-            elif field.form_type == models.Field.BOOLEAN:
-                form, _ = models.BooleanForm.objects.get_or_create(object=obj, field=field)
-                form.value = field_data["value"]
-                form.save()
+    def resolve_fields(self, service: models.Service, payloads: list[dict], result: ImportResult) -> dict:
+        """
+        Maps every ``(name, type)`` referenced by the payloads to a Field of the
+        service, from the cached schema with one bulk insert for the missing
+        ones.
+        """
+        specs = [
+            FieldSpec(field_data["name"], field_data.get("type"), field_data.get("description") or "")
+            for payload in payloads
+            for field_data in payload.get("fields", [])
+        ]
+        resolved = schemas.resolve(service, specs)
+
+        for name, form_type in dict.fromkeys((name, form_type) for name, form_type, _ in specs):
+            if (name, form_type) not in resolved:
+                result.add_error(f"{form_type} does not exist")
+
+        return resolved
+
+    def write_objects(self, service: models.Service, payloads: list[dict], result: ImportResult) -> None:
+        with result.phase("objects"):
+            existing = models.Object.load_many(payload["human_id"] for payload in payloads if "human_id" in payload)
+            created = iter(ingest.create_objects(service, sum("human_id" not in payload for payload in payloads)))
+
+        with result.phase("fields"):
+            fields = self.resolve_fields(service, payloads, result)
+
+        cells = []
+
+        for payload in payloads:
+            if "human_id" in payload:
+                obj = existing.get(payload["human_id"])
+
+                if obj is None or obj.service_id != service.id:
+                    result.add_error(f"{payload['human_id']} does not exist in {service}")
+                    continue
+
+                result.add_updated(obj.id)
 
             else:
-                result.errors += f"{field.form_type} does not exist"
+                obj = next(created)
+                result.add_created(obj.id)
 
+            for field_data in payload.get("fields", []):
+                field = fields.get((field_data["name"], field_data.get("type")))
+
+                if field is not None:
+                    cells.append((obj, field, field_data["value"]))
+
+        with result.phase("forms"):
+            ingest.bulk_upsert_forms(cells)
 
     def post(self, request, *args, **kwargs):
-        json_payload = json.loads(request.body)
+        # ?ids=false leaves the created / updated id spans out of the response
+        import_result = ImportResult(include_ids=request.GET.get("ids", "true").lower() not in ("0", "false", "no"))
 
-        if not json_payload.get("service"):
-            return JsonResponse({"msg": "Error: No service provided!"})
+        try:
+            # the body is read as a stream, so only one chunk of objects is held in memory at a time
+            if request.content_type == "application/x-ndjson":
+                service_name, payloads = streaming.read_ndjson_import(request, request.GET.get("service"))
 
-        service_name = json_payload["service"]
-        service, _ = models.Service.objects.get_or_create(name=service_name)
+            else:
+                service_name, payloads = streaming.read_json_import(request, request.GET.get("service"))
 
-        import_result = ImportResult()
-        import_result.service_id = service.id
+            if not service_name:
+                return JsonResponse({"msg": "Error: No service provided!"})
 
-        for payload in json_payload.get("objects"):
-            if "human_id" in payload:
-                obj = models.Object.load(payload['human_id'])
-                import_result.updated += 1
-                import_result.updated_ticket_ids.append(obj.id)
+            service, _ = models.Service.objects.get_or_create(name=service_name)
+            import_result.service_id = service.id
 
-            else:
-                obj = models.Object(service=service)
-                obj.save()
-                import_result.created += 1
-                import_result.ticket_ids.append(obj.id)
+            chunk_size = getattr(settings, "CUSTOMER_API_CHUNK_SIZE", ingest.DEFAULT_BATCH_SIZE)
+            chunks = ingest.batched(payloads, chunk_size)
+
+            with record_queries(f"customer-api:{service_name}") as import_result.queries:
+                while True:
+                    with import_result.phase("read"):
+                        chunk = next(chunks, None)
+
+                    if chunk is None:
+                        break
+
+                    # every cell of a chunk is written with a handful of queries per form type
+                    with transaction.atomic():
+                        self.write_objects(service, chunk, import_result)
+
+        # chunks before the malformed part of the body are already committed
+        except (json.JSONDecodeError, UnicodeDecodeError) as ex:
+            import_result.add_error(f"Invalid JSON: {ex}")
+
+            return JsonResponse({"result": import_result.as_dict()}, status=400)
+
+        except streaming.ImportFormatError as ex:
+            import_result.add_error(f"Invalid import: {ex}")
+
+            return JsonResponse({"result": import_result.as_dict()}, status=400)
+
+        return JsonResponse({"result": import_result.as_dict()})
+
+
+class ServiceTableView(View):
+    # ?format= -> (ServiceTable method, content type)
+    FORMATS = {
+        "json": ("iter_json", "application/json"),
+        "jsonl": ("iter_json_lines", "application/x-ndjson"),
+        "csv": ("iter_csv", "text/csv"),
+    }
+
+    def get(self, request, name, *args, **kwargs):
+        output = request.GET.get("format", "json")
+
+        if output not in self.FORMATS:
+            return JsonResponse({"msg": f"Error: Unknown format {output}, expected one of {list(self.FORMATS)}"}, status=400)
+
+        service_id = models.service_names.get(name) or models.service_names.refresh().get(name)
+
+        if service_id is None:
+            return JsonResponse({"msg": f"Error: No service named {name}"}, status=404)
+
+        table = ServiceTable(models.Service.objects.get(pk=service_id))
+        method, content_type = self.FORMATS[output]
+        response = StreamingHttpResponse(getattr(table, method)(), content_type=content_type)
 
-            self.build_ticket(service, obj, payload, import_result)
+        if output == "csv":
+            response["Content-Disposition"] = f'attachment; filename="{name}.csv"'
 
-        return JsonResponse({"result": str(import_result)})
+        return response
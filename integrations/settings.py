@@ -50,6 +50,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.instrumentation.QueryInstrumentationMiddleware",
 ]
 
 ROOT_URLCONF = "integrations.urls"
@@ -130,5 +131,85 @@ REST_FRAMEWORK = {
     # or allow read-only access for unauthenticated users.
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
-    ]
+    ],
+    # keyset pagination, ordered by each viewset's ``keyset_ordering`` (pk by default)
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Number of rows the biz_rule ingestion writes per bulk insert / transaction
+INGEST_BATCH_SIZE = 500
+
+# Number of objects the customer API writes per transaction while streaming a payload
+CUSTOMER_API_CHUNK_SIZE = 500
+
+# bizrule API calls: how many run at once, and the timeout (seconds) of each source
+BIZRULE_MAX_WORKERS = 4
+BIZRULE_TIMEOUT = 30
+BIZRULE_TIMEOUTS = {
+    "marvel": 60,
+}
+
+# on-disk cache of the bizrule API responses, revalidated with ETag/Last-Modified.
+# MAX_AGE (seconds) reuses a response without asking the API, None follows its Cache-Control
+BIZRULE_HTTP_CACHE = {
+    "DIR": BASE_DIR / ".http_cache",
+    "MAX_AGE": None,
+    "MAX_SIZE": 256 * 1024 * 1024,
+}
+
+# batches waiting between two stages of the ingest pipeline (fetch -> convert -> write)
+INGEST_PIPELINE_QUEUE_SIZE = 4
+
+# shared HTTP client of the bizrule sources: requests per second per host, retries of
+# connection errors, 429 and 5xx with exponential backoff (seconds), and connections kept per host
+BIZRULE_HTTP = {
+    "RATE_LIMITS": {
+        "api.scryfall.com": 10,
+    },
+    "DEFAULT_RATE": None,
+    "MAX_RETRIES": 5,
+    "BACKOFF": 0.5,
+    "MAX_BACKOFF": 30.0,
+    "POOL_SIZE": 10,
+}
+
+# serialized responses of the read endpoints, see core.response_cache. The bizrule command only
+# invalidates the web workers' entries through a cache they share, use a file, memcached or Redis
+# backend when they run as separate processes
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+
+RESPONSE_CACHE = {
+    "ALIAS": "default",
+    "TIMEOUT": 60,
+}
+
+# most queries a request to each endpoint (view name) may run, see core.instrumentation.
+# An overrun is logged as a warning, QUERY_BUDGETS_RAISE turns it into an error (for tests)
+QUERY_BUDGETS = {
+    "service-list": 2,
+    "service-detail": 2,
+    "field-list": 1,
+    "field-detail": 1,
+    # page, the services' fields and one query per form type
+    "object-list": 2 + 7,
+    "object-detail": 2 + 7,
+    "form-list": 1 + 7,
+}
+QUERY_BUDGETS_RAISE = False
+
+# core.instrumentation logs a JSON line per request (and bizrule source) at INFO, lower the level to see them
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "core.instrumentation": {"handlers": ["console"], "level": "WARNING"},
+    },
 }
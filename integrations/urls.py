@@ -18,6 +18,10 @@ from django.urls import path, include
 from rest_framework import routers, serializers, viewsets
 
 from core import models
+from core.filters import SERVICE_PARAM, FieldValueFilter
+from core.loading import concrete_forms, prefetch_forms
+from core.response_cache import CachedResponseMixin
+from core.views import ServiceTableView
 
 
 class FieldSerializer(serializers.HyperlinkedModelSerializer):
@@ -25,7 +29,7 @@ class FieldSerializer(serializers.HyperlinkedModelSerializer):
         model = models.Field
         fields = "__all__"
 
-class FieldViewSet(viewsets.ModelViewSet):
+class FieldViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = models.Field.objects.all()
     serializer_class = FieldSerializer
 
@@ -38,16 +42,26 @@ class FormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class FormViewSet(viewsets.ModelViewSet):
-    queryset = models.Form.objects.all()
+    # the page is read from core_form with the fields, then each form type's table once,
+    # instead of downcasting by content type
+    queryset = models.Form.objects.published().non_polymorphic().select_related("field")
     serializer_class = FormSerializer
 
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+
+        return concrete_forms(page) if page is not None else None
+
+    def get_object(self):
+        return concrete_forms([super().get_object()])[0]
+
 class IntegerFormSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = models.IntegerForm
         fields = ["object", "field", "value"]
 
 class IntegerFormViewSet(viewsets.ModelViewSet):
-    queryset = models.IntegerForm.objects.all()
+    queryset = models.IntegerForm.objects.published()
     serializer_class = IntegerFormSerializer
 
 class FloatFormSerializer(serializers.HyperlinkedModelSerializer):
@@ -56,7 +70,7 @@ class FloatFormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class FloatFormViewSet(viewsets.ModelViewSet):
-    queryset = models.FloatForm.objects.all()
+    queryset = models.FloatForm.objects.published()
     serializer_class = FloatFormSerializer
 
 class CharacterFormSerializer(serializers.HyperlinkedModelSerializer):
@@ -65,7 +79,7 @@ class CharacterFormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class CharacterFormViewSet(viewsets.ModelViewSet):
-    queryset = models.CharacterForm.objects.all()
+    queryset = models.CharacterForm.objects.published()
     serializer_class = CharacterFormSerializer
 
 class TextFormSerializer(serializers.HyperlinkedModelSerializer):
@@ -74,7 +88,7 @@ class TextFormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class TextFormViewSet(viewsets.ModelViewSet):
-    queryset = models.TextForm.objects.all()
+    queryset = models.TextForm.objects.published()
     serializer_class = TextFormSerializer
 
 class BooleanFormSerializer(serializers.HyperlinkedModelSerializer):
@@ -83,7 +97,7 @@ class BooleanFormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class BooleanFormViewSet(viewsets.ModelViewSet):
-    queryset = models.BooleanForm.objects.all()
+    queryset = models.BooleanForm.objects.published()
     serializer_class = BooleanFormSerializer
 
 class DateFormSerializer(serializers.HyperlinkedModelSerializer):
@@ -92,7 +106,7 @@ class DateFormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class DateFormViewSet(viewsets.ModelViewSet):
-    queryset = models.DateForm.objects.all()
+    queryset = models.DateForm.objects.published()
     serializer_class = DateFormSerializer
 
 class URLFormSerializer(serializers.HyperlinkedModelSerializer):
@@ -101,7 +115,7 @@ class URLFormSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["object", "field", "value"]
 
 class URLFormViewSet(viewsets.ModelViewSet):
-    queryset = models.URLForm.objects.all()
+    queryset = models.URLForm.objects.published()
     serializer_class = URLFormSerializer
 
 class ServiceSerializer(serializers.HyperlinkedModelSerializer):
@@ -111,8 +125,8 @@ class ServiceSerializer(serializers.HyperlinkedModelSerializer):
         model = models.Service
         fields = ["name", "description", "field_set"]
 
-class ServiceViewSet(viewsets.ModelViewSet):
-    queryset = models.Service.objects.all()
+class ServiceViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    queryset = models.Service.objects.prefetch_related("field_set")
     serializer_class = ServiceSerializer
 
 class ObjectSerializer(serializers.HyperlinkedModelSerializer):
@@ -123,9 +137,29 @@ class ObjectSerializer(serializers.HyperlinkedModelSerializer):
         model = models.Object
         fields = ["pk", "human_id", "service", "form_set"]
 
-class ObjectViewSet(viewsets.ModelViewSet):
-    queryset = models.Object.objects.all()
+class ObjectViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    # service, its fields and the concrete forms are loaded for the whole page up front
+    # instead of once per object, objects of unpublished imports are left out
+    queryset = models.Object.objects.published().select_related("service").prefetch_related("service__field_set")
     serializer_class = ObjectSerializer
+    keyset_ordering = ("service_id", "object_counter", "pk")
+    # ?service=<name>&<field>__<op>=<value>
+    filter_backends = [FieldValueFilter]
+
+    # a listing of one service is cached under that service's version
+    def cache_service_id(self, request):
+        name = request.query_params.get(SERVICE_PARAM)
+
+        return models.service_names.get(name) if name and self.action == "list" else None
+
+    # the forms are read from the tables of the form types of the services' fields
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+
+        return prefetch_forms(page) if page is not None else None
+
+    def get_object(self):
+        return prefetch_forms([super().get_object()])[0]
 
 
 router = routers.DefaultRouter()
@@ -144,6 +178,7 @@ router.register("fields", FieldViewSet)
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("customer-api/", include("core.urls")),
+    path("services/<str:name>/table/", ServiceTableView.as_view(), name="service_table"),
     path("", include(router.urls)),
     path("api/", include("rest_framework.urls")),
 ]